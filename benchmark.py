@@ -0,0 +1,345 @@
+"""قياس أداء السلسلة كاملة بدون إنترنت
+
+يشغّل خادم HTTP محلياً يقدّم: خلاصة RSS ثابتة، صفحات وصفات بأسلوب WordPress،
+نقطتا generateContent وstreamGenerateContent (SSE) مزيفتان بزمن استجابة
+قابل للضبط، ومحرر Medium مبسّط
+بنفس عناصر data-testid التي يعتمد عليها main.py.
+ثم يشغّل main.main() ضده ويطبع أزمنة كل مرحلة (من سجل التتبع) بصيغة JSON.
+
+أمثلة:
+    python benchmark.py --posts 3 --gemini-latency 0.5
+    python benchmark.py --runs 5 --output bench.json
+    python benchmark.py --with-api              # مسار النشر عبر /v1/users/{id}/posts
+    python benchmark.py --with-api --split      # prepare ثم publish من الطابور (زمن النشر وحده)
+    python benchmark.py --with-browser          # يتطلب Chrome لتجربة مسار النشر
+    BROWSER_BACKEND=cdp python benchmark.py --with-browser   # نفس المسار عبر CDP بدون chromedriver
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import statistics
+import struct
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# ====== بيانات الاختبار الثابتة ======
+RECIPES = [
+    ("pecan-pie-lasagna", "Pecan Pie Lasagna"),
+    ("coconut-limeade", "Coconut Limeade"),
+    ("baklava-cheesecake-cookies", "Baklava Cheesecake Cookies"),
+    ("cinnamon-toast-bites", "Cinnamon Toast Bites"),
+    ("lemon-garlic-salmon", "Lemon Garlic Salmon"),
+    ("chocolate-banana-bread", "Chocolate Banana Bread"),
+]
+
+FAKE_GEMINI_RESULT = {
+    "new_title": "A Benchmark Recipe Everyone Will Want to Make Tonight",
+    "new_html_content": (
+        "<p>An introduction paragraph for the benchmark article.</p>"
+        "INSERT_IMAGE_1_HERE INSERT_MID_CTA_HERE"
+        "<h2>Why it works</h2><ul><li>Simple</li><li>Fast</li></ul>"
+        "INSERT_IMAGE_2_HERE<h3>Tips</h3><p>Serve warm.</p>"
+    ),
+    "tags": ["Recipe", "Food", "Cooking", "Dessert", "Baking"],
+    "caption1": "Getting everything ready",
+    "caption2": "The finished dish",
+}
+
+FAKE_EDITOR_HTML = """<!doctype html>
+<html><head><title>New story</title></head><body>
+<button data-action="show-prepublish">Publish</button>
+<h3 data-testid="editorTitleParagraph" contenteditable="true"></h3>
+<article><p data-testid="editorParagraphText" contenteditable="true"></p></article>
+<div id="prepublish" style="display:none">
+  <label><input type="radio" name="when" checked> Publish now</label>
+  <div data-testid="publishTopicsInput"><input placeholder="Add a topic..."></div>
+  <div id="topics"></div>
+  <button data-testid="publishConfirmButton">Publish now</button>
+</div>
+<script>
+const story = document.querySelector('[data-testid="editorParagraphText"]');
+story.addEventListener('paste', (event) => {
+    event.preventDefault();
+    story.innerHTML = event.clipboardData.getData('text/html') || event.clipboardData.getData('text/plain');
+});
+document.querySelector('[data-action="show-prepublish"]').addEventListener('click', () => {
+    setTimeout(() => { document.getElementById('prepublish').style.display = 'block'; }, 150);
+});
+document.querySelector('#prepublish input[placeholder]').addEventListener('keydown', (event) => {
+    if (event.key === 'Enter') {
+        const chip = document.createElement('span');
+        chip.textContent = event.target.value;
+        document.getElementById('topics').appendChild(chip);
+        event.target.value = '';
+    }
+});
+document.querySelector('[data-testid="publishConfirmButton"]').addEventListener('click', () => {
+    setTimeout(() => { location.href = '/@bench/benchmark-story-123?source=published'; }, 200);
+});
+</script>
+</body></html>"""
+
+def make_jpeg(width, height):
+    """ملف JPEG صغير يحمل أبعاداً حقيقية في ترويسة SOF0 (بدون بيانات صورة فعلية)"""
+    sof0 = b"\xff\xc0" + struct.pack(">HBHHB", 11, 8, height, width, 1) + b"\x01\x11\x00"
+    return b"\xff\xd8" + sof0 + b"\x00" * 2048 + b"\xff\xd9"
+
+def make_feed(base_url, count):
+    items = []
+    for slug, title in RECIPES[:count]:
+        link = f"{base_url}/recipes/{slug}"
+        items.append(f"""<item><title>{title}</title><link>{link}</link>
+<description>&lt;p&gt;{title} is an easy recipe with simple ingredients.&lt;/p&gt;</description>
+<media:content url="{base_url}/wp-content/uploads/{slug}-featured.jpg" medium="image"/></item>""")
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0" xmlns:media="http://search.yahoo.com/mrss/"><channel>
+<title>Benchmark Recipes</title><link>{base_url}</link>
+{''.join(items)}
+</channel></rss>"""
+
+def make_article(base_url, slug, title):
+    images = "".join(
+        f'<figure><img src="data:image/gif;base64,R0lGODlhAQABAAAAACw=" '
+        f'data-lazy-src="{base_url}/wp-content/uploads/{slug}-{i}.jpg" alt="{title} step {i}" width="1200"></figure>'
+        for i in range(1, 5)
+    )
+    recipe = {
+        "@context": "https://schema.org",
+        "@graph": [
+            {"@type": "WebPage", "name": title},
+            {
+                "@type": "Recipe",
+                "name": title,
+                "description": f"A reader favourite: {title}, made with pantry staples.",
+                "prepTime": "PT20M", "cookTime": "PT45M", "totalTime": "PT1H5M",
+                "recipeYield": ["12", "12 servings"],
+                "recipeIngredient": [f"{n} cup ingredient {n}" for n in range(1, 11)],
+                "recipeInstructions": [
+                    {"@type": "HowToStep", "text": f"Step {n}: combine, stir and bake until golden for {title}."}
+                    for n in range(1, 8)
+                ],
+            },
+        ],
+    }
+    return f"""<!doctype html><html><head>
+<script type="application/ld+json">{json.dumps(recipe)}</script>
+</head><body>
+<header><img src="{base_url}/wp-content/uploads/logo.png" alt="logo"></header>
+<article class="article"><h1>{title}</h1><p>Ingredients and steps for {title}.</p>{images}</article>
+<aside><img src="{base_url}/wp-content/uploads/author-avatar.jpg" alt="author"></aside>
+</body></html>"""
+
+class BenchmarkHandler(BaseHTTPRequestHandler):
+    """يقدّم الخلاصة والصفحات وGemini المزيف ومحرر Medium المزيف"""
+    server_version = "AutoposterBench/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type, status=200):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        config = self.server.bench_config
+        path = urlsplit(self.path).path
+        base_url = config["base_url"]
+
+        if path == "/feed":
+            return self.send_body(make_feed(base_url, config["posts"]), "application/rss+xml")
+        if path.startswith("/recipes/"):
+            slug = path.rsplit("/", 1)[-1]
+            titles = dict(RECIPES)
+            if slug in titles:
+                time.sleep(config["page_latency"])
+                return self.send_body(make_article(base_url, slug, titles[slug]), "text/html; charset=utf-8")
+        if path.startswith("/wp-content/uploads/"):
+            return self.send_body(make_jpeg(1200, 800), "image/jpeg")
+        if path in ("/", "/new-story"):
+            return self.send_body(FAKE_EDITOR_HTML, "text/html; charset=utf-8")
+        if path == "/v1/me":
+            return self.send_body(json.dumps({"data": {"id": "bench-user", "username": "bench"}}), "application/json")
+        if path.startswith("/@bench/"):
+            return self.send_body("<html><body><h1>Published</h1></body></html>", "text/html")
+        self.send_body("not found", "text/plain", status=404)
+
+    def do_POST(self):
+        config = self.server.bench_config
+        path = urlsplit(self.path).path
+        length = int(self.headers.get("Content-Length") or 0)
+        body_bytes = self.rfile.read(length)
+
+        if path.startswith("/v1beta/models/") and path.endswith(":generateContent"):
+            time.sleep(config["gemini_latency"])
+            text = "```json\n" + json.dumps(FAKE_GEMINI_RESULT) + "\n```"
+            body = {
+                "candidates": [{"content": {"parts": [{"text": text}]}}],
+                "usageMetadata": {"promptTokenCount": 600, "candidatesTokenCount": 900, "totalTokenCount": 1500},
+            }
+            return self.send_body(json.dumps(body), "application/json")
+        if path == "/v1/users/bench-user/posts":
+            post = json.loads(body_bytes)
+            time.sleep(config["page_latency"])
+            slug = "-".join(post["title"].lower().split()[:6])
+            data = {"id": slug, "title": post["title"], "url": f"{config['base_url']}/@bench/{slug}", "publishStatus": post.get("publishStatus")}
+            return self.send_body(json.dumps({"data": data}), "application/json", status=201)
+        if path == "/v1/images":
+            if b'name="image"' not in body_bytes:
+                return self.send_body(json.dumps({"errors": [{"message": "image field missing"}]}), "application/json", status=400)
+            time.sleep(config["page_latency"])
+            digest = hashlib.md5(body_bytes).hexdigest()
+            data = {"url": f"{config['base_url']}/wp-content/uploads/medium-{digest}.jpeg", "md5": digest}
+            return self.send_body(json.dumps({"data": data}), "application/json", status=201)
+        if path.startswith("/v1beta/models/") and path.endswith(":streamGenerateContent"):
+            return self.send_stream(config["gemini_latency"])
+        self.send_body("not found", "text/plain", status=404)
+
+    def send_stream(self, latency, chunks=8):
+        """رد SSE مقسّم: الزمن الكلي نفس latency موزعاً على الدفعات"""
+        text = "```json\n" + json.dumps(FAKE_GEMINI_RESULT) + "\n```"
+        size = -(-len(text) // chunks)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for index in range(chunks):
+            time.sleep(latency / chunks)
+            event = {"candidates": [{"content": {"parts": [{"text": text[index * size:(index + 1) * size]}]}}]}
+            if index == chunks - 1:
+                event["usageMetadata"] = {"promptTokenCount": 600, "candidatesTokenCount": 900, "totalTokenCount": 1500}
+            self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+            self.wfile.flush()
+
+def start_server(config):
+    """تشغيل الخادم المحلي على منفذ حر في خيط خلفي"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BenchmarkHandler)
+    config["base_url"] = f"http://127.0.0.1:{server.server_address[1]}"
+    server.bench_config = config
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def configure_environment(workdir, base_url, publisher=None):
+    """توجيه main.py إلى الخادم المحلي ومجلد عمل مؤقت قبل استيراده"""
+    sites_file = os.path.join(workdir, "sites.json")
+    with open(sites_file, "w", encoding="utf-8") as f:
+        json.dump({"sites": [{"name": "Benchrecipes", "domain": "127.0.0.1", "rss_url": f"{base_url}/feed"}]}, f)
+
+    os.environ.update({
+        "SITES_FILE": sites_file,
+        "CACHE_DIR": os.path.join(workdir, ".cache"),
+        "STATE_DB_FILE": os.path.join(workdir, "articles.db"),
+        "TRACE_FILE": os.path.join(workdir, "run_trace.jsonl"),
+        "GEMINI_API_BASE": base_url,
+        "GEMINI_API_KEY": "benchmark-key",
+        "MEDIUM_BASE_URL": base_url,
+        "MEDIUM_API_BASE": base_url,
+        "MEDIUM_SID_COOKIE": "benchmark-sid",
+        "MEDIUM_UID_COOKIE": "benchmark-uid",
+        "MEDIUM_INTEGRATION_TOKEN": "benchmark-token",
+        "PUBLISHERS": publisher or "api,browser",
+        "TEST_MODE": "false" if publisher else "true",
+    })
+
+def run_once(args, run_index):
+    """تشغيل واحد كامل في مجلد مؤقت جديد وإرجاع سجل التتبع"""
+    import importlib
+
+    config = {"posts": args.posts, "gemini_latency": args.gemini_latency, "page_latency": args.page_latency}
+    server = start_server(config)
+    workdir = tempfile.mkdtemp(prefix=f"autoposter-bench-{run_index}-")
+    configure_environment(workdir, config["base_url"], args.publisher)
+
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import main
+        main = importlib.reload(main)
+        common = ["--max-posts", str(args.posts), "--workers", str(args.workers)]
+        if args.split:
+            # prepare يملأ الطابور ثم publish يسحب منه - النتيجة المقاسة زمن publish وحده
+            commands = [["prepare", "--queue-target", str(args.posts)], ["publish"]]
+        else:
+            commands = [[]]
+        # سجل main.py يذهب إلى stderr حتى يبقى stdout نتيجة JSON فقط
+        with contextlib.redirect_stdout(sys.stderr):
+            for command in commands:
+                sys.argv = ["main.py", *command, *common]
+                main.main()
+    finally:
+        os.chdir(previous_cwd)
+        server.shutdown()
+
+    with open(os.environ["TRACE_FILE"], "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f.readlines()[-len(commands):]]
+    record = records[-1]
+    if args.split:
+        record["prepare"] = {"duration_ms": records[0]["duration_ms"], "outcome": records[0]["outcome"]}
+    return record
+
+def summarize(records):
+    """حساب الأدنى والوسيط والأقصى لكل مرحلة وللتشغيل كاملاً"""
+    def stats(values):
+        return {"min": min(values), "median": round(statistics.median(values), 1), "max": max(values)}
+
+    stages = sorted({name for record in records for name in record["stage_totals_ms"]})
+    return {
+        "runs": len(records),
+        "end_to_end_ms": stats([record["duration_ms"] for record in records]),
+        "stages_ms": {name: stats([record["stage_totals_ms"].get(name, 0) for record in records]) for name in stages},
+        "outcomes": [record["outcome"] for record in records],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="قياس أداء السلسلة ضد خدمات محلية بدون إنترنت")
+    parser.add_argument("--posts", type=int, default=3, help=f"عدد المقالات في الخلاصة (حتى {len(RECIPES)})")
+    parser.add_argument("--workers", type=int, default=3, help="عدد عمال التجهيز")
+    parser.add_argument("--runs", type=int, default=1, help="عدد مرات التكرار")
+    parser.add_argument("--gemini-latency", type=float, default=1.0, help="زمن استجابة Gemini المزيف بالثواني")
+    parser.add_argument("--page-latency", type=float, default=0.05, help="زمن استجابة صفحات الوصفات بالثواني")
+    parser.add_argument("--with-browser", action="store_const", const="browser", dest="publisher",
+                        help="تشغيل مسار النشر عبر Chrome ضد المحرر المزيف")
+    parser.add_argument("--with-api", action="store_const", const="api", dest="publisher",
+                        help="تشغيل مسار النشر عبر واجهة Medium البرمجية المزيفة (بدون Chrome)")
+    parser.add_argument("--split", action="store_true",
+                        help="تشغيل prepare ثم publish بدل السلسلة الكاملة وقياس زمن publish وحده")
+    parser.add_argument("--output", help="حفظ النتيجة في ملف JSON بدل طباعتها فقط")
+    args = parser.parse_args()
+    args.posts = max(1, min(args.posts, len(RECIPES)))
+
+    records = [run_once(args, index) for index in range(args.runs)]
+    report = {
+        "config": {
+            "posts": args.posts,
+            "workers": args.workers,
+            "gemini_latency": args.gemini_latency,
+            "page_latency": args.page_latency,
+            "publisher": args.publisher,
+            "split": args.split,
+        },
+        "summary": summarize(records),
+        "runs": records,
+    }
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    main()
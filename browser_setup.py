@@ -0,0 +1,189 @@
+"""تجهيز تشغيل Chrome بسرعة: مسار chromedriver مثبّت في manifest وملف تعريف دائم
+
+- مسار chromedriver يُحل مرة واحدة لكل إصدار رئيسي من Chrome ويُحفظ في
+  manifest محلي، فالتشغيلات التالية لا تسأل الشبكة عن الإصدار المطابق.
+- ملف تعريف Chrome دائم (--user-data-dir) مع كاش القرص داخل مجلد الكاش الذي
+  يُستعاد عبر actions/cache، فلا يُعاد تنزيل JS وCSS الخاصة بـ Medium كل مرة.
+  جلسة Medium (الكوكيز والتخزين المحلي) تُمسح قبل الإغلاق حتى لا تُحفظ في الكاش.
+- ملف الناشر: حظر الصور والخطوط والمتتبعات عبر Network.setBlockedURLs أثناء
+  تحميل المحرر فقط (يعمل مع Selenium وCDP عبر execute_cdp_cmd).
+"""
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import time
+
+# ملفات قفل Chrome - تبقى بعد انهيار أو إلغاء التشغيل وتمنع فتح الملف من جديد
+PROFILE_LOCK_FILES = ("SingletonLock", "SingletonCookie", "SingletonSocket")
+
+# الحد الأقصى لكاش القرص حتى يبقى حجم actions/cache معقولاً
+PROFILE_DISK_CACHE_BYTES = 100 * 1024 * 1024
+
+# بيانات الجلسة في الملف الدائم - لا يُحفظ منها شيء في actions/cache
+SESSION_STORAGE_TYPES = "cookies,local_storage,session_storage,indexeddb,websql,service_workers,cache_storage"
+PROFILE_SESSION_PATHS = (
+    "Default/Cookies", "Default/Cookies-journal",
+    "Default/Network/Cookies", "Default/Network/Cookies-journal",
+    "Default/Local Storage", "Default/Session Storage", "Default/Sessions",
+    "Default/IndexedDB", "Default/Service Worker", "Default/Login Data", "Default/Login Data-journal",
+)
+
+# موارد لا يحتاجها المحرر حتى يصبح جاهزاً للكتابة
+BLOCKED_MEDIA_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.avif", "*.svg", "*.ico",
+    "*miro.medium.com/*",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*fonts.googleapis.com/*", "*fonts.gstatic.com/*",
+]
+BLOCKED_TRACKER_PATTERNS = [
+    "*google-analytics.com/*", "*googletagmanager.com/*", "*doubleclick.net/*",
+    "*googlesyndication.com/*", "*facebook.net/*", "*connect.facebook.com/*",
+    "*branch.io/*", "*app.link/*", "*sentry.io/*", "*segment.io/*", "*segment.com/*",
+    "*amplitude.com/*", "*hotjar.com/*", "*quantserve.com/*", "*scorecardresearch.com/*",
+]
+
+def chrome_version(binary):
+    """إصدار Chrome من `chrome --version` (مثل 141.0.7390.54)، أو None"""
+    try:
+        output = subprocess.run([binary, "--version"], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = re.search(r"(\d+)\.\d+\.\d+\.\d+", output)
+    return match.group(0) if match else None
+
+def major_version(version):
+    return version.split(".", 1)[0] if version else None
+
+def load_manifest(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(path, manifest):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_file = f"{path}.tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_file, path)
+
+def find_local_chromedriver(chrome_major):
+    """chromedriver موجود مسبقاً (PATH أو CHROMEWEBDRIVER في GitHub Actions) بنفس الإصدار الرئيسي"""
+    candidates = []
+    if os.environ.get("CHROMEWEBDRIVER"):
+        candidates.append(os.path.join(os.environ["CHROMEWEBDRIVER"], "chromedriver"))
+    if shutil.which("chromedriver"):
+        candidates.append(shutil.which("chromedriver"))
+
+    for path in candidates:
+        if not os.access(path, os.X_OK):
+            continue
+        if chrome_major is None or major_version(chrome_version(path)) == chrome_major:
+            return path
+    return None
+
+def resolve_driver_path(manifest_path, chrome_binary=None, download_dir=None):
+    """مسار chromedriver المطابق لـ Chrome - يرجع (المسار، المصدر) والمصدر manifest أو local أو download
+
+    المسار المحفوظ يُستخدم ما دام الملف موجوداً والإصدار الرئيسي لـ Chrome لم يتغير.
+    """
+    version = chrome_version(chrome_binary) if chrome_binary else None
+    chrome_major = major_version(version)
+    manifest = load_manifest(manifest_path)
+    entry = manifest.get("chromedriver", {})
+
+    path = entry.get("path")
+    if path and os.access(path, os.X_OK) and (chrome_major is None or entry.get("chrome_major") == chrome_major):
+        return path, "manifest"
+
+    source = "local"
+    path = find_local_chromedriver(chrome_major)
+    if path is None:
+        from webdriver_manager.chrome import ChromeDriverManager
+        from webdriver_manager.core.driver_cache import DriverCacheManager
+
+        # التنزيل داخل مجلد الكاش حتى يُستعاد مع actions/cache
+        cache_manager = DriverCacheManager(root_dir=download_dir) if download_dir else None
+        path = ChromeDriverManager(cache_manager=cache_manager).install()
+        source = "download"
+
+    manifest["chromedriver"] = {
+        "path": path,
+        "chrome_version": version,
+        "chrome_major": chrome_major,
+        "resolved_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    save_manifest(manifest_path, manifest)
+    return path, source
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def prepare_profile_dir(profile_dir):
+    """تجهيز ملف التعريف الدائم - يرجع (جاهز، دافئ)
+
+    جاهز=False إذا كان Chrome آخر يعمل بنفس الملف الآن (فيُستخدم ملف مؤقت بدلاً منه).
+    دافئ=True إذا كان الملف موجوداً من تشغيل سابق (كاش القرص ممتلئ).
+    """
+    warm = os.path.isdir(os.path.join(profile_dir, "Default"))
+    os.makedirs(profile_dir, exist_ok=True)
+
+    lock_path = os.path.join(profile_dir, "SingletonLock")
+    if os.path.lexists(lock_path):
+        # الرابط الرمزي بصيغة hostname-pid
+        try:
+            owner = os.readlink(lock_path)
+        except OSError:
+            owner = ""
+        host, _, pid = owner.rpartition("-")
+        if host == socket.gethostname() and pid.isdigit() and pid_alive(int(pid)):
+            return False, warm
+
+    for name in PROFILE_LOCK_FILES:
+        path = os.path.join(profile_dir, name)
+        if os.path.lexists(path):
+            os.remove(path)
+    return True, warm
+
+def clear_session_data(driver, origins):
+    """مسح الكوكيز وتخزين المواقع (localStorage وIndexedDB...) من المتصفح قبل إغلاقه"""
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    for origin in origins:
+        driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": SESSION_STORAGE_TYPES})
+
+def scrub_profile_dir(profile_dir):
+    """حذف ملفات الجلسة من الملف الدائم بعد إغلاق Chrome (كاش القرص يبقى)"""
+    removed = 0
+    for relative in PROFILE_SESSION_PATHS:
+        path = os.path.join(profile_dir, relative)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.lexists(path):
+            os.remove(path)
+        else:
+            continue
+        removed += 1
+    return removed
+
+def profile_arguments():
+    """معاملات Chrome الخاصة بكاش القرص في الملف الدائم"""
+    return [f"--disk-cache-size={PROFILE_DISK_CACHE_BYTES}"]
+
+def set_blocked_resources(driver, block_media=True, block_trackers=True):
+    """حظر الموارد بأنماط URL (قائمة فارغة تلغي الحظر)"""
+    patterns = (BLOCKED_MEDIA_PATTERNS if block_media else []) + (BLOCKED_TRACKER_PATTERNS if block_trackers else [])
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+    return len(patterns)
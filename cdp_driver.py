@@ -0,0 +1,485 @@
+"""متصفح Chrome عبر بروتوكول DevTools مباشرة (WebSocket) بدون chromedriver
+
+كل أمر رسالة JSON واحدة على WebSocket مفتوح بدل طلب HTTP إلى chromedriver
+الذي يترجمه بدوره إلى CDP، ولا حاجة لتنزيل chromedriver في كل تشغيل.
+
+- الكتابة عبر Input.insertText وInput.dispatchKeyEvent، والنقر عبر
+  Input.dispatchMouseEvent (أحداث موثوقة isTrusted مثل المستخدم الحقيقي).
+- السكربتات عبر Runtime.evaluate، والسكربتات غير المتزامنة بـ awaitPromise.
+- خمول الشبكة من أحداث Network (الطلبات المعلقة فعلاً) بدل الاستطلاع من الصفحة،
+  وانتظار التحميل والتنقل من أحداث Page.
+
+الواجهة تحاكي الجزء الذي يستخدمه main.py من WebDriver في Selenium (get،
+execute_script، execute_async_script، current_url، page_source،
+save_screenshot، add_cookie، execute_cdp_cmd، quit) حتى يعمل كود الكشط كما هو.
+"""
+import base64
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+CHROME_CANDIDATES = ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser", "chrome")
+
+# مفاتيح Input.dispatchKeyEvent: (code, windowsVirtualKeyCode, text)
+KEYS = {
+    "Enter": ("Enter", 13, "\r"),
+    "Tab": ("Tab", 9, ""),
+    "Escape": ("Escape", 27, ""),
+    "Backspace": ("Backspace", 8, ""),
+}
+
+# نفس ما يعدّله selenium_stealth في الصفحة قبل تحميل أي سكربت
+STEALTH_JS = """
+Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+Object.defineProperty(navigator, 'languages', {get: () => ['en-US', 'en']});
+Object.defineProperty(navigator, 'platform', {get: () => 'Win32'});
+Object.defineProperty(navigator, 'vendor', {get: () => 'Google Inc.'});
+Object.defineProperty(navigator, 'plugins', {get: () => [1, 2, 3, 4, 5]});
+window.chrome = window.chrome || {runtime: {}};
+const getParameter = WebGLRenderingContext.prototype.getParameter;
+WebGLRenderingContext.prototype.getParameter = function(parameter) {
+    if (parameter === 37445) return 'Intel Inc.';
+    if (parameter === 37446) return 'Intel Iris OpenGL Engine';
+    return getParameter.call(this, parameter);
+};
+"""
+
+# ينتظر ظهور عنصر عبر MutationObserver بدل الاستطلاع - يرجع true أو false عند المهلة
+WAIT_SELECTOR_JS = """
+(selectors, timeoutMs) => new Promise(resolve => {
+    const find = () => selectors.find(selector => document.querySelector(selector));
+    const found = find();
+    if (found) return resolve(found);
+    const observer = new MutationObserver(() => {
+        const match = find();
+        if (match) { observer.disconnect(); clearTimeout(timer); resolve(match); }
+    });
+    observer.observe(document, {childList: true, subtree: true, attributes: true});
+    const timer = setTimeout(() => { observer.disconnect(); resolve(null); }, timeoutMs);
+})
+"""
+
+# مركز العنصر بعد تمريره إلى العرض (للنقر بإحداثيات حقيقية)
+ELEMENT_CENTER_JS = """
+(selector) => {
+    const element = document.querySelector(selector);
+    if (!element) return null;
+    element.scrollIntoView({block: 'center', inline: 'center'});
+    const rect = element.getBoundingClientRect();
+    return {x: rect.left + rect.width / 2, y: rect.top + rect.height / 2, width: rect.width, height: rect.height};
+}
+"""
+
+class CDPError(Exception):
+    """خطأ من Chrome (رد error أو استثناء JavaScript) أو انقطاع الاتصال"""
+
+def find_chrome_binary():
+    """CHROME_BINARY إن وُجد، وإلا أول متصفح Chrome/Chromium في PATH"""
+    configured = os.environ.get("CHROME_BINARY")
+    if configured:
+        return configured
+    for name in CHROME_CANDIDATES:
+        path = shutil.which(name)
+        if path:
+            return path
+    raise CDPError("Chrome binary not found (set CHROME_BINARY)")
+
+def wait_for_devtools_port(user_data_dir, process, timeout=30):
+    """Chrome يكتب المنفذ الفعلي في DevToolsActivePort عند --remote-debugging-port=0"""
+    port_file = os.path.join(user_data_dir, "DevToolsActivePort")
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CDPError(f"Chrome exited with code {process.returncode}")
+        try:
+            with open(port_file, "r", encoding="utf-8") as f:
+                port = f.readline().strip()
+            if port:
+                return int(port)
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.05)
+    raise CDPError("Chrome did not open a DevTools port")
+
+def launch_chrome(binary=None, user_data_dir=None, headless=True, window_size=(1920, 1080), extra_args=()):
+    """تشغيل Chrome مع منفذ DevTools - يرجع (العملية، المنفذ، مجلد البيانات، هل هو مؤقت)"""
+    binary = binary or find_chrome_binary()
+    temporary = user_data_dir is None
+    user_data_dir = user_data_dir or tempfile.mkdtemp(prefix="cdp-chrome-")
+    os.makedirs(user_data_dir, exist_ok=True)
+    # ملف منفذ قديم من تشغيل سابق يعطي منفذاً خاطئاً
+    try:
+        os.remove(os.path.join(user_data_dir, "DevToolsActivePort"))
+    except OSError:
+        pass
+
+    args = [
+        binary,
+        "--remote-debugging-port=0",
+        "--remote-allow-origins=*",
+        f"--user-data-dir={user_data_dir}",
+        f"--window-size={window_size[0]},{window_size[1]}",
+        "--no-first-run",
+        "--no-default-browser-check",
+        "--no-sandbox",
+        "--disable-dev-shm-usage",
+        "--disable-gpu",
+        "--disable-blink-features=AutomationControlled",
+        *extra_args,
+    ]
+    if headless:
+        args.append("--headless=new")
+    args.append("about:blank")
+
+    process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        port = wait_for_devtools_port(user_data_dir, process)
+    except Exception:
+        process.kill()
+        if temporary:
+            shutil.rmtree(user_data_dir, ignore_errors=True)
+        raise
+    return process, port, user_data_dir, temporary
+
+class CDPConnection:
+    """اتصال WebSocket واحد: أوامر بمعرّفات متسلسلة ومستمعون للأحداث
+
+    خيط قراءة واحد يوزع الردود على الأوامر المنتظرة والأحداث على المستمعين،
+    فلا يُحجب أمر بانتظار حدث ولا العكس.
+    """
+
+    def __init__(self, ws_url, timeout=30):
+        import websocket
+
+        self.timeout = timeout
+        self.ws = websocket.create_connection(ws_url, timeout=None, suppress_origin=True, enable_multithread=True)
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._listeners = {}
+        self._lock = threading.Lock()
+        self.closed = False
+        self._reader = threading.Thread(target=self._read_loop, name="cdp-reader", daemon=True)
+        self._reader.start()
+
+    def _read_loop(self):
+        while not self.closed:
+            try:
+                message = json.loads(self.ws.recv())
+            except Exception:
+                break
+            if "id" in message:
+                with self._lock:
+                    waiter = self._pending.pop(message["id"], None)
+                if waiter:
+                    waiter["message"] = message
+                    waiter["event"].set()
+            elif "method" in message:
+                for callback in list(self._listeners.get(message["method"], ())):
+                    try:
+                        callback(message.get("params", {}))
+                    except Exception as e:
+                        print(f"    ⚠️ CDP: خطأ في معالج {message['method']}: {e}")
+
+        # إيقاظ كل من ينتظر رداً لن يصل
+        self.closed = True
+        with self._lock:
+            waiters, self._pending = list(self._pending.values()), {}
+        for waiter in waiters:
+            waiter["event"].set()
+
+    def on(self, method, callback):
+        self._listeners.setdefault(method, []).append(callback)
+
+    def send(self, method, params=None, timeout=None):
+        """إرسال أمر وانتظار رده - يرجع result أو يرفع CDPError"""
+        if self.closed:
+            raise CDPError("DevTools connection is closed")
+        message_id = next(self._ids)
+        waiter = {"event": threading.Event(), "message": None}
+        with self._lock:
+            self._pending[message_id] = waiter
+        self.ws.send(json.dumps({"id": message_id, "method": method, "params": params or {}}))
+
+        if not waiter["event"].wait(timeout or self.timeout):
+            with self._lock:
+                self._pending.pop(message_id, None)
+            raise CDPError(f"{method} timed out after {timeout or self.timeout}s")
+        message = waiter["message"]
+        if message is None:
+            raise CDPError(f"{method}: DevTools connection closed")
+        if "error" in message:
+            raise CDPError(f"{method}: {message['error'].get('message')}")
+        return message.get("result", {})
+
+    def close(self):
+        self.closed = True
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+class CDPDriver:
+    """متصفح بتبويب واحد يُتحكم به عبر CDP - بديل WebDriver لـ main.py"""
+
+    is_cdp = True
+
+    def __init__(self, binary=None, user_data_dir=None, headless=True, stealth=True, command_timeout=30, extra_args=()):
+        import requests
+
+        self.process, self.port, self.user_data_dir, self._temporary_profile = launch_chrome(
+            binary, user_data_dir, headless, extra_args=extra_args
+        )
+        self.script_timeout = 30
+        try:
+            targets = requests.get(f"http://127.0.0.1:{self.port}/json/list", timeout=10).json()
+            page = next(target for target in targets if target.get("type") == "page")
+            self.cdp = CDPConnection(page["webSocketDebuggerUrl"], timeout=command_timeout)
+        except Exception:
+            self._stop_process()
+            raise
+
+        # حالة الصفحة والشبكة تُحدَّث من الأحداث
+        self._state = threading.Condition()
+        self._inflight = set()
+        self._last_network_activity = time.monotonic()
+        self._load_count = 0
+        self._url = "about:blank"
+        self._main_frame = None
+        self._subscribe()
+
+        self.cdp.send("Page.enable")
+        self.cdp.send("Network.enable")
+        tree = self.cdp.send("Page.getFrameTree")
+        self._main_frame = tree["frameTree"]["frame"]["id"]
+        if stealth:
+            self._apply_stealth()
+
+    # ----- الأحداث -----
+
+    def _subscribe(self):
+        def request_started(params):
+            with self._state:
+                self._inflight.add(params["requestId"])
+                self._last_network_activity = time.monotonic()
+                self._state.notify_all()
+
+        def request_finished(params):
+            with self._state:
+                self._inflight.discard(params["requestId"])
+                self._last_network_activity = time.monotonic()
+                self._state.notify_all()
+
+        def load_fired(params):
+            with self._state:
+                self._load_count += 1
+                self._state.notify_all()
+
+        def navigated(params):
+            frame = params["frame"]
+            if frame.get("parentId"):
+                return
+            with self._state:
+                self._main_frame = frame["id"]
+                self._url = frame["url"] + frame.get("urlFragment", "")
+                self._state.notify_all()
+
+        def navigated_within_document(params):
+            if params.get("frameId") != self._main_frame:
+                return
+            with self._state:
+                self._url = params["url"]
+                self._state.notify_all()
+
+        self.cdp.on("Network.requestWillBeSent", request_started)
+        self.cdp.on("Network.loadingFinished", request_finished)
+        self.cdp.on("Network.loadingFailed", request_finished)
+        self.cdp.on("Page.loadEventFired", load_fired)
+        self.cdp.on("Page.frameNavigated", navigated)
+        self.cdp.on("Page.navigatedWithinDocument", navigated_within_document)
+
+    def _apply_stealth(self):
+        self.cdp.send("Page.addScriptToEvaluateOnNewDocument", {"source": STEALTH_JS})
+        user_agent = self.cdp.send("Browser.getVersion")["userAgent"].replace("HeadlessChrome", "Chrome")
+        self.cdp.send("Network.setUserAgentOverride", {
+            "userAgent": user_agent, "acceptLanguage": "en-US,en", "platform": "Win32",
+        })
+
+    # ----- واجهة WebDriver -----
+
+    def get(self, url, timeout=60):
+        """الانتقال إلى رابط وانتظار حدث load (مثل driver.get)"""
+        with self._state:
+            loads_before = self._load_count
+            # الطلبات المعلقة من الصفحة السابقة لن تكتمل بعد التنقل
+            self._inflight.clear()
+        result = self.cdp.send("Page.navigate", {"url": url})
+        if result.get("errorText"):
+            raise CDPError(f"navigation to {url} failed: {result['errorText']}")
+        if not result.get("loaderId"):
+            # تنقل داخل نفس المستند (#hash) لا يطلق load
+            return
+        self._wait_state(lambda: self._load_count > loads_before, timeout)
+
+    def _wait_state(self, predicate, timeout):
+        with self._state:
+            return self._state.wait_for(predicate, timeout)
+
+    @property
+    def current_url(self):
+        return self.evaluate("location.href")
+
+    @property
+    def page_source(self):
+        return self.evaluate("document.documentElement.outerHTML")
+
+    @property
+    def title(self):
+        return self.evaluate("document.title")
+
+    def evaluate(self, expression, await_promise=False, timeout=None):
+        """Runtime.evaluate بقيمة JSON - استثناء JavaScript يُرفع كـ CDPError"""
+        result = self.cdp.send("Runtime.evaluate", {
+            "expression": expression,
+            "returnByValue": True,
+            "awaitPromise": await_promise,
+            "userGesture": True,
+        }, timeout=timeout)
+        if result.get("exceptionDetails"):
+            details = result["exceptionDetails"]
+            description = details.get("exception", {}).get("description") or details.get("text")
+            raise CDPError(f"JavaScript error: {description}")
+        return result.get("result", {}).get("value")
+
+    def call(self, function_source, *args, await_promise=False, timeout=None):
+        """استدعاء دالة JavaScript بمعاملات JSON"""
+        arguments = ", ".join(json.dumps(arg) for arg in args)
+        return self.evaluate(f"({function_source})({arguments})", await_promise, timeout)
+
+    def execute_script(self, script, *args):
+        """مثل WebDriver: جسم دالة يصل إلى arguments ويرجع قيمة بـ return"""
+        return self.call(f"function() {{\n{script}\n}}.bind(null, ...{json.dumps(list(args))})")
+
+    def execute_async_script(self, script, *args):
+        """مثل WebDriver: آخر معامل دالة رد النداء التي تنهي السكربت"""
+        wrapper = (
+            "() => new Promise(resolve => { (function() {\n" + script + "\n})"
+            f".apply(null, [...{json.dumps(list(args))}, resolve]); }})"
+        )
+        return self.call(wrapper, await_promise=True, timeout=self.script_timeout)
+
+    def set_script_timeout(self, seconds):
+        self.script_timeout = seconds
+
+    def save_screenshot(self, path):
+        data = self.cdp.send("Page.captureScreenshot", {"format": "png"})["data"]
+        with open(path, "wb") as f:
+            f.write(base64.b64decode(data))
+        return True
+
+    def add_cookie(self, cookie):
+        """Network.setCookie - بدون domain يُربط الكوكي بالصفحة الحالية كما في WebDriver"""
+        params = {key: cookie[key] for key in ("name", "value", "domain", "path", "secure", "httpOnly") if key in cookie}
+        if "domain" not in params:
+            params["url"] = cookie.get("url") or self.current_url
+        params.setdefault("path", "/")
+        if not self.cdp.send("Network.setCookie", params).get("success", True):
+            raise CDPError(f"cookie {cookie['name']} was rejected")
+
+    def execute_cdp_cmd(self, method, params):
+        return self.cdp.send(method, params)
+
+    def reset(self):
+        """تبويب نظيف بين الاستخدامات: صفحة فارغة وبدون كوكيز"""
+        self.get("about:blank")
+        self.cdp.send("Network.clearBrowserCookies")
+
+    def quit(self):
+        try:
+            self.cdp.send("Browser.close", timeout=5)
+        except Exception:
+            pass
+        self.cdp.close()
+        self._stop_process()
+
+    def _stop_process(self):
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        if self._temporary_profile:
+            shutil.rmtree(self.user_data_dir, ignore_errors=True)
+
+    # ----- تفاعل مباشر عبر CDP -----
+
+    def wait_for_selector(self, selectors, timeout=30):
+        """انتظار أول محدد يظهر في DOM - يرجع المحدد أو None عند المهلة"""
+        if isinstance(selectors, str):
+            selectors = [selectors]
+        return self.call(WAIT_SELECTOR_JS, list(selectors), int(timeout * 1000),
+                         await_promise=True, timeout=timeout + 5)
+
+    def click(self, selector):
+        """نقرة فأرة حقيقية في مركز العنصر - False إن لم يوجد أو كان مخفياً"""
+        center = self.call(ELEMENT_CENTER_JS, selector)
+        if not center or not center["width"] or not center["height"]:
+            return False
+        for event_type in ("mouseMoved", "mousePressed", "mouseReleased"):
+            self.cdp.send("Input.dispatchMouseEvent", {
+                "type": event_type, "x": center["x"], "y": center["y"],
+                "button": "left" if event_type != "mouseMoved" else "none", "clickCount": 1,
+            })
+        return True
+
+    def focus(self, selector):
+        return bool(self.call("(s) => { const e = document.querySelector(s); if (!e) return false; e.focus(); return true; }", selector))
+
+    def insert_text(self, text):
+        """كتابة النص دفعة واحدة في العنصر المركّز (بدل send_keys حرفاً حرفاً)"""
+        self.cdp.send("Input.insertText", {"text": text})
+
+    def press_key(self, key):
+        code, key_code, text = KEYS[key]
+        base = {"key": key, "code": code, "windowsVirtualKeyCode": key_code, "nativeVirtualKeyCode": key_code}
+        self.cdp.send("Input.dispatchKeyEvent", {"type": "keyDown", **base, **({"text": text} if text else {})})
+        self.cdp.send("Input.dispatchKeyEvent", {"type": "keyUp", **base})
+
+    def wait_for_load(self, timeout=30):
+        """انتظار اكتمال المستند الحالي"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.evaluate("document.readyState") == "complete":
+                return True
+            with self._state:
+                loads = self._load_count
+                self._state.wait_for(lambda: self._load_count > loads, min(1.0, deadline - time.monotonic()))
+        return False
+
+    def wait_for_network_idle(self, idle_ms=500, timeout=30):
+        """انتظار عدم وجود طلبات معلقة لمدة idle_ms - من أحداث Network"""
+        idle_seconds = idle_ms / 1000
+        deadline = time.monotonic() + timeout
+        with self._state:
+            while True:
+                now = time.monotonic()
+                quiet_for = now - self._last_network_activity
+                if not self._inflight and quiet_for >= idle_seconds:
+                    return True
+                if now >= deadline:
+                    return False
+                wake_in = idle_seconds - quiet_for if not self._inflight else deadline - now
+                self._state.wait(max(0.01, min(wake_in, deadline - now)))
+
+    def wait_for_url(self, predicate, timeout=30):
+        """انتظار رابط يحقق الشرط - من أحداث التنقل (بما فيها pushState)"""
+        with self._state:
+            if predicate(self._url):
+                return self._url
+            if self._state.wait_for(lambda: predicate(self._url), timeout):
+                return self._url
+        return None
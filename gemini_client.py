@@ -0,0 +1,293 @@
+"""عميل Gemini غير متزامن (asyncio) مع تحديد المعدل وإعادة المحاولة
+
+- دلوان للرموز (token bucket) لكل نموذج: طلبات في الدقيقة (RPM) ورموز في الدقيقة (TPM).
+- إعادة محاولة 429/5xx وأخطاء الشبكة بتأخير أُسّي عشوائي (full jitter)،
+  مع احترام Retry-After إن أرسله الخادم.
+- عدة طلبات تعمل معاً على حلقة أحداث واحدة في خيط خلفي، فمجموع زمن دفعة
+  المقالات يقترب من زمن أبطأ طلب بدل مجموع الطلبات.
+- وضع البث (streamGenerateContent): حقول JSON تصل فور اكتمالها، والتوقف عن
+  التقدم يُكتشف خلال stall_timeout ثانية بدل انتظار المهلة الكاملة.
+
+الطلب نفسه يمر عبر جلسة requests المشتركة (http_client) داخل asyncio.to_thread،
+فيستفيد من مجمّع الاتصالات بدل إضافة مكتبة HTTP غير متزامنة.
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+
+import requests
+from urllib3.exceptions import HTTPError as Urllib3Error
+
+from incremental_json import IncrementalObjectParser
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class GeminiError(Exception):
+    """فشل طلب Gemini بعد استنفاد المحاولات أو بخطأ غير قابل للإعادة"""
+
+    def __init__(self, message, status=None, attempts=0):
+        super().__init__(message)
+        self.status = status
+        self.attempts = attempts
+
+class TokenBucket:
+    """دلو يمتلئ بمعدل ثابت (capacity في الدقيقة) - acquire ينتظر حتى يتوفر المطلوب"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        # طلب أكبر من سعة الدلو كله ينتظر امتلاءه فقط، وإلا لن يمر أبداً
+        amount = min(float(amount), self.capacity)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, amount):
+        """تصحيح الاستهلاك بعد معرفة العدد الفعلي (قد يصبح الرصيد سالباً كدَين)"""
+        self._refill()
+        self.tokens -= amount
+
+def estimate_tokens(body):
+    """تقدير تقريبي قبل الإرسال: 4 أحرف لكل رمز + الحد الأقصى للمخرجات"""
+    prompt_chars = sum(
+        len(part.get("text", ""))
+        for content in body.get("contents", [])
+        for part in content.get("parts", [])
+    )
+    return prompt_chars // 4 + body.get("generationConfig", {}).get("maxOutputTokens", 0)
+
+def retry_delay(attempt, response=None, base=1.0, cap=30.0):
+    """Retry-After إن وُجد، وإلا تأخير عشوائي بين 0 و base*2^attempt"""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), cap)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def iter_stream_lines(response):
+    """أسطر البث فور وصولها - iter_lines تنتظر امتلاء 512 بايت قبل أي سطر
+
+    read1 (urllib3 2) يرجع ما وصل من المقبس فقط، وiter_content(None) يرجع كل
+    مقطع chunked فور وصوله في الإصدارات الأقدم. القراءة المباشرة من raw ترفع
+    أخطاء urllib3 (مثل ReadTimeoutError) بدون تغليف requests، ولا تفك ضغط
+    Content-Encoding إلا مع decode_content=True.
+    """
+    read1 = getattr(response.raw, "read1", None)
+    if read1 is not None:
+        chunks = iter(lambda: read1(8192, decode_content=True), b"")
+    else:
+        chunks = response.iter_content(chunk_size=None)
+
+    pending = b""
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r").decode("utf-8")
+    if pending:
+        yield pending.rstrip(b"\r").decode("utf-8")
+
+class GeminiClient:
+    """عميل Gemini مشترك بين خيوط التحضير (حلقة أحداث واحدة، وحد معدل لكل نموذج)"""
+
+    def __init__(self, api_base, api_key, session, rpm=15, tpm=1_000_000, max_retries=4, timeout=(10, 180), max_concurrency=8, stall_timeout=20):
+        self.api_base = api_base
+        self.api_key = api_key
+        self.session = session
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.stall_timeout = stall_timeout
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_loop(self):
+        """تشغيل حلقة الأحداث في خيط خلفي عند أول استخدام"""
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="gemini-client", daemon=True)
+                self._thread.start()
+                # الدلاء والقفل مرتبطة بحلقة الأحداث فتُنشأ داخلها
+                asyncio.run_coroutine_threadsafe(self._init_limits(), self._loop).result()
+        return self._loop
+
+    async def _init_limits(self):
+        self.buckets = {}
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def _buckets_for(self, model):
+        """حصص Gemini لكل نموذج على حدة، فدلوا (RPM، TPM) لكل نموذج"""
+        if model not in self.buckets:
+            self.buckets[model] = (TokenBucket(self.rpm), TokenBucket(self.tpm))
+        return self.buckets[model]
+
+    def run_sync(self, coroutine):
+        """تشغيل coroutine على حلقة العميل من خيط عادي وانتظار نتيجتها"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop()).result()
+
+    def _post(self, url, body):
+        return self.session.post(
+            url, headers={"Content-Type": "application/json"},
+            data=json.dumps(body), timeout=self.timeout
+        )
+
+    def _stream(self, url, body, on_text, stop=None):
+        """قراءة بث SSE في خيط عادي - مهلة القراءة هي مهلة التوقف بين الدفعات
+
+        stop (threading.Event) يوقف القراءة ويغلق الاتصال عند إلغاء الطلب.
+        """
+        deadline = time.monotonic() + self.timeout[1]
+        # بث بدون ضغط: gzip يؤخر الأسطر حتى يمتلئ مقطع الضغط
+        response = self.session.post(
+            url, headers={"Content-Type": "application/json", "Accept-Encoding": "identity"}, data=json.dumps(body),
+            timeout=(self.timeout[0], self.stall_timeout), stream=True
+        )
+        with response:
+            if not response.ok:
+                # قراءة نص الخطأ قبل إغلاق الاتصال حتى يبقى response.text متاحاً
+                response.content
+                return response, None
+
+            texts = []
+            usage = {}
+            for line in iter_stream_lines(response):
+                if time.monotonic() > deadline:
+                    raise GeminiError(f"stream exceeded {self.timeout[1]}s")
+                if stop is not None and stop.is_set():
+                    raise GeminiError("stream cancelled")
+                if not line or not line.startswith("data:"):
+                    continue
+                event = json.loads(line[5:])
+                usage = event.get("usageMetadata", usage)
+                for candidate in event.get("candidates", [])[:1]:
+                    for part in candidate.get("content", {}).get("parts", []):
+                        if part.get("text"):
+                            texts.append(part["text"])
+                            on_text(part["text"])
+
+        # نفس شكل رد generateContent حتى يبقى كود الاستدعاء واحداً
+        payload = {
+            "candidates": [{"content": {"parts": [{"text": "".join(texts)}]}}],
+            "usageMetadata": usage,
+        }
+        return response, payload
+
+    async def _request(self, model, body, send, retry_on_quota=True):
+        """حد المعدل وإعادة المحاولة حول send() التي ترجع (response, payload)
+
+        retry_on_quota=False يرفع 429 فوراً حتى ينتقل الموجّه إلى نموذج آخر.
+        """
+        estimated = estimate_tokens(body)
+        request_bucket, token_bucket = self._buckets_for(model)
+
+        for attempt in range(self.max_retries + 1):
+            await request_bucket.acquire(1)
+            await token_bucket.acquire(estimated)
+
+            response = None
+            try:
+                async with self.semaphore:
+                    response, payload = await asyncio.to_thread(send)
+            except (requests.ConnectionError, requests.Timeout, Urllib3Error) as e:
+                # في البث تعني مهلة القراءة أن التوليد توقف عن التقدم
+                error = GeminiError(f"network error or stall: {e}", attempts=attempt + 1)
+            except ValueError as e:
+                # رد مقطوع أو تالف (UnicodeDecodeError وJSONDecodeError) - يُعاد كخطأ شبكة
+                error = GeminiError(f"malformed response: {str(e)[:200]}", attempts=attempt + 1)
+            else:
+                if response.ok:
+                    used = payload.get("usageMetadata", {}).get("totalTokenCount")
+                    if used:
+                        token_bucket.adjust(used - estimated)
+                    return payload, attempt + 1
+                error = GeminiError(
+                    f"HTTP {response.status_code}: {response.text[:200]}",
+                    status=response.status_code, attempts=attempt + 1
+                )
+                if response.status_code not in RETRYABLE_STATUSES:
+                    raise error
+                if response.status_code == 429 and not retry_on_quota:
+                    raise error
+
+            if attempt < self.max_retries:
+                delay = retry_delay(attempt, response)
+                print(f"    🔁 Gemini: {error} - إعادة المحاولة بعد {delay:.1f}s")
+                await asyncio.sleep(delay)
+        raise error
+
+    async def generate(self, model, body, retry_on_quota=True):
+        """طلب واحد مع حد المعدل وإعادة المحاولة - يرجع (JSON الرد، عدد المحاولات)"""
+        url = f"{self.api_base}/v1beta/models/{model}:generateContent?key={self.api_key}"
+
+        def send():
+            response = self._post(url, body)
+            return response, (response.json() if response.ok else None)
+
+        return await self._request(model, body, send, retry_on_quota)
+
+    async def generate_stream(self, model, body, on_field=None, retry_on_quota=True, stop=None):
+        """مثل generate لكن بالبث: on_field(key, value) تُستدعى لكل حقل JSON فور اكتماله
+
+        تُستدعى on_field من خيط العمل، ومرة واحدة لكل مفتاح حتى لو أُعيدت المحاولة.
+        """
+        url = f"{self.api_base}/v1beta/models/{model}:streamGenerateContent?alt=sse&key={self.api_key}"
+        emitted = set()
+
+        def send():
+            parser = IncrementalObjectParser()
+
+            def on_text(text):
+                for key, value in parser.feed(text):
+                    if on_field and key not in emitted:
+                        emitted.add(key)
+                        on_field(key, value)
+
+            return self._stream(url, body, on_text, stop)
+
+        return await self._request(model, body, send, retry_on_quota)
+
+    async def generate_many(self, model, bodies):
+        """عدة طلبات معاً - النتيجة لكل طلب (payload, attempts) أو GeminiError"""
+        return await asyncio.gather(
+            *(self.generate(model, body) for body in bodies), return_exceptions=True
+        )
+
+    def generate_sync(self, model, body):
+        """غلاف متزامن للاستدعاء من الخيوط العادية"""
+        return self.run_sync(self.generate(model, body))
+
+    def generate_stream_sync(self, model, body, on_field=None):
+        return self.run_sync(self.generate_stream(model, body, on_field))
+
+    def generate_many_sync(self, model, bodies):
+        return self.run_sync(self.generate_many(model, bodies))
+
+    def close(self):
+        """إيقاف حلقة الأحداث والخيط الخلفي"""
+        with self._start_lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join(timeout=5)
+                self._loop.close()
+                self._loop = None
+                self._thread = None
@@ -0,0 +1,119 @@
+"""مخطط المخرجات المنظمة لإعادة كتابة Gemini والتحقق منها
+
+Gemini يلتزم بـ responseSchema فيرجع JSON صالحاً دائماً، لكن المحتوى نفسه قد
+يخالف المطلوب (عنصر نائب ناقص، وسم HTML غير مسموح). validate_rewrite ترجع
+المشاكل لكل حقل، فيُطلب إصلاح الحقول المعطوبة فقط بدل توليد المقال من جديد.
+"""
+import json
+import re
+
+PLACEHOLDERS = ("INSERT_IMAGE_1_HERE", "INSERT_MID_CTA_HERE", "INSERT_IMAGE_2_HERE")
+ALLOWED_TAGS = {"p", "h2", "h3", "ul", "ol", "li", "strong", "em", "br"}
+MAX_TAGS = 5
+
+HTML_TAG = re.compile(r"</?\s*([a-zA-Z][a-zA-Z0-9]*)[^>]*>")
+
+FIELD_SCHEMAS = {
+    "new_title": {"type": "STRING", "description": "Engaging SEO title, 60-70 characters"},
+    "new_html_content": {
+        "type": "STRING",
+        "description": "600-700 word article in simple HTML with the three INSERT_*_HERE placeholders",
+    },
+    "tags": {"type": "ARRAY", "items": {"type": "STRING"}, "description": "5 Medium tags"},
+    "caption1": {"type": "STRING", "description": "Short caption for the first image"},
+    "caption2": {"type": "STRING", "description": "Short caption for the second image"},
+}
+
+def response_schema(fields=tuple(FIELD_SCHEMAS)):
+    """مخطط responseSchema لمجموعة حقول - propertyOrdering يبقي العنوان أولاً في البث"""
+    return {
+        "type": "OBJECT",
+        "properties": {field: FIELD_SCHEMAS[field] for field in fields},
+        "required": list(fields),
+        "propertyOrdering": list(fields),
+    }
+
+def structured_generation_config(base_config, fields=tuple(FIELD_SCHEMAS)):
+    """generationConfig مع responseMimeType وresponseSchema"""
+    return {**base_config, "responseMimeType": "application/json", "responseSchema": response_schema(fields)}
+
+def validate_rewrite(result):
+    """التحقق من نتيجة إعادة الكتابة - يرجع {الحقل: [المشاكل]} (فارغ إن كانت سليمة)"""
+    problems = {}
+
+    def add(field, message):
+        problems.setdefault(field, []).append(message)
+
+    for field in FIELD_SCHEMAS:
+        if field not in result:
+            add(field, "missing")
+
+    title = result.get("new_title")
+    if "new_title" in result and (not isinstance(title, str) or not title.strip()):
+        add("new_title", "must be a non-empty string")
+
+    html = result.get("new_html_content")
+    if isinstance(html, str):
+        for placeholder in PLACEHOLDERS:
+            count = html.count(placeholder)
+            if count != 1:
+                add("new_html_content", f"{placeholder} must appear exactly once (found {count})")
+        disallowed = sorted({tag.lower() for tag in HTML_TAG.findall(html)} - ALLOWED_TAGS)
+        if disallowed:
+            add("new_html_content", f"disallowed HTML tags: {', '.join(disallowed)}")
+    elif "new_html_content" in result:
+        add("new_html_content", "must be a string")
+
+    tags = result.get("tags")
+    if "tags" in result and (not isinstance(tags, list) or not all(isinstance(tag, str) and tag.strip() for tag in tags) or not tags):
+        add("tags", "must be a non-empty list of strings")
+
+    return problems
+
+def build_repair_prompt(result, problems):
+    """طلب إصلاح يخص الحقول المعطوبة فقط، مع قيمها الحالية وقائمة المشاكل"""
+    lines = [
+        "You previously returned this JSON for a Medium recipe article, but some fields are invalid.",
+        "Return ONLY the listed fields, corrected. Keep everything else about them unchanged.",
+        "",
+        "Rules:",
+        f"- new_html_content may use ONLY these HTML tags: {', '.join(sorted(ALLOWED_TAGS))}",
+        f"- new_html_content must contain each of {', '.join(PLACEHOLDERS)} exactly once, written exactly as shown",
+        "- No links or calls to action",
+        "",
+        "Problems:",
+    ]
+    for field, messages in problems.items():
+        for message in messages:
+            lines.append(f"- {field}: {message}")
+    lines += ["", "Current values:", json.dumps({field: result.get(field) for field in problems}, ensure_ascii=False)]
+    return "\n".join(lines)
+
+def sanitize_rewrite(result):
+    """إصلاح محلي أخير بدون طلب جديد: إزالة الوسوم غير المسموحة وإدراج العناصر النائبة الناقصة"""
+    fixed = dict(result)
+    html = fixed.get("new_html_content")
+    if isinstance(html, str):
+        html = HTML_TAG.sub(lambda match: match.group(0) if match.group(1).lower() in ALLOWED_TAGS else "", html)
+        for placeholder in PLACEHOLDERS:
+            first = html.find(placeholder)
+            if first != -1:
+                # الإبقاء على أول ظهور فقط
+                html = html[:first + len(placeholder)] + html[first + len(placeholder):].replace(placeholder, "")
+
+        paragraphs = [match.end() for match in re.finditer(r"</p>", html)]
+        inserts = {
+            "INSERT_IMAGE_1_HERE": paragraphs[0] if paragraphs else 0,
+            "INSERT_MID_CTA_HERE": paragraphs[0] if paragraphs else 0,
+            "INSERT_IMAGE_2_HERE": paragraphs[len(paragraphs) // 2] if paragraphs else len(html),
+        }
+        # الإدراج من الخلف حتى لا تتغير مواضع ما قبله
+        for placeholder in reversed(PLACEHOLDERS):
+            if placeholder not in html:
+                position = inserts[placeholder]
+                html = html[:position] + placeholder + html[position:]
+        fixed["new_html_content"] = html
+
+    if isinstance(fixed.get("tags"), list):
+        fixed["tags"] = [tag for tag in fixed["tags"] if isinstance(tag, str) and tag.strip()][:MAX_TAGS]
+    return fixed
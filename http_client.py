@@ -0,0 +1,153 @@
+"""طبقة HTTP مشتركة: جلسة requests واحدة لكل العملية
+
+- تجميع الاتصالات مع keep-alive، فطلبات RSS وGemini والصور لنفس المضيف
+  تعيد استخدام اتصال TLS بدل مصافحة جديدة لكل طلب.
+- حد للاتصالات المتزامنة لكل مضيف (الخيوط الزائدة تنتظر اتصالاً متاحاً).
+- كاش DNS قصير العمر في الذاكرة لاتصالات هذه الجلسة فقط (Selenium وCDP
+  وبقية العملية تبقى على حل DNS العادي).
+- سياسة موحدة للمهلات وإعادة المحاولة (GET/HEAD فقط - POST لا يُعاد تلقائياً).
+"""
+import os
+import socket
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NameResolutionError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+from urllib3.util.retry import Retry
+
+# عدد المضيفين المحتفظ بمجمّعاتهم، والحد الأقصى للاتصالات لكل مضيف
+HTTP_POOL_HOSTS = int(os.environ.get("HTTP_POOL_HOSTS", "16"))
+HTTP_PER_HOST = int(os.environ.get("HTTP_PER_HOST", "8"))
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "2"))
+DNS_CACHE_TTL = 300
+
+# (مهلة الاتصال، مهلة القراءة) بالثواني لكل نوع طلب
+TIMEOUTS = {
+    "default": (5, 30),
+    "feed": (5, 30),
+    "page": (5, 15),
+    "image": (5, 10),
+    "gemini": (10, 180),
+}
+
+_session = None
+_session_lock = threading.Lock()
+_dns_cache = {}
+_dns_lock = threading.Lock()
+
+def cached_getaddrinfo(host, port):
+    """getaddrinfo مع كاش لمدة DNS_CACHE_TTL (أخطاء الحل لا تُحفظ)"""
+    key = (host, port)
+    now = time.monotonic()
+    with _dns_lock:
+        cached = _dns_cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    result = socket.getaddrinfo(host, port, allowed_gai_family(), socket.SOCK_STREAM)
+    with _dns_lock:
+        _dns_cache[key] = (now + DNS_CACHE_TTL, result)
+    return result
+
+class CachedDNSConnectionMixin:
+    """اتصال urllib3 يحل المضيف من الكاش ثم يجرب العناوين بالترتيب
+
+    _dns_host يُستبدل بالعنوان فقط أثناء الاتصال، أما SNI والتحقق من الشهادة
+    فيستخدمان host الأصلي.
+    """
+
+    def _new_conn(self):
+        host = self._dns_host
+        try:
+            addresses = cached_getaddrinfo(host, self.port)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+
+        error = None
+        try:
+            for *_, address in addresses:
+                self._dns_host = address[0]
+                try:
+                    return super()._new_conn()
+                except (NewConnectionError, ConnectTimeoutError) as e:
+                    error = e
+        finally:
+            self._dns_host = host
+        if error is None:
+            raise NewConnectionError(self, "getaddrinfo returned an empty list")
+        raise error
+
+class CachedDNSHTTPConnection(CachedDNSConnectionMixin, HTTPConnection):
+    pass
+
+class CachedDNSHTTPSConnection(CachedDNSConnectionMixin, HTTPSConnection):
+    pass
+
+class CachedDNSHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CachedDNSHTTPConnection
+
+class CachedDNSHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CachedDNSHTTPSConnection
+
+class CachedDNSAdapter(HTTPAdapter):
+    """HTTPAdapter بكاش DNS خاص بمجمّعاته بدل تعديل socket.getaddrinfo للعملية كلها"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        # نسخة جديدة: القاموس الافتراضي مشترك بين كل PoolManager
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CachedDNSHTTPConnectionPool,
+            "https": CachedDNSHTTPSConnectionPool,
+        }
+
+class PooledSession(requests.Session):
+    """جلسة بمهلة افتراضية حتى لا يعلق أي طلب نُسيت مهلته"""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", TIMEOUTS["default"])
+        return super().request(method, url, **kwargs)
+
+def create_session():
+    """إنشاء جلسة بمجمّع اتصالات وسياسة إعادة محاولة موحدة"""
+    retry = Retry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=HTTP_RETRIES,
+        status=HTTP_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = CachedDNSAdapter(
+        pool_connections=HTTP_POOL_HOSTS,
+        pool_maxsize=HTTP_PER_HOST,
+        pool_block=True,
+        max_retries=retry,
+    )
+    session = PooledSession()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_session():
+    """الجلسة المشتركة للعملية (تُنشأ عند أول استخدام)"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+def close_session():
+    """إغلاق كل الاتصالات المفتوحة"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
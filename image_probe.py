@@ -0,0 +1,266 @@
+"""فحص الصور عن بُعد بدون تنزيلها كاملة
+
+يرسل HEAD ثم GET جزئي (Range: bytes=0-N) لكل صورة بالتوازي، ويقرأ أبعاد
+JPEG/PNG/WebP/GIF من الترويسة فقط. النتيجة: نوع المحتوى والحجم بالبايت والأبعاد.
+
+عند طلب البصمة المرئية (dHash) تُنزَّل الصورة كاملة مرة واحدة - يتطلب Pillow
+(اختياري)، ولذلك تُطلب فقط للمرشحات القليلة الباقية بعد فلترة الحجم والأبعاد.
+النتائج المؤكدة تُحفظ في كاش SQLite على القرص بمفتاح الرابط المُطبَّع،
+فالزيارات المتكررة لنفس صور CDN عبر التشغيلات والمواقع لا تلمس الشبكة.
+"""
+import sqlite3
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# عدد البايتات المطلوبة من بداية الملف - يكفي عادة لترويسة JPEG حتى مع بيانات EXIF
+PROBE_RANGE_BYTES = 32768
+PROBE_TIMEOUT = 10
+# أقصى حجم يُنزَّل كاملاً لحساب البصمة المرئية
+HASH_MAX_BYTES = 6 * 1024 * 1024
+# صلاحية نتائج الكاش بالأيام
+CACHE_TTL_DAYS = 30
+# ردود خطأ نهائية تُحفظ في الكاش (429 و5xx مؤقتة ولا تُحفظ)
+CACHEABLE_ERROR_STATUSES = (404, 410)
+PROBE_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+def parse_image_header(data):
+    """قراءة (النوع، العرض، الارتفاع) من أول بايتات الصورة، أو (None, None, None)"""
+    if data.startswith(b"\x89PNG\r\n\x1a\n") and len(data) >= 24 and data[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", data[16:24])
+        return "png", width, height
+
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        width, height = struct.unpack("<HH", data[6:10])
+        return "gif", width, height
+
+    if data.startswith(b"RIFF") and data[8:12] == b"WEBP" and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b"VP8 " and data[23:26] == b"\x9d\x01\x2a":
+            width, height = struct.unpack("<HH", data[26:30])
+            return "webp", width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L" and data[20:21] == b"\x2f":
+            bits = int.from_bytes(data[21:25], "little")
+            return "webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            width = int.from_bytes(data[24:27], "little") + 1
+            height = int.from_bytes(data[27:30], "little") + 1
+            return "webp", width, height
+        return "webp", None, None
+
+    if data.startswith(b"\xff\xd8"):
+        # المرور على مقاطع JPEG حتى الوصول إلى SOF (يحمل الأبعاد)
+        offset = 2
+        while offset + 9 < len(data):
+            if data[offset] != 0xFF:
+                offset += 1
+                continue
+            marker = data[offset + 1]
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+                offset += 1 if marker == 0xFF else 2
+                continue
+            segment_length = struct.unpack(">H", data[offset + 2:offset + 4])[0]
+            if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+                height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+                return "jpeg", width, height
+            offset += 2 + segment_length
+        return "jpeg", None, None
+
+    return None, None, None
+
+def compute_dhash(data):
+    """بصمة dHash بطول 64 بت (نص hex) من بيانات الصورة، أو None بدون Pillow"""
+    if Image is None:
+        return None
+    import io
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            pixels = list(img.convert("L").resize((9, 8)).getdata())
+    except Exception:
+        return None
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{value:016x}"
+
+def hash_distance(hash1, hash2):
+    """مسافة Hamming بين بصمتين (None إذا كانت إحداهما مفقودة)"""
+    if not hash1 or not hash2:
+        return None
+    return bin(int(hash1, 16) ^ int(hash2, 16)).count("1")
+
+def normalize_image_url(url):
+    """مفتاح الكاش: https، نطاق بأحرف صغيرة بدون www، بدون #"""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return urlunsplit(("https", host, parts.path, parts.query, ""))
+
+def probe_image(url, session=None, range_bytes=PROBE_RANGE_BYTES, timeout=PROBE_TIMEOUT, compute_hash=False,
+                hash_max_bytes=HASH_MAX_BYTES):
+    """فحص صورة واحدة: HEAD للحجم والنوع ثم GET جزئي للأبعاد (أو GET كامل للبصمة بدون HEAD)"""
+    http = session or requests
+    headers = {"User-Agent": PROBE_USER_AGENT}
+    result = {
+        "url": url, "ok": False, "status": None, "content_type": None,
+        "bytes": None, "format": None, "width": None, "height": None, "dhash": None, "error": None
+    }
+    # البصمة تحتاج الملف كاملاً، فنتجاوز Range حين يكون Pillow متاحاً
+    full_download = compute_hash and Image is not None
+    read_limit = hash_max_bytes if full_download else range_bytes
+
+    try:
+        # التنزيل الكامل يعطي الحجم من ردّ GET نفسه، فلا حاجة لـ HEAD
+        if not full_download:
+            head = http.head(url, headers=headers, timeout=timeout, allow_redirects=True)
+            result["status"] = head.status_code
+            if head.ok:
+                result["content_type"] = head.headers.get("Content-Type")
+                if head.headers.get("Content-Length"):
+                    result["bytes"] = int(head.headers["Content-Length"])
+
+        get_headers = headers if full_download else {**headers, "Range": f"bytes=0-{range_bytes - 1}"}
+        response = http.get(url, headers=get_headers, timeout=timeout, stream=True, allow_redirects=True)
+        try:
+            result["status"] = response.status_code
+            if not response.ok:
+                return result
+
+            result["content_type"] = response.headers.get("Content-Type") or result["content_type"]
+            content_range = response.headers.get("Content-Range", "")
+            if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+                result["bytes"] = int(content_range.rsplit("/", 1)[1])
+            elif response.status_code == 200 and response.headers.get("Content-Length"):
+                result["bytes"] = int(response.headers["Content-Length"])
+
+            # ملف أكبر من حد البصمة: تكفي الترويسة للأبعاد
+            if full_download and result["bytes"] and result["bytes"] > hash_max_bytes:
+                full_download = False
+                read_limit = range_bytes
+
+            # إن تجاهل الخادم Range نقرأ أول range_bytes فقط ونغلق الاتصال
+            data = b""
+            for chunk in response.iter_content(chunk_size=8192):
+                data += chunk
+                if len(data) >= read_limit:
+                    break
+        finally:
+            response.close()
+
+        result["format"], result["width"], result["height"] = parse_image_header(data[:range_bytes])
+        if full_download and len(data) < read_limit:
+            result["bytes"] = result["bytes"] or len(data)
+            result["dhash"] = compute_dhash(data)
+        result["ok"] = result["format"] is not None
+        if not result["ok"]:
+            result["error"] = "unrecognized image header"
+    except (requests.RequestException, ValueError, struct.error) as e:
+        result["error"] = str(e)[:200]
+
+    return result
+
+def open_image_cache(path):
+    """فتح كاش بيانات الصور (SQLite) وإنشاء الجدول"""
+    import os
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS images (
+            url_key TEXT PRIMARY KEY,
+            status INTEGER,
+            content_type TEXT,
+            bytes INTEGER,
+            format TEXT,
+            width INTEGER,
+            height INTEGER,
+            dhash TEXT,
+            probed_at REAL NOT NULL
+        )
+    """)
+    return conn
+
+CACHED_FIELDS = ("status", "content_type", "bytes", "format", "width", "height", "dhash")
+
+def load_cached_probes(conn, urls, need_hash=False):
+    """قراءة نتائج الفحص المحفوظة والصالحة لقائمة روابط"""
+    cached = {}
+    min_time = time.time() - CACHE_TTL_DAYS * 86400
+    for url in urls:
+        row = conn.execute(
+            f"SELECT {', '.join(CACHED_FIELDS)} FROM images WHERE url_key = ? AND probed_at >= ?",
+            (normalize_image_url(url), min_time)
+        ).fetchone()
+        if row is None:
+            continue
+        result = {"url": url, "error": None, **dict(zip(CACHED_FIELDS, row))}
+        result["ok"] = result["format"] is not None
+        # نتيجة بدون بصمة لا تكفي إذا طُلبت البصمة ومعنا Pillow
+        if need_hash and Image is not None and result["ok"] and not result["dhash"]:
+            continue
+        cached[url] = result
+    return cached
+
+def is_cacheable_probe(result):
+    """فحص ناجح بأبعاد مقروءة، أو صورة غير موجودة نهائياً (404/410)"""
+    status = result["status"]
+    if status is None:
+        return False
+    if 200 <= status < 300:
+        return result["ok"]
+    return status in CACHEABLE_ERROR_STATUSES
+
+def store_probes(conn, results):
+    """حفظ النتائج المؤكدة فقط (أخطاء الشبكة وردود 429/5xx المؤقتة لا تُحفظ)"""
+    now = time.time()
+    rows = [
+        (normalize_image_url(result["url"]), *(result[field] for field in CACHED_FIELDS), now)
+        for result in results if is_cacheable_probe(result)
+    ]
+    conn.executemany(
+        f"INSERT OR REPLACE INTO images (url_key, {', '.join(CACHED_FIELDS)}, probed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    conn.commit()
+
+def probe_images(urls, max_workers=8, session=None, timeout=PROBE_TIMEOUT, cache_path=None, compute_hash=False,
+                 hash_max_bytes=HASH_MAX_BYTES):
+    """فحص عدة صور بالتوازي - يرجع قاموساً {url: النتيجة}، مع كاش اختياري على القرص"""
+    unique_urls = list(dict.fromkeys(urls))
+    if not unique_urls:
+        return {}
+
+    conn = open_image_cache(cache_path) if cache_path else None
+    try:
+        results = load_cached_probes(conn, unique_urls, compute_hash) if conn else {}
+        missing = [url for url in unique_urls if url not in results]
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missing)))) as executor:
+                fresh = list(executor.map(
+                    lambda url: probe_image(
+                        url, session=session, timeout=timeout, compute_hash=compute_hash, hash_max_bytes=hash_max_bytes
+                    ),
+                    missing
+                ))
+            results.update(zip(missing, fresh))
+            if conn:
+                store_probes(conn, fresh)
+    finally:
+        if conn:
+            conn.close()
+
+    return {url: results[url] for url in unique_urls}
@@ -0,0 +1,144 @@
+"""توحيد روابط الصور واختيار المقاس المناسب
+
+- قراءة srcset بواصفات العرض (800w) أو الكثافة (2x) واختيار أصغر نسخة تغطي
+  العرض المطلوب (عمود Medium حوالي 1400px).
+- فهم أنماط تغيير المقاس الشائعة في CDN: Cloudflare (/cdn-cgi/image/...)،
+  لاحقة WordPress (-300x200.jpg)، وJetpack/Photon (?w= و ?resize=).
+الهدف ألا نجلب الأصل الضخم ولا الصورة المصغّرة.
+"""
+import re
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+# عرض عمود Medium للصور الكاملة
+TARGET_IMAGE_WIDTH = 1400
+
+SRCSET_DESCRIPTOR = re.compile(r"\s+\d+(\.\d+)?[wx]\s*(,|$)")
+WP_SIZE_SUFFIX = re.compile(r"-(\d+)x(\d+)(\.(?:jpe?g|png|webp))$", re.IGNORECASE)
+JETPACK_HOST = re.compile(r"^i[0-3]\.wp\.com$")
+CDN_CGI_MARKER = "/cdn-cgi/image/"
+WP_UPLOADS_MARKER = "/wp-content/uploads/"
+
+def is_srcset(value):
+    """هل القيمة srcset (رابط أو أكثر مع واصفات) وليست رابطاً واحداً؟"""
+    return bool(SRCSET_DESCRIPTOR.search(value))
+
+def parse_srcset(srcset):
+    """تحليل srcset إلى قائمة (الرابط، العرض، الكثافة) حسب قواعد HTML
+
+    الروابط قد تحتوي فواصل (مثل خيارات cdn-cgi) لذا نقرأ الرابط حتى أول مسافة
+    ثم الواصفات حتى الفاصلة التالية.
+    """
+    candidates = []
+    position = 0
+    length = len(srcset)
+    while position < length:
+        while position < length and (srcset[position].isspace() or srcset[position] == ","):
+            position += 1
+        if position >= length:
+            break
+
+        start = position
+        while position < length and not srcset[position].isspace():
+            position += 1
+        url = srcset[start:position]
+
+        descriptors = ""
+        if url.endswith(","):
+            url = url.rstrip(",")
+        else:
+            start = position
+            while position < length and srcset[position] != ",":
+                position += 1
+            descriptors = srcset[start:position].strip()
+
+        width = density = None
+        for descriptor in descriptors.split():
+            try:
+                if descriptor.endswith("w"):
+                    width = int(descriptor[:-1])
+                elif descriptor.endswith("x"):
+                    density = float(descriptor[:-1])
+            except ValueError:
+                pass
+        if url:
+            candidates.append((url, width, density))
+    return candidates
+
+def select_srcset_url(srcset, target_width=TARGET_IMAGE_WIDTH):
+    """أصغر نسخة بعرض >= المطلوب، أو الأكبر إن لم تكفِ أي نسخة"""
+    candidates = parse_srcset(srcset)
+    if not candidates:
+        return srcset.strip()
+
+    with_width = [(width, url) for url, width, _ in candidates if width]
+    if with_width:
+        large_enough = [item for item in with_width if item[0] >= target_width]
+        return min(large_enough)[1] if large_enough else max(with_width)[1]
+
+    # بدون واصفات عرض لا نعرف المقاس الحقيقي، فالكثافة الأعلى أقرب للمطلوب
+    return max(candidates, key=lambda item: item[2] or 1.0)[0]
+
+def canonicalize_cdn_cgi(url, target_width):
+    """Cloudflare: /cdn-cgi/image/<خيارات>/<المصدر> - توحيد العرض على المطلوب"""
+    parts = urlsplit(url)
+    prefix, _, rest = parts.path.partition(CDN_CGI_MARKER)
+    options, _, source = rest.partition("/")
+    if not source:
+        return url
+
+    kept = [
+        option for option in options.split(",")
+        if option and option.split("=", 1)[0] not in ("width", "w", "height", "h", "fit")
+    ]
+    options = ",".join([f"width={target_width}"] + kept)
+
+    if source.startswith(("http:/", "https:/")):
+        source = re.sub(r"^(https?):/+", r"\1://", source)
+        return f"{parts.scheme}://{parts.netloc}{prefix}{CDN_CGI_MARKER}{options}/{source}"
+    return urlunsplit((parts.scheme, parts.netloc, f"{prefix}{CDN_CGI_MARKER}{options}/{source}", parts.query, ""))
+
+def canonicalize_jetpack(url, target_width):
+    """Jetpack/Photon: استبدال w/resize/fit بعرض واحد (لا يكبّر أكبر من الأصل)"""
+    parts = urlsplit(url)
+    query = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in ("w", "h", "resize", "fit")
+    ]
+    query.append(("w", str(target_width)))
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+
+def canonicalize_wordpress_size(url, target_width):
+    """WordPress: name-300x200.jpg نسخة مصغرة - نرجع للأصل إن كانت أصغر من المطلوب
+
+    فقط داخل /wp-content/uploads/، فملف مثل banner-300x250.jpg في موقع آخر اسمه الحقيقي.
+    """
+    parts = urlsplit(url)
+    if WP_UPLOADS_MARKER not in parts.path:
+        return url
+    match = WP_SIZE_SUFFIX.search(parts.path)
+    if not match or int(match.group(1)) >= target_width:
+        return url
+    path = parts.path[:match.start()] + match.group(3)
+    return urlunsplit((parts.scheme, parts.netloc, path, parts.query, ""))
+
+def canonicalize_image_url(src, base_url, target_width=TARGET_IMAGE_WIDTH):
+    """srcset أو رابط نسبي أو رابط CDN -> رابط مطلق بالمقاس المناسب"""
+    url = src.strip()
+    # نسخة srcset اختيرت بمقاسها عمداً، فلا نرجع منها إلى الأصل الضخم بحذف -WxH
+    from_srcset = is_srcset(url)
+    if from_srcset:
+        url = select_srcset_url(url, target_width)
+
+    url = urljoin(base_url, url)
+    parts = urlsplit(url)
+    query_keys = {key for key, _ in parse_qsl(parts.query)}
+
+    if CDN_CGI_MARKER in parts.path:
+        url = canonicalize_cdn_cgi(url, target_width)
+        return url if from_srcset else canonicalize_wordpress_size(url, target_width)
+    if JETPACK_HOST.match(parts.netloc.lower()) or (query_keys & {"w", "resize", "fit"} and "/wp-content/" in parts.path):
+        # Photon لا يكبّر النسخة المصغرة، لذا نرجع للأصل قبل ضبط العرض
+        return canonicalize_jetpack(canonicalize_wordpress_size(url, target_width), target_width)
+    if from_srcset:
+        return url
+    return canonicalize_wordpress_size(url, target_width)
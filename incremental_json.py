@@ -0,0 +1,111 @@
+"""محلل JSON تدريجي لكائن واحد يصل على دفعات (بث Gemini)
+
+يُغذّى بالنص كما يصل، ويُرجع حقول المستوى الأعلى فور اكتمال كل قيمة، فيصل
+new_title والوسوم قبل انتهاء new_html_content. أي نص قبل أول { (مثل ```json)
+يُتجاهل، وكذلك ما بعد القوس الأخير - بدل التعبير الجشع \\{.*\\}.
+"""
+import json
+
+class IncrementalObjectParser:
+    """feed(text) يرجع قائمة (المفتاح، القيمة) للحقول التي اكتملت في هذه الدفعة"""
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.started = False
+        self.done = False
+        # قيمة تالفة (مثل [1,,2]): يتوقف التحليل وتُعتبر النتيجة غير صالحة
+        self.failed = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.token_start = 0
+        # key -> colon -> value -> (value_string | value_nested | value_scalar) -> comma
+        self.expecting = "key"
+        self.key = None
+        self.fields = {}
+
+    def _fail(self):
+        self.failed = True
+        self.done = True
+
+    def _emit(self, text, completed):
+        try:
+            value = json.loads(text)
+        except ValueError:
+            self._fail()
+            return
+        self.fields[self.key] = value
+        completed.append((self.key, value))
+        self.expecting = "comma"
+
+    def feed(self, text):
+        self.buffer += text
+        completed = []
+        buffer = self.buffer
+
+        while self.position < len(buffer) and not self.done:
+            index = self.position
+            char = buffer[index]
+            self.position += 1
+
+            if not self.started:
+                if char == "{":
+                    self.started = True
+                    self.depth = 1
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1 and self.expecting == "key_string":
+                        try:
+                            self.key = json.loads(buffer[self.token_start:index + 1])
+                        except ValueError:
+                            self._fail()
+                            continue
+                        self.expecting = "colon"
+                    elif self.depth == 1 and self.expecting == "value_string":
+                        self._emit(buffer[self.token_start:index + 1], completed)
+                continue
+
+            if char == '"':
+                self.in_string = True
+                if self.depth == 1 and self.expecting in ("key", "value"):
+                    self.token_start = index
+                    self.expecting = f"{self.expecting}_string"
+            elif char in "{[":
+                if self.depth == 1 and self.expecting == "value":
+                    self.token_start = index
+                    self.expecting = "value_nested"
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 1 and self.expecting == "value_nested":
+                    self._emit(buffer[self.token_start:index + 1], completed)
+                elif self.depth == 0:
+                    if self.expecting == "value_scalar":
+                        self._emit(buffer[self.token_start:index].strip(), completed)
+                    self.done = True
+            elif self.depth == 1:
+                if char == ":" and self.expecting == "colon":
+                    self.expecting = "value"
+                elif char == ",":
+                    if self.expecting == "value_scalar":
+                        self._emit(buffer[self.token_start:index].strip(), completed)
+                    self.expecting = "key"
+                elif not char.isspace() and self.expecting == "value":
+                    self.token_start = index
+                    self.expecting = "value_scalar"
+
+        return completed
+
+def parse_json_object(text):
+    """تحليل نص كامل: أول كائن JSON فيه، أو None إن لم يكتمل أو كان تالفاً"""
+    parser = IncrementalObjectParser()
+    parser.feed(text)
+    return parser.fields if parser.done and not parser.failed else None
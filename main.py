@@ -1,17 +1,18 @@
 import feedparser
 import os
+import atexit
+import threading
 import time
 import re
 import requests
 import json
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome.service import Service as ChromeService
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium_stealth import stealth
+import html
+from collections import OrderedDict
+from contextlib import contextmanager
+from http_client import TIMEOUTS, close_session, get_session
+from incremental_json import parse_json_object
+from gemini_schema import FIELD_SCHEMAS, build_repair_prompt, sanitize_rewrite, structured_generation_config, validate_rewrite
+# Selenium يُستورد داخل الدوال فقط حتى يبقى مسار "لا جديد" سريعاً بدون تحميله
 
 # --- برمجة ahmed si - النسخة v34 Optimized ---
 
@@ -36,27 +37,801 @@ IMAGE_PATHS = [
 TEST_MODE = os.environ.get("TEST_MODE", "false").lower() == "true"
 # ==========================================
 
-POSTED_LINKS_FILE = "posted_links.txt"
+POSTED_LINKS_FILE = "posted_links.txt"  # السجل القديم - يُستورد مرة واحدة إلى قاعدة البيانات
+STATE_DB_FILE = os.environ.get("STATE_DB_FILE", "articles.db")
+# مفاتيح payload التي تُحذف عند النشر (HTML النهائي وبيانات الصور)
+PUBLISHED_DROP_KEYS = ("post", "images")
+# أقصى عدد لمحاولات النشر الفاشلة قبل تجاوز المقال (لتجنب النشر المكرر)
+MAX_PUBLISH_ATTEMPTS = int(os.environ.get("MAX_PUBLISH_ATTEMPTS", "2"))
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 
-def get_posted_links():
-    if not os.path.exists(POSTED_LINKS_FILE): return set()
-    with open(POSTED_LINKS_FILE, "r", encoding='utf-8') as f: return set(line.strip() for line in f)
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.0-flash")
+# نماذج بديلة بالترتيب: للتحوّط عند البطء وللانتقال عند نفاد الحصة
+GEMINI_FALLBACK_MODELS = [model.strip() for model in os.environ.get("GEMINI_FALLBACK_MODELS", "gemini-2.0-flash-lite").split(",") if model.strip()]
+# التحوّط بعد تجاوز هذه النسبة المئوية من أزمنة النموذج الأخيرة (أو بعد الثواني الافتراضية قبل تجمّع عينات كافية)
+GEMINI_HEDGE_PERCENTILE = float(os.environ.get("GEMINI_HEDGE_PERCENTILE", "90"))
+GEMINI_HEDGE_AFTER_SECONDS = float(os.environ.get("GEMINI_HEDGE_AFTER_SECONDS", "30"))
+# حصص Gemini في الدقيقة (الطبقة المجانية لـ flash) وعدد محاولات 429/5xx
+GEMINI_RPM = int(os.environ.get("GEMINI_RPM", "15"))
+GEMINI_TPM = int(os.environ.get("GEMINI_TPM", "1000000"))
+GEMINI_MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", "4"))
+# البث: الحقول تصل فور اكتمالها، وتوقف التوليد يُكتشف بعد هذه الثواني بلا تقدم
+GEMINI_STREAM = os.environ.get("GEMINI_STREAM", "true").lower() == "true"
+GEMINI_STALL_SECONDS = float(os.environ.get("GEMINI_STALL_SECONDS", "20"))
 
-def add_posted_link(link):
-    with open(POSTED_LINKS_FILE, "a", encoding='utf-8') as f: f.write(link + "\n")
+# عناوين الخدمات الخارجية - تُغيَّر فقط لتشغيلها ضد بدائل محلية (benchmark.py)
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+MEDIUM_BASE_URL = os.environ.get("MEDIUM_BASE_URL", "https://medium.com").rstrip("/")
+MEDIUM_API_BASE = os.environ.get("MEDIUM_API_BASE", "https://api.medium.com").rstrip("/")
 
-def get_next_post_to_publish():
-    print(f"--- 1. البحث عن مقالات في: {RSS_URL}")
-    feed = feedparser.parse(RSS_URL)
-    if not feed.entries: return None
+# رفع الصور المختارة إلى Medium (رمز التكامل) أثناء عمل Gemini، فلا يجلبها Medium من موقع المصدر عند النشر
+MEDIUM_PREUPLOAD_IMAGES = os.environ.get("MEDIUM_PREUPLOAD_IMAGES", "true").lower() == "true"
+
+# واجهات النشر بالترتيب: api (رمز التكامل، طلب HTTP واحد) ثم browser (المحرر عبر BROWSER_BACKEND) كاحتياط
+PUBLISHERS = [name.strip() for name in os.environ.get("PUBLISHERS", "api,browser").split(",") if name.strip()]
+
+# محرك المتصفح: selenium (chromedriver) أو cdp (WebSocket مباشر إلى Chrome بدون chromedriver)
+BROWSER_BACKEND = os.environ.get("BROWSER_BACKEND", "selenium").lower()
+
+# وكيل المستخدم لطلبات HTTP المباشرة (الخلاصة وصفحات المقالات)
+SCRAPE_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+# مجلد الكاش المحلي (يُحفظ بين التشغيلات عبر actions/cache)
+CACHE_DIR = os.environ.get("CACHE_DIR", ".cache")
+
+# كاش ردود Gemini: مفتاحه بصمة الطلب الكامل
+GEMINI_CACHE_DIR = os.path.join(CACHE_DIR, "gemini")
+GEMINI_CACHE_TTL_HOURS = float(os.environ.get("GEMINI_CACHE_TTL_HOURS", "168"))
+GEMINI_CACHE_MAX_ENTRIES = int(os.environ.get("GEMINI_CACHE_MAX_ENTRIES", "500"))
+GEMINI_CACHE_BYPASS = os.environ.get("GEMINI_CACHE_BYPASS", "false").lower() == "true"
+
+# ميزانية الرموز لمحتوى الوصفة داخل طلب Gemini (ملخص JSON-LD أو المحتوى الرئيسي)
+PROMPT_CONTENT_TOKENS = int(os.environ.get("PROMPT_CONTENT_TOKENS", "500"))
+
+# إحصاءات زمن ونجاح كل نموذج (تحدد حد التحوّط عبر التشغيلات)
+MODEL_STATS_FILE = os.path.join(CACHE_DIR, "model_stats.json")
+
+# المتصفح: ملف تعريف Chrome دائم (كاش القرص) ومسار chromedriver المثبّت في manifest
+BROWSER_CACHE_DIR = os.path.join(CACHE_DIR, "browser")
+BROWSER_PROFILE_DIR = os.path.join(BROWSER_CACHE_DIR, "profile")
+DRIVER_MANIFEST_FILE = os.path.join(BROWSER_CACHE_DIR, "driver_manifest.json")
+BROWSER_PERSISTENT_PROFILE = os.environ.get("BROWSER_PERSISTENT_PROFILE", "true").lower() == "true"
+# حظر الصور والخطوط والمتتبعات أثناء تحميل المحرر (المتتبعات تبقى محظورة حتى النشر)
+PUBLISHER_BLOCK_RESOURCES = os.environ.get("PUBLISHER_BLOCK_RESOURCES", "true").lower() == "true"
+
+# كاش الخلاصة: آخر نسخة مع ETag/Last-Modified للطلبات الشرطية
+FEED_CACHE_DIR = os.path.join(CACHE_DIR, "feeds")
+
+# ميزانية الانتظار القصوى لكل مرحلة بالثواني - كل انتظار ينتهي فور تحقق شرطه
+WAIT_BUDGETS = {
+    "page_load": 15,
+    "scroll": 4,
+    "paste": 30,
+    "prepublish": 15,
+    "tags": 5,
+    "publish": 30,
+}
+
+# فحص الصور فعلياً (HEAD + Range) قبل اختيارها لاستبعاد الروابط الميتة والملفات الثقيلة
+IMAGE_PROBE_ENABLED = os.environ.get("IMAGE_PROBE_ENABLED", "true").lower() == "true"
+IMAGE_PROBE_WORKERS = int(os.environ.get("IMAGE_PROBE_WORKERS", "8"))
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", str(4 * 1024 * 1024)))
+# عدد المرشحات (بعد الفلترة) التي تُنزَّل كاملة لحساب البصمة المرئية
+IMAGE_HASH_CANDIDATES = int(os.environ.get("IMAGE_HASH_CANDIDATES", "6"))
+MIN_IMAGE_WIDTH = 200
+PREFERRED_IMAGE_WIDTH = 700
+# العرض المطلوب عند اختيار نسخة من srcset أو ضبط مقاس CDN (عمود Medium)
+TARGET_IMAGE_WIDTH = int(os.environ.get("TARGET_IMAGE_WIDTH", "1400"))
+# كاش بيانات الصور (الأبعاد والحجم وبصمة dHash) مشترك بين التشغيلات والمواقع
+IMAGE_CACHE_FILE = os.path.join(CACHE_DIR, "images.db")
+# صورتان بمسافة Hamming أقل من هذا الحد تُعتبران نفس الصورة بمقاس أو مسار مختلف
+NEAR_DUPLICATE_DISTANCE = 10
+
+# ملف تتبع زمن المراحل (سطر JSON لكل تشغيل) - يُرفع مع لقطات الشاشة
+TRACE_FILE = os.environ.get("TRACE_FILE", "run_trace.jsonl")
+
+# سجل المواقع (JSON أو YAML): عند وجود الملف تُعالج كل المواقع فيه، وإلا يُستخدم الموقع أعلاه
+SITES_FILE = os.environ.get("SITES_FILE", "sites.json")
+SITE_WORKERS = int(os.environ.get("SITE_WORKERS", "8"))
+
+# وضع الدفعات: عدد المقالات في كل تشغيل وعدد عمال التجهيز
+MAX_POSTS = int(os.environ.get("MAX_POSTS", "1"))
+PREPARE_WORKERS = int(os.environ.get("PREPARE_WORKERS", "3"))
+# أمر prepare يملأ طابور المقالات الجاهزة حتى هذا العدد، وأمر publish يسحب منه فقط
+QUEUE_TARGET = int(os.environ.get("QUEUE_TARGET", "4"))
+
+# ====== سجل المواقع ======
+# قوالب CTA الافتراضية - المتغيرات المتاحة: {link} و{domain} و{title}
+DEFAULT_MID_CTAS = [
+    '💡 <em>Want to see the exact measurements and timing? Check out <a href="{link}" rel="noopener" target="_blank">the full recipe on {domain}</a></em>',
+    '👉 <em>Get all the ingredients and detailed steps for {title} on <a href="{link}" rel="noopener" target="_blank">{domain}</a></em>',
+    '📖 <em>Find the printable version with nutrition facts at <a href="{link}" rel="noopener" target="_blank">{domain}</a></em>',
+    '🍳 <em>See step-by-step photos and pro tips on <a href="{link}" rel="noopener" target="_blank">{domain}</a></em>'
+]
+
+DEFAULT_FINAL_CTA = '''
+    <br>
+    <hr>
+    <h3>Ready to Make This Recipe?</h3>
+    <p><strong>🎯 Get the complete recipe with:</strong></p>
+    <ul>
+        <li>Exact measurements and ingredients list</li>
+        <li>Step-by-step instructions with photos</li>
+        <li>Prep and cooking times</li>
+        <li>Nutritional information</li>
+        <li>Storage and serving suggestions</li>
+    </ul>
+    <p><strong>👉 Visit <a href="{link}" rel="noopener" target="_blank">{domain}</a> for the full recipe and more delicious ideas!</strong></p>
+    '''
+
+def make_site(name, domain=None, rss_url=None, image_paths=None, mid_ctas=None, final_cta=None,
+              state_namespace=None, max_posts=None):
+    """بناء إعدادات موقع مع القيم الافتراضية"""
+    domain = domain or f"{name}.com"
+    return {
+        "name": name,
+        "domain": domain,
+        "rss_url": rss_url or f"https://{domain}/feed",
+        "image_paths": image_paths or [path for path in IMAGE_PATHS if path != f"/{SITE_NAME}"] + [f"/{name}"],
+        "mid_ctas": mid_ctas or DEFAULT_MID_CTAS,
+        "final_cta": final_cta or DEFAULT_FINAL_CTA,
+        "state_namespace": state_namespace or name,
+        "max_posts": max_posts
+    }
+
+DEFAULT_SITE = make_site(SITE_NAME, SITE_DOMAIN, RSS_URL, IMAGE_PATHS)
+
+def read_sites_registry(path):
+    """قراءة ملف السجل: JSON، أو YAML إن كان الامتداد .yml/.yaml (يتطلب PyYAML)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.lower().endswith((".yml", ".yaml")):
+            import yaml
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+def load_sites():
+    """قراءة سجل المواقع من SITES_FILE، أو الموقع الافتراضي إن لم يوجد الملف"""
+    if not os.path.exists(SITES_FILE):
+        return [DEFAULT_SITE]
+    
+    import inspect
+    registry = read_sites_registry(SITES_FILE)
+    allowed_keys = set(inspect.signature(make_site).parameters) | {"enabled"}
+    
+    sites = []
+    for index, config in enumerate(registry.get("sites", []), 1):
+        label = config.get("name") or f"#{index}"
+        unknown = sorted(set(config) - allowed_keys)
+        if unknown or not config.get("name"):
+            problem = f"مفاتيح غير معروفة {unknown}" if unknown else "المفتاح name مفقود"
+            print(f"!!! ❌ تجاهل الموقع {label} في {SITES_FILE}: {problem} (المسموح: {sorted(allowed_keys)})")
+            continue
+        if not config.pop("enabled", True):
+            continue
+        sites.append(make_site(**config))
+    
+    print(f"--- 🗂️ تم تحميل {len(sites)} موقع من {SITES_FILE}")
+    return sites
+
+# ====== جلسة المتصفح المشتركة ======
+# متصفح واحد لكل عملية يستعيره الكاشط والناشر بدل تشغيل Chrome مرتين
+_shared_driver = None
+# المتصفح غير آمن للخيوط، لذلك يستعيره خيط واحد فقط في كل مرة
+_browser_lock = threading.RLock()
+# هل يعمل المتصفح الحالي بالملف الدائم (فتُحذف ملفات الجلسة منه عند الإغلاق)
+_browser_uses_profile = False
+
+def browser_profile_dir():
+    """ملف التعريف الدائم إن كان متاحاً، وإلا None (ملف مؤقت فارغ)"""
+    global _browser_uses_profile
+    from browser_setup import prepare_profile_dir
+    
+    _browser_uses_profile = False
+    if not BROWSER_PERSISTENT_PROFILE:
+        return None
+    ready, warm = prepare_profile_dir(BROWSER_PROFILE_DIR)
+    if not ready:
+        print("    ⚠️ ملف تعريف Chrome مستخدم من عملية أخرى - تشغيل بملف مؤقت")
+        trace_annotate_run(browser_profile="busy")
+        return None
+    trace_annotate_run(browser_profile="warm" if warm else "cold")
+    _browser_uses_profile = True
+    return BROWSER_PROFILE_DIR
+
+def chromedriver_path():
+    """مسار chromedriver من manifest المحلي، ولا يُسأل عنه الشبكة إلا عند تغيّر إصدار Chrome"""
+    from browser_setup import resolve_driver_path
+    from cdp_driver import CDPError, find_chrome_binary
+    
+    try:
+        chrome_binary = find_chrome_binary()
+    except CDPError:
+        chrome_binary = None
+    path, source = resolve_driver_path(
+        DRIVER_MANIFEST_FILE, chrome_binary, download_dir=os.path.join(BROWSER_CACHE_DIR, "drivers")
+    )
+    print(f"    🧭 chromedriver ({source}): {path}")
+    trace_annotate_run(driver_source=source)
+    return path
+
+def create_stealth_driver():
+    """تشغيل متصفح Chrome مخفي مع إعدادات stealth"""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service as ChromeService
+    from selenium_stealth import stealth
+    from browser_setup import profile_arguments
+    
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+    options.add_argument("window-size=1920,1080")
+    options.add_argument("--disable-blink-features=AutomationControlled")
+    profile_dir = browser_profile_dir()
+    if profile_dir:
+        options.add_argument(f"--user-data-dir={os.path.abspath(profile_dir)}")
+        for argument in profile_arguments():
+            options.add_argument(argument)
+    
+    service = ChromeService(chromedriver_path())
+    driver = webdriver.Chrome(service=service, options=options)
+    
+    stealth(driver,
+            languages=["en-US", "en"],
+            vendor="Google Inc.",
+            platform="Win32",
+            webgl_vendor="Intel Inc.",
+            renderer="Intel Iris OpenGL Engine",
+            fix_hairline=True)
+    
+    return driver
+
+def create_cdp_driver():
+    """تشغيل Chrome والتحكم به عبر CDP مباشرة (بدون chromedriver ولا تنزيله)"""
+    from cdp_driver import CDPDriver
+    from browser_setup import profile_arguments
+    
+    profile_dir = browser_profile_dir()
+    return CDPDriver(
+        user_data_dir=os.path.abspath(profile_dir) if profile_dir else None, headless=True, stealth=True,
+        extra_args=profile_arguments() if profile_dir else ()
+    )
+
+def create_browser():
+    """تشغيل المتصفح حسب BROWSER_BACKEND"""
+    if BROWSER_BACKEND == "cdp":
+        return create_cdp_driver()
+    return create_stealth_driver()
+
+def is_cdp_driver(driver):
+    return getattr(driver, "is_cdp", False)
+
+def reset_browser(driver):
+    """إعادة ضبط المتصفح بين الاستخدامات: إغلاق التبويبات الإضافية ومسح الكوكيز"""
+    from browser_setup import set_blocked_resources
+    
+    # الكاشط يحتاج الصور التي ربما حظرها الناشر
+    set_blocked_resources(driver, block_media=False, block_trackers=False)
+    if is_cdp_driver(driver):
+        driver.reset()
+        return
+    handles = driver.window_handles
+    for handle in handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(handles[0])
+    driver.get("about:blank")
+    # delete_all_cookies تمسح كوكيز النطاق الحالي فقط، لذلك نمسح الكل عبر CDP
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+
+def get_browser():
+    """استعارة المتصفح المشترك - يُشغَّل مرة واحدة فقط لكل عملية"""
+    global _shared_driver
+    
+    if _shared_driver is not None:
+        try:
+            reset_browser(_shared_driver)
+            return _shared_driver
+        except Exception as e:
+            print(f"    ⚠️ المتصفح المشترك لا يستجيب، سيتم إعادة تشغيله: {str(e)[:100]}")
+            close_browser()
+    
+    print(f"--- 🌐 تشغيل متصفح Chrome المشترك ({BROWSER_BACKEND})...")
+    with trace_span("browser_start", backend=BROWSER_BACKEND):
+        _shared_driver = create_browser()
+    return _shared_driver
+
+# يُطفأ عندما لن يُستخدم المتصفح للنشر (أمر prepare، أو النشر عبر الواجهة البرمجية)
+_browser_prewarm = True
+
+def prewarm_browser():
+    """تشغيل Chrome مسبقاً في خيط خلفي حتى يكون جاهزاً عند النشر"""
+    if TEST_MODE or not _browser_prewarm or _shared_driver is not None:
+        return
+    
+    def warm():
+        try:
+            with _browser_lock:
+                if _shared_driver is None:
+                    get_browser()
+        except Exception as e:
+            print(f"    ⚠️ فشل التشغيل المسبق للمتصفح: {str(e)[:100]}")
+    
+    threading.Thread(target=warm, name="browser-prewarm", daemon=True).start()
+
+def close_browser():
+    """إغلاق المتصفح المشترك إن كان يعمل، بدون ترك جلسة Medium في الملف الدائم"""
+    global _shared_driver
+    from browser_setup import clear_session_data, scrub_profile_dir
+    
+    if _shared_driver is None:
+        return
+    if _browser_uses_profile:
+        try:
+            clear_session_data(_shared_driver, list(dict.fromkeys([MEDIUM_BASE_URL, "https://medium.com"])))
+        except Exception as e:
+            print(f"    ⚠️ تعذر مسح جلسة المتصفح عبر CDP: {str(e)[:100]}")
+    try:
+        _shared_driver.quit()
+    except Exception:
+        pass
+    _shared_driver = None
+    if _browser_uses_profile:
+        # احتياط إن فشل المسح عبر CDP: ملفات الكوكيز والتخزين تُحذف من القرص
+        scrub_profile_dir(BROWSER_PROFILE_DIR)
+
+atexit.register(close_browser)
+
+# ====== محرك الانتظار ======
+# بدل time.sleep الثابتة: شروط WebDriverWait، استقرار DOM عبر MutationObserver، وخمول الشبكة
+
+DOM_SETTLED_JS = """
+const quietMs = arguments[0], timeoutMs = arguments[1], done = arguments[arguments.length - 1];
+const start = Date.now();
+let quietTimer = null, hardTimer = null;
+const observer = new MutationObserver(() => {
+    clearTimeout(quietTimer);
+    quietTimer = setTimeout(() => finish(true), quietMs);
+});
+function finish(settled) {
+    observer.disconnect();
+    clearTimeout(quietTimer);
+    clearTimeout(hardTimer);
+    done({settled: settled, elapsed: Date.now() - start});
+}
+observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+quietTimer = setTimeout(() => finish(true), quietMs);
+hardTimer = setTimeout(() => finish(false), timeoutMs);
+"""
+
+NETWORK_IDLE_JS = """
+const idleMs = arguments[0], timeoutMs = arguments[1], done = arguments[arguments.length - 1];
+const start = Date.now();
+let lastCount = -1, stableSince = Date.now();
+function pendingImages() {
+    return Array.from(document.images).filter(img => img.src && !img.complete).length;
+}
+function check() {
+    const count = performance.getEntriesByType('resource').length;
+    if (count !== lastCount || pendingImages() > 0) {
+        lastCount = count;
+        stableSince = Date.now();
+    }
+    if (Date.now() - stableSince >= idleMs) return done({idle: true, elapsed: Date.now() - start});
+    if (Date.now() - start >= timeoutMs) return done({idle: false, elapsed: Date.now() - start});
+    setTimeout(check, 100);
+}
+check();
+"""
+
+def wait_for_condition(driver, condition, stage, timeout=None):
+    """انتظار شرط WebDriverWait ضمن ميزانية المرحلة - يرجع النتيجة أو None عند انتهاء المهلة"""
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import TimeoutException
+    
+    timeout = timeout or WAIT_BUDGETS[stage]
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=0.2).until(condition)
+    except TimeoutException:
+        print(f"    ⏱️ انتهت مهلة الانتظار ({stage}: {timeout}s)")
+        return None
+
+def run_async_wait(driver, script, quiet_ms, stage, timeout=None):
+    """تشغيل سكربت انتظار غير متزامن داخل الصفحة ضمن ميزانية المرحلة"""
+    timeout = timeout or WAIT_BUDGETS[stage]
+    driver.set_script_timeout(timeout + 5)
+    try:
+        return driver.execute_async_script(script, quiet_ms, int(timeout * 1000))
+    except Exception as e:
+        print(f"    ⚠️ تعذر الانتظار ({stage}): {str(e)[:100]}")
+        return None
+
+def wait_for_dom_settled(driver, stage, quiet_ms=500, timeout=None):
+    """الانتظار حتى يتوقف تغيّر DOM لمدة quiet_ms"""
+    result = run_async_wait(driver, DOM_SETTLED_JS, quiet_ms, stage, timeout)
+    return bool(result and result.get("settled"))
+
+def wait_for_network_idle(driver, stage, idle_ms=500, timeout=None):
+    """الانتظار حتى تتوقف طلبات الموارد الجديدة وتكتمل كل الصور"""
+    if is_cdp_driver(driver):
+        # أحداث Network تعرف الطلبات المعلقة فعلاً بدل عدّ الموارد من داخل الصفحة
+        idle = driver.wait_for_network_idle(idle_ms, timeout or WAIT_BUDGETS[stage])
+        if not idle:
+            print(f"    ⏱️ انتهت مهلة الانتظار ({stage}: {timeout or WAIT_BUDGETS[stage]}s)")
+        return idle
+    result = run_async_wait(driver, NETWORK_IDLE_JS, idle_ms, stage, timeout)
+    return bool(result and result.get("idle"))
+
+def wait_for_document_ready(driver, stage="page_load"):
+    """الانتظار حتى يكتمل تحميل المستند"""
+    if is_cdp_driver(driver):
+        return driver.wait_for_load(WAIT_BUDGETS[stage])
+    return wait_for_condition(
+        driver, lambda d: d.execute_script("return document.readyState") == "complete", stage
+    )
+
+# ====== تتبع زمن المراحل ======
+# كل تشغيل يضيف سجلاً واحداً (JSONL) فيه مدة كل مرحلة وعدد البايتات والصور واستهلاك Gemini
+_run_trace = None
+_trace_lock = threading.Lock()
+_trace_local = threading.local()
+
+def start_run_trace():
+    """بدء سجل تتبع جديد لهذا التشغيل"""
+    global _run_trace
+    from datetime import datetime
+    _run_trace = {
+        "run_id": os.environ.get("GITHUB_RUN_ID") or datetime.now().strftime("%Y%m%d%H%M%S"),
+        "started_at": datetime.now().isoformat(),
+        "start": time.perf_counter(),
+        "spans": []
+    }
+
+@contextmanager
+def trace_span(name, **attrs):
+    """قياس مدة مرحلة؛ يمكن إضافة بيانات إليها عبر القاموس المُرجع أو trace_annotate"""
+    span = {"name": name, **attrs}
+    stack = getattr(_trace_local, "stack", None)
+    if stack is None:
+        stack = _trace_local.stack = []
+    stack.append(span)
+    start = time.perf_counter()
+    try:
+        yield span
+        span.setdefault("status", "ok")
+    except Exception as e:
+        span["status"] = "error"
+        span["error"] = str(e)[:200]
+        raise
+    finally:
+        span["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        stack.pop()
+        if _run_trace is not None:
+            with _trace_lock:
+                _run_trace["spans"].append(span)
+
+def trace_annotate(**attrs):
+    """إضافة بيانات إلى المرحلة الجارية في الخيط الحالي (إن وجدت)"""
+    stack = getattr(_trace_local, "stack", None)
+    if stack:
+        stack[-1].update(attrs)
+
+def trace_annotate_run(**attrs):
+    """إضافة بيانات على مستوى التشغيل كله (عدد المواقع والمقالات...)"""
+    if _run_trace is not None:
+        with _trace_lock:
+            _run_trace.setdefault("attrs", {}).update(attrs)
+
+def finish_run_trace(outcome, **attrs):
+    """حساب الإجماليات وإضافة سجل التشغيل إلى TRACE_FILE"""
+    global _run_trace
+    if _run_trace is None:
+        return
+    
+    trace = _run_trace
+    _run_trace = None
+    
+    stage_totals = {}
+    gemini_tokens = 0
+    for span in trace["spans"]:
+        stage_totals[span["name"]] = round(stage_totals.get(span["name"], 0) + span["duration_ms"], 1)
+        gemini_tokens += span.get("total_tokens", 0)
+    
+    record = {
+        "run_id": trace["run_id"],
+        "started_at": trace["started_at"],
+        "duration_ms": round((time.perf_counter() - trace["start"]) * 1000, 1),
+        "outcome": outcome,
+        "stage_totals_ms": stage_totals,
+        "gemini_total_tokens": gemini_tokens,
+        **trace.get("attrs", {}),
+        **attrs,
+        "spans": trace["spans"]
+    }
+    
+    try:
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"📈 تم حفظ تتبع التشغيل في {TRACE_FILE} ({record['duration_ms']:.0f}ms)")
+    except OSError as e:
+        print(f"    ⚠️ تعذر حفظ تتبع التشغيل: {e}")
+
+# ====== مخزن حالة المقالات (SQLite) ======
+# صف واحد لكل رابط مقال مُطبَّع مع حالته: discovered → scraped → rewritten → published / failed
+# unconfirmed: ربما نُشر ولم يتأكد ذلك - لا يُعاد تلقائياً ويحتاج تحققاً يدوياً من حساب Medium
+_state_db = None
+_state_db_lock = threading.RLock()
+
+def normalize_article_url(url):
+    """تطبيع رابط المقال: https، بدون www، بدون utm_* أو # أو / في النهاية"""
+    from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query) if not key.lower().startswith("utm_")
+    ))
+    return urlunsplit(("https", host, path, query, ""))
+
+def get_state_db():
+    """فتح قاعدة بيانات الحالة (مرة واحدة لكل عملية) وإنشاء الجداول"""
+    global _state_db
+    with _state_db_lock:
+        if _state_db is not None:
+            return _state_db
+        
+        import sqlite3
+        conn = sqlite3.connect(STATE_DB_FILE, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS articles (
+                url_key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                site TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                medium_url TEXT,
+                payload TEXT,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_articles_site_state ON articles(site, state);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        import_posted_links_file(conn)
+        prune_published_payloads(conn)
+        _state_db = conn
+        return conn
+
+def close_state_db():
+    """إغلاق قاعدة البيانات (يدمج ملف WAL في الملف الرئيسي قبل حفظه في Git)"""
+    global _state_db
+    with _state_db_lock:
+        if _state_db is not None:
+            _state_db.close()
+            _state_db = None
+
+atexit.register(close_state_db)
+atexit.register(close_session)
+
+def prune_published_payloads(conn):
+    """حذف payload المقالات المنشورة (من إصدارات سابقة) ثم VACUUM لتصغير الملف فعلاً"""
+    cursor = conn.execute(
+        "UPDATE articles SET payload = NULL WHERE state = 'published' AND payload IS NOT NULL"
+    )
+    conn.commit()
+    if cursor.rowcount:
+        conn.execute("VACUUM")
+        print(f"--- 🗜️ تم حذف محتوى {cursor.rowcount} مقال منشور من {STATE_DB_FILE}")
+
+def import_posted_links_file(conn):
+    """استيراد posted_links.txt القديم مرة واحدة كمقالات منشورة"""
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'posted_links_imported'").fetchone():
+        return
+    
+    imported = 0
+    if os.path.exists(POSTED_LINKS_FILE):
+        from datetime import datetime
+        now = datetime.now().isoformat()
+        with open(POSTED_LINKS_FILE, "r", encoding='utf-8') as f:
+            for line in f:
+                link = line.strip()
+                if not link:
+                    continue
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO articles (url_key, url, site, state, created_at, updated_at) "
+                    "VALUES (?, ?, ?, 'published', ?, ?)",
+                    (normalize_article_url(link), link, DEFAULT_SITE["state_namespace"], now, now)
+                )
+                imported += cursor.rowcount
+    
+    conn.execute("INSERT INTO meta (key, value) VALUES ('posted_links_imported', ?)", (str(imported),))
+    conn.commit()
+    if imported:
+        print(f"--- 🗃️ تم استيراد {imported} رابط من {POSTED_LINKS_FILE} إلى {STATE_DB_FILE}")
+
+def get_article(link):
+    """قراءة صف المقال (بحث مفهرس) أو None"""
+    with _state_db_lock:
+        row = get_state_db().execute(
+            "SELECT * FROM articles WHERE url_key = ?", (normalize_article_url(link),)
+        ).fetchone()
+    if row is None:
+        return None
+    article = dict(row)
+    article["payload"] = json.loads(article["payload"]) if article["payload"] else {}
+    return article
+
+def update_article_state(link, state, medium_url=None, payload=None, error=None, count_attempt=False, site=None):
+    """تحديث حالة المقال (إنشاء الصف إن لم يكن موجوداً)، payload يُدمج مع الموجود"""
+    from datetime import datetime
+    now = datetime.now().isoformat()
+    
+    with _state_db_lock:
+        conn = get_state_db()
+        article = get_article(link)
+        merged_payload = article["payload"] if article else {}
+        if payload:
+            merged_payload.update(payload)
+        if state == "published":
+            # HTML والصور لا حاجة لها بعد النشر، وبقاؤها يضخم الملف المحفوظ في Git
+            for key in PUBLISHED_DROP_KEYS:
+                merged_payload.pop(key, None)
+        
+        conn.execute("""
+            INSERT INTO articles (url_key, url, site, state, attempts, medium_url, payload, last_error, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(url_key) DO UPDATE SET
+                state = excluded.state,
+                attempts = articles.attempts + ?,
+                medium_url = COALESCE(excluded.medium_url, articles.medium_url),
+                payload = excluded.payload,
+                last_error = excluded.last_error,
+                updated_at = excluded.updated_at
+        """, (
+            normalize_article_url(link), link, (site or DEFAULT_SITE)["state_namespace"], state, 1 if count_attempt else 0,
+            medium_url, json.dumps(merged_payload, ensure_ascii=False) if merged_payload else None,
+            error, now, now, 1 if count_attempt else 0
+        ))
+        conn.commit()
+
+def is_article_done(article):
+    """المقال منتهٍ إذا نُشر أو لم يتأكد نشره أو استنفد محاولات النشر"""
+    if not article:
+        return False
+    if article["state"] in ("published", "unconfirmed"):
+        return True
+    return article["state"] == "failed" and article["attempts"] >= MAX_PUBLISH_ATTEMPTS
+
+# ====== طابور المقالات الجاهزة ======
+# المقال المُجهّز بالكامل (العنوان وHTML النهائي والوسوم والصور) يبقى في payload.post
+# بحالة queued حتى يسحبه أمر publish؛ حالة publishing تعني أن النشر بدأ ولم ينتهِ
+
+def enqueue_post(post, site=None):
+    update_article_state(post["link"], "queued", payload={"post": post}, site=site)
+
+def count_queued_posts():
+    with _state_db_lock:
+        return get_state_db().execute("SELECT COUNT(*) FROM articles WHERE state = 'queued'").fetchone()[0]
+
+def get_queued_posts(limit=None):
+    """المقالات الجاهزة للنشر بترتيب دخولها الطابور، ثم الفاشلة التي بقيت لها محاولات"""
+    with _state_db_lock:
+        rows = get_state_db().execute(
+            "SELECT url FROM articles WHERE state = 'queued' OR (state = 'failed' AND attempts < ?) "
+            "ORDER BY state = 'failed', updated_at",
+            (MAX_PUBLISH_ATTEMPTS,)
+        ).fetchall()
+    
+    posts = []
+    for row in rows:
+        article = get_article(row["url"])
+        if article and article["payload"].get("post"):
+            posts.append(article["payload"]["post"])
+            if limit and len(posts) >= limit:
+                break
+    return posts
+
+def recover_interrupted_publishes():
+    """نشر انقطع قبل تسجيل نتيجته (إلغاء التشغيل مثلاً) يصبح unconfirmed ولا يُعاد تلقائياً"""
+    with _state_db_lock:
+        rows = get_state_db().execute("SELECT url FROM articles WHERE state = 'publishing'").fetchall()
+    for row in rows:
+        print(f"    ⚠️ نشر غير مكتمل من تشغيل سابق (تحقق يدوياً من Medium): {row['url']}")
+        update_article_state(
+            row["url"], "unconfirmed", error="interrupted during publish (may have been published)", count_attempt=True
+        )
+    return len(rows)
+
+def fetch_feed(rss_url, cache_name):
+    """جلب الخلاصة بطلب شرطي (ETag/Last-Modified) مع كاش محلي لآخر نسخة
+    
+    يرجع (feed, not_modified) حيث not_modified=True عند الرد 304.
+    """
+    os.makedirs(FEED_CACHE_DIR, exist_ok=True)
+    meta_file = os.path.join(FEED_CACHE_DIR, f"{cache_name}.json")
+    body_file = os.path.join(FEED_CACHE_DIR, f"{cache_name}.xml")
+    
+    meta = {}
+    if os.path.exists(meta_file) and os.path.exists(body_file):
+        try:
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+    if meta.get("url") != rss_url:
+        meta = {}
+    
+    headers = {'User-Agent': SCRAPE_USER_AGENT}
+    if meta.get("etag"):
+        headers['If-None-Match'] = meta["etag"]
+    if meta.get("last_modified"):
+        headers['If-Modified-Since'] = meta["last_modified"]
+    
+    try:
+        response = get_session().get(rss_url, headers=headers, timeout=TIMEOUTS["feed"])
+    except requests.RequestException as e:
+        print(f"    ⚠️ فشل جلب الخلاصة: {e}")
+        if meta:
+            print("    ♻️ استخدام آخر نسخة محفوظة من الخلاصة")
+            return feedparser.parse(body_file), False
+        return feedparser.parse(""), False
+    
+    trace_annotate(http_status=response.status_code, bytes=len(response.content))
+    if response.status_code == 304 and meta:
+        print("    ♻️ الخلاصة لم تتغير منذ آخر تشغيل (304)")
+        return feedparser.parse(body_file), True
+    
+    if not response.ok:
+        print(f"    ⚠️ فشل جلب الخلاصة: HTTP {response.status_code}")
+        if meta:
+            print("    ♻️ استخدام آخر نسخة محفوظة من الخلاصة")
+            return feedparser.parse(body_file), False
+        response.raise_for_status()
+    with open(body_file, 'wb') as f:
+        f.write(response.content)
+    with open(meta_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            "url": rss_url,
+            "etag": response.headers.get('ETag'),
+            "last_modified": response.headers.get('Last-Modified')
+        }, f)
+    
+    return feedparser.parse(response.content), False
+
+def get_next_posts_to_publish(limit=1, site=None, skip_states=()):
+    """إرجاع حتى limit مقال غير منشور من خلاصة الموقع، الأقدم أولاً (skip_states: حالات تُتجاوز أيضاً)"""
+    site = site or DEFAULT_SITE
+    print(f"--- 1. البحث عن مقالات في: {site['rss_url']}")
+    feed, not_modified = fetch_feed(site["rss_url"], site["state_namespace"])
+    if not feed.entries: return []
     print(f"--- تم العثور على {len(feed.entries)} مقالات.")
-    posted_links = get_posted_links()
+    entries = []
     for entry in reversed(feed.entries):
-        if entry.link not in posted_links:
+        article = get_article(entry.link)
+        if not is_article_done(article) and not (article and article["state"] in skip_states):
             print(f">>> تم تحديد المقال: {entry.title}")
-            return entry
-    return None
+            if not article:
+                update_article_state(entry.link, "discovered", site=site)
+            entries.append(entry)
+            if len(entries) >= limit:
+                break
+    if not entries and not_modified:
+        print("--- ⚡ لا جديد منذ آخر تشغيل - إنهاء سريع بدون تشغيل المتصفح")
+    return entries
+
+def get_next_post_to_publish(site=None):
+    entries = get_next_posts_to_publish(1, site)
+    return entries[0] if entries else None
 
 def extract_image_url_from_entry(entry):
     """استخراج أول صورة من RSS feed"""
@@ -73,11 +848,18 @@ def extract_image_url_from_entry(entry):
     if match: return match.group(1)
     return None
 
+# مقاسات الأيقونات والصور المصغرة - تُقارن كأرقام حتى لا يطابق w=16 العرض w=1600
+SMALL_IMAGE_SIZES = {16, 32, 48, 64, 96, 128, 150, 160}
+# width=N أو w=N (في الاستعلام أو خيارات cdn-cgi)، و-NxM أو _NxM في اسم الملف
+IMAGE_SIZE_PATTERNS = [
+    re.compile(r'(?<![a-z0-9])(?:width|w)=(\d+)', re.IGNORECASE),
+    re.compile(r'[-_](\d+)x'),
+]
+
 def is_valid_article_image(url):
     """التحقق من أن الصورة صالحة للمقال"""
-    small_sizes = ['16', '32', '48', '64', '96', '128', '150', '160']
-    for size in small_sizes:
-        if f'width={size}' in url or f'w={size}' in url or f'-{size}x' in url or f'_{size}x' in url:
+    for pattern in IMAGE_SIZE_PATTERNS:
+        if any(int(size) in SMALL_IMAGE_SIZES for size in pattern.findall(url)):
             return False
     
     exclude_keywords = [
@@ -97,204 +879,356 @@ def is_valid_article_image(url):
     
     return has_valid_extension
 
-def is_recipe_image(url, alt_text=""):
+def is_recipe_image(url, alt_text="", site=None):
     """التحقق من أن الصورة متعلقة بالوصفة"""
+    site = site or DEFAULT_SITE
     food_keywords = ['recipe', 'food', 'dish', 'meal', 'cook', 'ingredient']
     if any(keyword in url.lower() or keyword in alt_text.lower() for keyword in food_keywords):
         return True
     
-    if any(path in url for path in IMAGE_PATHS):
+    if any(path in url for path in site["image_paths"]):
         return True
     
-    if SITE_DOMAIN in url:
+    if site["domain"] in url:
         return True
     
     return False
 
-def scrape_article_images_with_alt(article_url):
-    """كشط الصور مع نصوص alt من داخل المقال"""
-    print(f"--- 🔍 كشط صور المقال بـ Selenium من: {article_url}")
+# حاويات المحتوى المحتملة بالترتيب - مشتركة بين الكشط السريع وSelenium
+ARTICLE_SELECTORS = [
+    "article.article",
+    "article",
+    "div.article-content",
+    "div.entry-content",
+    "div.post-content",
+    "div.content",
+    "main",
+    "div.recipe-content"
+]
+
+# خصائص مصدر الصورة بالترتيب (تشمل خصائص التحميل الكسول)
+IMAGE_SRC_ATTRS = ['src', 'data-src', 'data-lazy-src', 'data-original', 'data-srcset']
+
+def clean_image_url(src, article_url):
+    """تنظيف رابط الصورة: اختيار المقاس من srcset وتوحيد روابط CDN والروابط النسبية"""
+    from image_urls import canonicalize_image_url
+    return canonicalize_image_url(src, article_url, TARGET_IMAGE_WIDTH)
+
+def pick_image_source(attrs):
+    """مصدر الصورة: srcset أولاً (لاختيار المقاس) ثم خصائص src بالترتيب"""
+    for attr in dict.fromkeys(['srcset', 'data-srcset'] + IMAGE_SRC_ATTRS):
+        value = attrs.get(attr)
+        # في التحميل الكسول يكون src صورة data: مؤقتة
+        if value and not value.startswith("data:"):
+            return value
+    return None
+
+def add_image_candidate(images_data, seen_urls, src, alt_text, width, article_url):
+    """فحص صورة مرشحة وإضافتها إلى القائمة إن كانت صالحة وغير مكررة (seen_urls: الروابط المضافة)"""
+    clean_url = clean_image_url(src, article_url)
     
-    options = webdriver.ChromeOptions()
-    options.add_argument("--headless")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--disable-gpu")
-    options.add_argument("window-size=1920,1080")
-    options.add_argument("--disable-blink-features=AutomationControlled")
-    options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36")
+    if not is_valid_article_image(clean_url):
+        print(f"    ❌ صورة مرفوضة: {clean_url[:60]}...")
+        return False
     
-    service = ChromeService(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=options)
+    try:
+        width_int = int(width) if width else 0
+        if width_int < MIN_IMAGE_WIDTH and width_int > 0:
+            print(f"    ❌ صورة صغيرة جداً: {width_int}px")
+            return False
+    except:
+        pass
     
-    stealth(driver,
-            languages=["en-US", "en"],
-            vendor="Google Inc.",
-            platform="Win32",
-            webgl_vendor="Intel Inc.",
-            renderer="Intel Iris OpenGL Engine",
-            fix_hairline=True)
+    if clean_url in seen_urls:
+        return False
+    seen_urls.add(clean_url)
+    
+    images_data.append({
+        'url': clean_url,
+        'alt': alt_text
+    })
+    print(f"    ✅ تمت إضافة الصورة: {clean_url[:60]}...")
+    return True
+
+# آخر صفحات مقالات مجلوبة (LRU) - تكفي المقالات التي تُجهّز معاً بالتوازي
+PAGE_CACHE_ENTRIES = 8
+_page_cache = OrderedDict()
+_page_cache_lock = threading.Lock()
+
+def fetch_article_html(article_url):
+    """HTML صفحة المقال - يُجلب مرة واحدة ويشاركه كشط الصور واستخراج الوصفة"""
+    with _page_cache_lock:
+        if article_url in _page_cache:
+            _page_cache.move_to_end(article_url)
+            return _page_cache[article_url]
+    
+    response = get_session().get(article_url, headers={'User-Agent': SCRAPE_USER_AGENT}, timeout=TIMEOUTS["page"])
+    response.raise_for_status()
+    with _page_cache_lock:
+        _page_cache[article_url] = response.text
+        while len(_page_cache) > PAGE_CACHE_ENTRIES:
+            _page_cache.popitem(last=False)
+    return response.text
+
+def clear_page_cache():
+    with _page_cache_lock:
+        _page_cache.clear()
+
+def scrape_article_images_static(article_url, site=None):
+    """كشط سريع للصور عبر HTTP وBeautifulSoup بدون متصفح"""
+    from bs4 import BeautifulSoup
     
+    print(f"--- ⚡ كشط سريع لصور المقال عبر HTTP من: {article_url}")
     images_data = []
+    seen_urls = set()
     
     try:
-        print("    ⏳ تحميل الصفحة...")
-        driver.get(article_url)
-        time.sleep(3)
-        
-        wait = WebDriverWait(driver, 10)
+        soup = BeautifulSoup(fetch_article_html(article_url), "html.parser")
         
         article_element = None
-        selectors = [
-            "article.article",
-            "article",
-            "div.article-content",
-            "div.entry-content",
-            "div.post-content",
-            "div.content",
-            "main",
-            "div.recipe-content"
-        ]
-        
-        for selector in selectors:
-            try:
-                article_element = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, selector)))
+        for selector in ARTICLE_SELECTORS:
+            article_element = soup.select_one(selector)
+            if article_element:
                 print(f"    ✓ تم العثور على المحتوى في: {selector}")
                 break
-            except:
-                continue
         
         if not article_element:
             print("    ⚠️ لم أجد منطقة المحتوى، سأبحث في الصفحة كاملة")
-            article_element = driver.find_element(By.TAG_NAME, "body")
+            article_element = soup.body or soup
         
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight/4);")
-        time.sleep(1)
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight/2);")
-        time.sleep(1)
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight*3/4);")
-        time.sleep(1)
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        time.sleep(2)
+        img_elements = article_element.find_all("img")
+        print(f"    📊 عدد الصور في المقال: {len(img_elements)}")
+        
+        for img in img_elements:
+            src = pick_image_source(img.attrs)
+            if not src:
+                continue
+            
+            alt_text = img.get("alt") or img.get("title") or ""
+            add_image_candidate(images_data, seen_urls, src, alt_text, img.get("width"), article_url)
+        
+        if len(images_data) < 2:
+            print("    🔎 البحث في عناصر picture...")
+            for source in article_element.select("picture source"):
+                srcset = source.get("srcset") or source.get("data-srcset")
+                if srcset:
+                    add_image_candidate(images_data, seen_urls, srcset, 'Recipe image', None, article_url)
+        
+        print(f"--- ⚡ الكشط السريع وجد {len(images_data)} صورة صالحة")
+        
+    except Exception as e:
+        print(f"--- ⚠️ خطأ في الكشط السريع: {e}")
+    
+    return images_data
+
+def scrape_article_images_selenium(article_url, site=None):
+    """كشط الصور مع نصوص alt من داخل المقال عبر Selenium"""
+    print(f"--- 🔍 كشط صور المقال بـ Selenium من: {article_url}")
+    
+    with _browser_lock:
+        return scrape_images_with_driver(get_browser(), article_url, site)
+
+# سكربت واحد يجمع كل الصور المرشحة وخصائصها في رحلة WebDriver واحدة
+COLLECT_IMAGES_JS = """
+const selectors = arguments[0], srcAttrs = arguments[1];
+let container = null, containerSelector = null;
+for (const selector of selectors) {
+    container = document.querySelector(selector);
+    if (container) { containerSelector = selector; break; }
+}
+const root = container || document.body;
+const sourceSrcset = source => source.getAttribute('srcset') || source.getAttribute('data-srcset');
+const images = Array.from(document.images).map(img => {
+    const attrs = {};
+    for (const name of srcAttrs) attrs[name] = img.getAttribute(name);
+    const rect = img.getBoundingClientRect();
+    const picture = img.closest('picture');
+    return {
+        attrs: attrs,
+        current_src: img.currentSrc || img.src,
+        srcset: img.getAttribute('srcset'),
+        alt: img.getAttribute('alt'),
+        title: img.getAttribute('title'),
+        width_attr: img.getAttribute('width'),
+        height_attr: img.getAttribute('height'),
+        natural_width: img.naturalWidth,
+        natural_height: img.naturalHeight,
+        rendered_width: Math.round(rect.width),
+        rendered_height: Math.round(rect.height),
+        in_article: root.contains(img),
+        picture_sources: picture ? Array.from(picture.querySelectorAll('source')).map(sourceSrcset).filter(Boolean) : []
+    };
+});
+return {
+    container: containerSelector,
+    images: images,
+    picture_sources: Array.from(root.querySelectorAll('picture source')).map(sourceSrcset).filter(Boolean)
+};
+"""
+
+def extract_image_candidates(driver):
+    """جمع كل الصور المرشحة من الصفحة المحمّلة باستدعاء execute_script واحد"""
+    return driver.execute_script(COLLECT_IMAGES_JS, ARTICLE_SELECTORS, IMAGE_SRC_ATTRS)
+
+def scrape_images_with_driver(driver, article_url, site=None):
+    """كشط الصور من صفحة المقال باستخدام متصفح جاهز"""
+    images_data = []
+    seen_urls = set()
+    
+    try:
+        print("    ⏳ تحميل الصفحة...")
+        driver.get(article_url)
+        wait_for_document_ready(driver)
+        
+        # التمرير لتفعيل التحميل الكسول، مع انتظار استقرار DOM بعد كل خطوة
+        for position in ("scrollHeight/4", "scrollHeight/2", "scrollHeight*3/4", "scrollHeight"):
+            driver.execute_script(f"window.scrollTo(0, document.body.{position});")
+            wait_for_dom_settled(driver, "scroll", quiet_ms=300)
+        wait_for_network_idle(driver, "scroll", idle_ms=300)
         
         print("    🔎 البحث عن الصور...")
+        candidates = extract_image_candidates(driver)
         
-        all_images = driver.find_elements(By.TAG_NAME, "img")
-        print(f"    📊 عدد الصور الكلي في الصفحة: {len(all_images)}")
+        if candidates["container"]:
+            print(f"    ✓ تم العثور على المحتوى في: {candidates['container']}")
+        else:
+            print("    ⚠️ لم أجد منطقة المحتوى، سأبحث في الصفحة كاملة")
         
-        img_elements = article_element.find_elements(By.TAG_NAME, "img")
-        print(f"    📊 عدد الصور في المقال: {len(img_elements)}")
+        article_images = [img for img in candidates["images"] if img["in_article"]]
+        print(f"    📊 عدد الصور الكلي في الصفحة: {len(candidates['images'])}")
+        print(f"    📊 عدد الصور في المقال: {len(article_images)}")
         
-        for img in img_elements:
-            try:
-                src = None
-                src_attrs = ['src', 'data-src', 'data-lazy-src', 'data-original', 'data-srcset']
-                
-                for attr in src_attrs:
-                    src = img.get_attribute(attr)
-                    if src:
-                        break
-                
-                if not src:
-                    src = driver.execute_script("return arguments[0].currentSrc || arguments[0].src;", img)
-                
-                if not src:
-                    continue
-                
-                if ' ' in src and ',' in src:
-                    srcset_parts = src.split(',')
-                    src = srcset_parts[-1].strip().split(' ')[0]
-                
-                alt_text = img.get_attribute("alt") or img.get_attribute("title") or ""
-                
-                width = img.get_attribute("width") or driver.execute_script("return arguments[0].naturalWidth;", img)
-                height = img.get_attribute("height") or driver.execute_script("return arguments[0].naturalHeight;", img)
-                
-                print(f"    🔍 فحص صورة: {src[:50]}... | Alt: {alt_text[:30]}... | Size: {width}x{height}")
-                
-                clean_url = src
-                
-                if "/cdn-cgi/image/" in clean_url:
-                    match = re.search(r'/(wp-content/uploads/[^"]+)', clean_url)
-                    if match:
-                        clean_url = f"https://{SITE_DOMAIN}" + match.group(1)
-                    else:
-                        match = re.search(r'/([^/]+\.(jpg|jpeg|png|webp))', clean_url, re.IGNORECASE)
-                        if match:
-                            clean_url = f"https://{SITE_DOMAIN}/wp-content/uploads/" + match.group(1)
-                
-                if not clean_url.startswith("http"):
-                    if clean_url.startswith("//"):
-                        clean_url = "https:" + clean_url
-                    elif clean_url.startswith("/"):
-                        from urllib.parse import urljoin
-                        clean_url = urljoin(article_url, clean_url)
-                
-                if is_valid_article_image(clean_url):
-                    try:
-                        width_int = int(width) if width else 0
-                        if width_int < 200 and width_int > 0:
-                            print(f"    ❌ صورة صغيرة جداً: {width_int}px")
-                            continue
-                    except:
-                        pass
-                    
-                    image_exists = False
-                    for img_data in images_data:
-                        if img_data['url'] == clean_url:
-                            image_exists = True
-                            break
-                    
-                    if not image_exists:
-                        images_data.append({
-                            'url': clean_url,
-                            'alt': alt_text
-                        })
-                        print(f"    ✅ تمت إضافة الصورة: {clean_url[:60]}...")
-                else:
-                    print(f"    ❌ صورة مرفوضة: {clean_url[:60]}...")
-                        
-            except Exception as e:
-                print(f"    ⚠️ خطأ في معالجة صورة: {e}")
+        for img in article_images:
+            src = pick_image_source({**img["attrs"], 'srcset': img["srcset"]})
+            if not src and img["current_src"] and not img["current_src"].startswith("data:"):
+                src = img["current_src"]
+            
+            if not src:
                 continue
+            
+            alt_text = img["alt"] or img["title"] or ""
+            width = img["width_attr"] or img["natural_width"]
+            height = img["height_attr"] or img["natural_height"]
+            
+            print(f"    🔍 فحص صورة: {src[:50]}... | Alt: {alt_text[:30]}... | Size: {width}x{height}")
+            
+            add_image_candidate(images_data, seen_urls, src, alt_text, width, article_url)
         
         if len(images_data) < 2:
             print("    🔎 البحث في عناصر picture...")
-            picture_elements = article_element.find_elements(By.TAG_NAME, "picture")
-            for picture in picture_elements:
-                try:
-                    sources = picture.find_elements(By.TAG_NAME, "source")
-                    for source in sources:
-                        srcset = source.get_attribute("srcset")
-                        if srcset:
-                            urls = re.findall(r'(https?://[^\s]+)', srcset)
-                            if urls:
-                                url = urls[-1]
-                                if is_valid_article_image(url):
-                                    images_data.append({
-                                        'url': url,
-                                        'alt': 'Recipe image'
-                                    })
-                                    print(f"    ✅ صورة من picture: {url[:60]}...")
-                                    break
-                except:
-                    continue
+            for srcset in candidates["picture_sources"]:
+                add_image_candidate(images_data, seen_urls, srcset, 'Recipe image', None, article_url)
         
         print(f"--- ✅ تم العثور على {len(images_data)} صورة صالحة من المقال")
         
-        for i, img in enumerate(images_data, 1):
-            print(f"    📸 الصورة {i}: {img['url']}")
-        
     except Exception as e:
         print(f"--- ⚠️ خطأ في Selenium: {e}")
-    finally:
-        driver.quit()
     
     return images_data
 
-def get_best_images_for_article(article_url, rss_image=None):
+def scrape_article_images_with_alt(article_url, site=None):
+    """كشط الصور مع نصوص alt - الكشط السريع أولاً وSelenium كاحتياط فقط"""
+    images_data = scrape_article_images_static(article_url, site)
+    
+    if len(images_data) < 2:
+        print("--- 🔁 الكشط السريع لم يكفِ، الانتقال إلى Selenium...")
+        selenium_images = scrape_article_images_selenium(article_url, site)
+        if len(selenium_images) >= len(images_data):
+            images_data = selenium_images
+    
+    for i, img in enumerate(images_data, 1):
+        print(f"    📸 الصورة {i}: {img['url']}")
+    
+    return images_data
+
+def filter_images_by_probe(images_data):
+    """فحص الصور المرشحة فعلياً: استبعاد الميتة والثقيلة والصغيرة وتقديم الكبيرة"""
+    if not IMAGE_PROBE_ENABLED or not images_data:
+        return images_data
+    
+    from image_probe import probe_images
+    
+    with trace_span("image_probe", candidates=len(images_data)) as span:
+        # فحص الترويسة فقط لكل المرشحات، والتنزيل الكامل للبصمة لاحقاً للقليل الباقي
+        probes = probe_images(
+            [img['url'] for img in images_data], max_workers=IMAGE_PROBE_WORKERS,
+            session=get_session(), timeout=TIMEOUTS["image"], cache_path=IMAGE_CACHE_FILE
+        )
+        
+        kept = []
+        for img in images_data:
+            probe = probes[img['url']]
+            if probe['status'] and probe['status'] >= 400:
+                print(f"    ❌ صورة لا تعمل ({probe['status']}): {img['url'][:60]}...")
+            elif probe['bytes'] and probe['bytes'] > MAX_IMAGE_BYTES:
+                print(f"    ❌ صورة ثقيلة جداً ({probe['bytes'] // 1024}KB): {img['url'][:60]}...")
+            elif probe['width'] and probe['width'] < MIN_IMAGE_WIDTH:
+                print(f"    ❌ صورة صغيرة جداً: {probe['width']}px")
+            else:
+                # أخطاء الشبكة المؤقتة لا تستبعد الصورة، فقط الردود المؤكدة
+                kept.append({
+                    **img, 'width': probe['width'], 'height': probe['height'],
+                    'bytes': probe['bytes'], 'dhash': probe.get('dhash')
+                })
+        
+        # الصور ذات العرض الكافي أولاً مع الحفاظ على ترتيب الصفحة داخل كل مجموعة
+        kept.sort(key=lambda img: 0 if (img['width'] or 0) >= PREFERRED_IMAGE_WIDTH else 1)
+        span["kept"] = len(kept)
+        
+        # البصمة المرئية لأول المرشحات فقط (منها تُختار الصورتان)، بحد أقصى MAX_IMAGE_BYTES
+        hash_candidates = [img for img in kept[:IMAGE_HASH_CANDIDATES] if not img['dhash']]
+        if hash_candidates:
+            hashed = probe_images(
+                [img['url'] for img in hash_candidates], max_workers=IMAGE_PROBE_WORKERS,
+                session=get_session(), timeout=TIMEOUTS["image"], cache_path=IMAGE_CACHE_FILE,
+                compute_hash=True, hash_max_bytes=MAX_IMAGE_BYTES
+            )
+            for img in hash_candidates:
+                img['dhash'] = hashed[img['url']].get('dhash')
+            span["hashed"] = len(hash_candidates)
+    
+    print(f"--- 🔬 فحص الصور: {len(kept)} من {len(images_data)} صالحة")
+    return kept
+
+def group_near_duplicates(images_data):
+    """تجميع الصور المتشابهة بصرياً (نفس الصورة بمقاسات أو مسارات CDN مختلفة)"""
+    from image_probe import hash_distance
+    
+    groups = []
+    for img in images_data:
+        for group in groups:
+            distance = hash_distance(img.get('dhash'), group[0].get('dhash'))
+            if distance is not None and distance <= NEAR_DUPLICATE_DISTANCE:
+                group.append(img)
+                break
+        else:
+            groups.append([img])
+    return groups
+
+def select_distinct_images(images_data):
+    """اختيار صورتين من مجموعتين مختلفتين، مع الترتيب القديم (الأولى ثم الثالثة) كاحتياط"""
+    if not images_data:
+        return None, None
+    
+    groups = group_near_duplicates(images_data)
+    if len(groups) >= 2:
+        # الأولى من المجموعة الأولى، والثانية من المجموعة الثالثة إن وُجدت كما في الاختيار القديم
+        second_group = groups[2] if len(groups) >= 3 else groups[1]
+        if len(groups) < len(images_data):
+            print(f"--- 🧬 تم دمج {len(images_data) - len(groups)} صورة مكررة بصرياً")
+        return groups[0][0], second_group[0]
+    
+    if len(images_data) >= 2 and images_data[0].get('dhash'):
+        print("--- 🧬 كل الصور المرشحة نسخ من نفس الصورة")
+    if len(images_data) >= 3:
+        return images_data[0], images_data[2]
+    if len(images_data) == 2:
+        return images_data[0], images_data[1]
+    return images_data[0], images_data[0]
+
+def get_best_images_for_article(article_url, rss_image=None, site=None):
     """الحصول على أفضل صورتين مع alt text"""
-    scraped_images_data = scrape_article_images_with_alt(article_url)
+    scraped_images_data = scrape_article_images_with_alt(article_url, site)
     
     all_images_data = []
     all_images_data.extend(scraped_images_data)
@@ -312,49 +1246,145 @@ def get_best_images_for_article(article_url, rss_image=None):
                 'alt': 'Featured recipe image'
             })
     
-    if len(all_images_data) >= 2:
-        image1_data = all_images_data[0]
-        if len(all_images_data) >= 3:
-            image2_data = all_images_data[2]
-        else:
-            image2_data = all_images_data[1]
-    elif len(all_images_data) == 1:
-        image1_data = image2_data = all_images_data[0]
-    else:
-        image1_data = image2_data = None
+    all_images_data = filter_images_by_probe(all_images_data)
     
-    return image1_data, image2_data
+    return select_distinct_images(all_images_data)
 
-def create_mid_cta(original_link, recipe_title="this recipe"):
+def create_mid_cta(original_link, recipe_title="this recipe", site=None):
     """إنشاء CTA خفيف للمنتصف"""
-    cta_variations = [
-        f'💡 <em>Want to see the exact measurements and timing? Check out <a href="{original_link}" rel="noopener" target="_blank">the full recipe on {SITE_DOMAIN}</a></em>',
-        f'👉 <em>Get all the ingredients and detailed steps for {recipe_title} on <a href="{original_link}" rel="noopener" target="_blank">{SITE_DOMAIN}</a></em>',
-        f'📖 <em>Find the printable version with nutrition facts at <a href="{original_link}" rel="noopener" target="_blank">{SITE_DOMAIN}</a></em>',
-        f'🍳 <em>See step-by-step photos and pro tips on <a href="{original_link}" rel="noopener" target="_blank">{SITE_DOMAIN}</a></em>'
-    ]
+    site = site or DEFAULT_SITE
+    cta_variations = site["mid_ctas"]
     
     import hashlib
     index = int(hashlib.md5(original_link.encode()).hexdigest(), 16) % len(cta_variations)
-    return f'<p>{cta_variations[index]}</p>'
+    cta = cta_variations[index].format(link=original_link, domain=site["domain"], title=recipe_title)
+    return f'<p>{cta}</p>'
 
-def create_final_cta(original_link):
+def create_final_cta(original_link, site=None):
     """إنشاء CTA قوي للنهاية"""
-    final_cta = f'''
-    <br>
-    <hr>
-    <h3>Ready to Make This Recipe?</h3>
-    <p><strong>🎯 Get the complete recipe with:</strong></p>
-    <ul>
-        <li>Exact measurements and ingredients list</li>
-        <li>Step-by-step instructions with photos</li>
-        <li>Prep and cooking times</li>
-        <li>Nutritional information</li>
-        <li>Storage and serving suggestions</li>
-    </ul>
-    <p><strong>👉 Visit <a href="{original_link}" rel="noopener" target="_blank">{SITE_DOMAIN}</a> for the full recipe and more delicious ideas!</strong></p>
-    '''
-    return final_cta
+    site = site or DEFAULT_SITE
+    return site["final_cta"].format(link=original_link, domain=site["domain"])
+
+def gemini_cache_key(prompt, model):
+    """بصمة SHA-256 للطلب الكامل مع اسم النموذج"""
+    import hashlib
+    return hashlib.sha256(f"{model}\n{prompt}".encode('utf-8')).hexdigest()
+
+def get_cached_gemini_result(key):
+    """قراءة نتيجة Gemini من الكاش إن كانت موجودة ولم تنتهِ صلاحيتها"""
+    if GEMINI_CACHE_BYPASS:
+        return None
+    
+    cache_file = os.path.join(GEMINI_CACHE_DIR, f"{key}.json")
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    if time.time() - entry.get("created_at", 0) > GEMINI_CACHE_TTL_HOURS * 3600:
+        try:
+            os.remove(cache_file)
+        except OSError:
+            pass
+        return None
+    
+    return entry.get("result")
+
+def store_gemini_result(key, result):
+    """حفظ نتيجة Gemini المحللة في الكاش مع حذف الأقدم عند تجاوز الحد"""
+    try:
+        os.makedirs(GEMINI_CACHE_DIR, exist_ok=True)
+        cache_file = os.path.join(GEMINI_CACHE_DIR, f"{key}.json")
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({"created_at": time.time(), "result": result}, f, ensure_ascii=False)
+        os.replace(tmp_file, cache_file)
+        
+        entries = [os.path.join(GEMINI_CACHE_DIR, name) for name in os.listdir(GEMINI_CACHE_DIR) if name.endswith(".json")]
+        if len(entries) > GEMINI_CACHE_MAX_ENTRIES:
+            entries.sort(key=os.path.getmtime)
+            for old_file in entries[:len(entries) - GEMINI_CACHE_MAX_ENTRIES]:
+                os.remove(old_file)
+    except OSError as e:
+        print(f"    ⚠️ تعذر حفظ كاش Gemini: {e}")
+
+def format_gemini_result(result, title, content_html):
+    """تحويل JSON الخاص بـ Gemini إلى الشكل المستخدم في باقي المراحل"""
+    return {
+        "title": result.get("new_title", title),
+        "content": result.get("new_html_content", content_html),
+        "tags": result.get("tags", []),
+        "caption1": result.get("caption1", ""),
+        "caption2": result.get("caption2", "")
+    }
+
+_gemini_client = None
+_gemini_client_lock = threading.Lock()
+
+def get_gemini_client():
+    """عميل Gemini المشترك بين خيوط التحضير (حد معدل واحد للعملية)"""
+    global _gemini_client
+    with _gemini_client_lock:
+        if _gemini_client is None:
+            from gemini_client import GeminiClient
+            _gemini_client = GeminiClient(
+                GEMINI_API_BASE, GEMINI_API_KEY, get_session(),
+                rpm=GEMINI_RPM, tpm=GEMINI_TPM, max_retries=GEMINI_MAX_RETRIES,
+                timeout=TIMEOUTS["gemini"], stall_timeout=GEMINI_STALL_SECONDS
+            )
+        return _gemini_client
+
+_model_router = None
+
+def get_model_router():
+    """موجّه النماذج المشترك: GEMINI_MODEL أولاً ثم GEMINI_FALLBACK_MODELS"""
+    global _model_router
+    client = get_gemini_client()
+    with _gemini_client_lock:
+        if _model_router is None:
+            from model_router import ModelRouter
+            _model_router = ModelRouter(
+                client, [GEMINI_MODEL] + GEMINI_FALLBACK_MODELS, stats_file=MODEL_STATS_FILE,
+                hedge_percentile=GEMINI_HEDGE_PERCENTILE, hedge_default_seconds=GEMINI_HEDGE_AFTER_SECONDS
+            )
+        return _model_router
+
+def close_gemini_client():
+    global _gemini_client, _model_router
+    with _gemini_client_lock:
+        if _model_router is not None:
+            try:
+                _model_router.save_stats()
+            except OSError as e:
+                print(f"    ⚠️ تعذر حفظ إحصاءات النماذج: {e}")
+            _model_router = None
+        if _gemini_client is not None:
+            _gemini_client.close()
+            _gemini_client = None
+
+def gemini_response_text(response_json):
+    """نص أول مرشح في رد Gemini (فارغ إن لم يوجد)"""
+    candidates = response_json.get('candidates') or [{}]
+    parts = candidates[0].get('content', {}).get('parts') or [{}]
+    return parts[0].get('text', "")
+
+def is_complete_gemini_json(response_json):
+    """رد صالح للتوجيه: يحتوي كائن JSON مكتملاً"""
+    return parse_json_object(gemini_response_text(response_json)) is not None
+
+def repair_gemini_result(result, problems):
+    """طلب إصلاح موجّه للحقول المعطوبة فقط - يرجع (النتيجة بعد الدمج، الرموز المستهلكة)"""
+    fields = [field for field in FIELD_SCHEMAS if field in problems]
+    data = {
+        "contents": [{"parts": [{"text": build_repair_prompt(result, problems)}]}],
+        "generationConfig": structured_generation_config({"maxOutputTokens": 4096, "temperature": 0.2}, fields)
+    }
+    response_json, _ = get_model_router().generate_sync(data, is_valid=is_complete_gemini_json)
+    raw_text = gemini_response_text(response_json)
+    repaired = parse_json_object(raw_text) or {}
+    merged = {**result, **{field: value for field, value in repaired.items() if field in fields}}
+    return merged, response_json.get('usageMetadata', {}).get('totalTokenCount', 0)
 
 def rewrite_content_with_gemini(title, content_html, original_link, image1_alt="", image2_alt=""):
     if not GEMINI_API_KEY:
@@ -362,7 +1392,18 @@ def rewrite_content_with_gemini(title, content_html, original_link, image1_alt="
         return None
 
     print("--- 💬 التواصل مع Gemini API لإنشاء مقال احترافي...")
-    clean_content = re.sub('<[^<]+?>', ' ', content_html)
+    try:
+        page_html = fetch_article_html(original_link)
+    except requests.RequestException as e:
+        print(f"    ⚠️ تعذر جلب صفحة المقال للملخص، سيُستخدم نص RSS: {e}")
+        page_html = None
+    
+    from recipe_extract import count_tokens, summarize_recipe_content
+    article_summary, summary_source = summarize_recipe_content(
+        page_html, content_html, PROMPT_CONTENT_TOKENS, ARTICLE_SELECTORS
+    )
+    trace_annotate(content_source=summary_source, content_tokens=count_tokens(article_summary))
+    print(f"--- 📋 ملخص المحتوى من {summary_source}: ~{count_tokens(article_summary)} رمز")
     
     alt_info = ""
     if image1_alt:
@@ -403,75 +1444,115 @@ def rewrite_content_with_gemini(title, content_html, original_link, image1_alt="
     - "tags": Array of 5 tags
     - "caption1": A short engaging caption for the first image
     - "caption2": A short engaging caption for the second image
-    """ % (title, clean_content[:1500], original_link, alt_info)
+    """ % (title, article_summary, original_link, alt_info)
+    
+    cache_key = gemini_cache_key(prompt, GEMINI_MODEL)
+    result = get_cached_gemini_result(cache_key)
+    if result is not None:
+        print("--- ♻️ تم استخدام نتيجة Gemini من الكاش (بدون طلب جديد).")
+        trace_annotate(cached=True)
+        return format_gemini_result(result, title, content_html)
     
-    api_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}'
-    headers = {'Content-Type': 'application/json'}
     data = {
         "contents": [{"parts": [{"text": prompt}]}],
-        "generationConfig": {"maxOutputTokens": 4096, "temperature": 0.7}
+        "generationConfig": structured_generation_config({"maxOutputTokens": 4096, "temperature": 0.7})
     }
     
     try:
-        response = requests.post(api_url, headers=headers, data=json.dumps(data), timeout=180)
-        response.raise_for_status()
-        response_json = response.json()
-        raw_text = response_json['candidates'][0]['content']['parts'][0]['text']
-        
-        json_match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-        if json_match:
-            clean_json_str = json_match.group(0)
-            result = json.loads(clean_json_str)
-            print("--- ✅ تم استلام مقال محسّن من Gemini.")
-            return {
-                "title": result.get("new_title", title),
-                "content": result.get("new_html_content", content_html),
-                "tags": result.get("tags", []),
-                "caption1": result.get("caption1", ""),
-                "caption2": result.get("caption2", "")
-            }
+        router = get_model_router()
+        started = time.perf_counter()
+        first_field = {}
+        
+        def on_field(key, value):
+            if not first_field:
+                first_field["ms"] = round((time.perf_counter() - started) * 1000, 1)
+                print(f"--- ⚡ أول حقل من Gemini ({key}) بعد {first_field['ms'] / 1000:.1f}s")
+            if key == "new_title":
+                # العنوان جاهز والنص ما زال يُولَّد: نجهّز Chrome للنشر في الخلفية
+                prewarm_browser()
+        
+        response_json, route = router.generate_sync(
+            data, stream=GEMINI_STREAM, on_field=on_field, is_valid=is_complete_gemini_json
+        )
+        usage = response_json.get('usageMetadata', {})
+        trace_annotate(
+            cached=False,
+            stream=GEMINI_STREAM,
+            first_field_ms=first_field.get("ms"),
+            model=route["model"],
+            hedged=route["hedged"],
+            attempts=route["attempts"],
+            prompt_tokens=usage.get('promptTokenCount', 0),
+            output_tokens=usage.get('candidatesTokenCount', 0),
+            total_tokens=usage.get('totalTokenCount', 0)
+        )
+        result = parse_json_object(gemini_response_text(response_json))
+        if result is None:
+            print("!!! رد Gemini لا يحتوي كائن JSON مكتملاً")
+            return None
+        
+        problems = validate_rewrite(result)
+        trace_annotate(validation_problems=sum(len(messages) for messages in problems.values()), repaired=False)
+        if problems:
+            print(f"--- 🩹 نتيجة Gemini تحتاج إصلاحاً: {problems}")
+            try:
+                result, repair_tokens = repair_gemini_result(result, problems)
+                trace_annotate(repaired=True, total_tokens=usage.get('totalTokenCount', 0) + repair_tokens)
+            except Exception as e:
+                print(f"    ⚠️ فشل طلب الإصلاح: {e}")
+            remaining = validate_rewrite(result)
+            if remaining:
+                print(f"    🧹 إصلاح محلي لما تبقى: {remaining}")
+        result = sanitize_rewrite(result)
+        
+        print("--- ✅ تم استلام مقال محسّن من Gemini.")
+        store_gemini_result(cache_key, result)
+        return format_gemini_result(result, title, content_html)
     except Exception as e:
         print(f"!!! خطأ في Gemini: {e}")
+        trace_annotate(attempts=getattr(e, 'attempts', None))
         return None
 
-def prepare_html_with_multiple_images_and_ctas(content_html, image1_data, image2_data, original_link, original_title, caption1="", caption2=""):
+def prepare_html_with_multiple_images_and_ctas(content_html, image1_data, image2_data, original_link, original_title, caption1="", caption2="", site=None):
     """إعداد HTML النهائي مع الصور وCTAs متعددة"""
+    site = site or DEFAULT_SITE
+    site_domain = site["domain"]
     
     print("--- 🎨 إعداد المحتوى النهائي مع الصور وCTAs...")
     
     if image1_data:
         alt1 = image1_data['alt'] or "Recipe preparation"
-        full_alt1 = f"{alt1} | {SITE_DOMAIN}" if alt1 else f"Recipe image | {SITE_DOMAIN}"
+        full_alt1 = f"{alt1} | {site_domain}" if alt1 else f"Recipe image | {site_domain}"
         
         image1_html = f'<img src="{image1_data["url"]}" alt="{full_alt1}">'
         
         if caption1:
             image_caption1 = caption1
         elif image1_data['alt']:
-            image_caption1 = f"{image1_data['alt']} | {SITE_DOMAIN}"
+            image_caption1 = f"{image1_data['alt']} | {site_domain}"
         else:
-            image_caption1 = f"Step-by-step preparation | {SITE_DOMAIN}"
+            image_caption1 = f"Step-by-step preparation | {site_domain}"
         
         image1_with_caption = f'{image1_html}<p><em>{image_caption1}</em></p>'
     else:
         image1_with_caption = ""
     
-    mid_cta = create_mid_cta(original_link, original_title)
+    mid_cta = create_mid_cta(original_link, original_title, site)
     
     if image2_data:
         alt2 = image2_data['alt'] or "Final dish"
-        full_alt2 = f"{alt2} | {SITE_DOMAIN}" if alt2 else f"Recipe result | {SITE_DOMAIN}"
+        full_alt2 = f"{alt2} | {site_domain}" if alt2 else f"Recipe result | {site_domain}"
         
         image2_html = f'<img src="{image2_data["url"]}" alt="{full_alt2}">'
         
         if caption2:
             image_caption2 = caption2
         elif image2_data['alt'] and image2_data['alt'] != image1_data.get('alt', ''):
-            image_caption2 = f"{image2_data['alt']} | {SITE_DOMAIN}"
+            image_caption2 = f"{image2_data['alt']} | {site_domain}"
         elif image2_data['url'] == image1_data.get('url', ''):
-            image_caption2 = f"Another view of this delicious recipe | {SITE_DOMAIN}"
+            image_caption2 = f"Another view of this delicious recipe | {site_domain}"
         else:
-            image_caption2 = f"The final result - absolutely delicious! | {SITE_DOMAIN}"
+            image_caption2 = f"The final result - absolutely delicious! | {site_domain}"
         
         image2_with_caption = f'{image2_html}<p><em>{image_caption2}</em></p>'
     else:
@@ -481,29 +1562,38 @@ def prepare_html_with_multiple_images_and_ctas(content_html, image1_data, image2
     content_html = content_html.replace("INSERT_MID_CTA_HERE", mid_cta)
     content_html = content_html.replace("INSERT_IMAGE_2_HERE", image2_with_caption)
     
-    final_cta = create_final_cta(original_link)
+    final_cta = create_final_cta(original_link, site)
     
     return content_html + final_cta
 
+# حقول الوسوم المحتملة في نافذة النشر (Medium يغيّرها من وقت لآخر)
+TAG_INPUT_SELECTORS = [
+    'div[data-testid="publishTopicsInput"] input',
+    'div[data-testid="publishTopicsInput"]',
+    'input[placeholder*="Add a tag"]',
+    'input[placeholder*="Add up to"]',
+    'input[placeholder*="topic"]',
+    'div.tags-input',
+    'input[aria-label*="tag"]',
+    'input[aria-label*="topic"]'
+]
+
 def add_tags_safely(driver, wait, tags):
     """إضافة الوسوم بطريقة أكثر موثوقية"""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    
     if not tags:
         return False
     
     try:
-        # انتظار قليل لضمان تحميل الصفحة
-        time.sleep(2)
-        
         # محاولة العثور على حقل الوسوم بطرق متعددة
-        selectors = [
-            'div[data-testid="publishTopicsInput"]',
-            'input[placeholder*="Add a tag"]',
-            'input[placeholder*="Add up to"]',
-            'input[placeholder*="topic"]',
-            'div.tags-input',
-            'input[aria-label*="tag"]',
-            'input[aria-label*="topic"]'
-        ]
+        selectors = TAG_INPUT_SELECTORS[1:]
+        
+        # انتظار ظهور أي من حقول الوسوم بدل مهلة ثابتة
+        wait_for_condition(
+            driver, lambda d: any(d.find_elements(By.CSS_SELECTOR, selector) for selector in selectors), "tags"
+        )
         
         tags_input = None
         for selector in selectors:
@@ -529,17 +1619,14 @@ def add_tags_safely(driver, wait, tags):
         if tags_input:
             # النقر على الحقل
             driver.execute_script("arguments[0].scrollIntoView(true);", tags_input)
-            time.sleep(1)
             driver.execute_script("arguments[0].click();", tags_input)
-            time.sleep(1)
             
             # إضافة الوسوم
             for i, tag in enumerate(tags[:5]):
                 if tag:
                     tags_input.send_keys(tag)
-                    time.sleep(0.5)
                     tags_input.send_keys(Keys.ENTER)
-                    time.sleep(1)
+                    wait_for_dom_settled(driver, "tags", quiet_ms=250)
                     print(f"    ✅ تمت إضافة الوسم {i+1}: {tag}")
             
             print(f"--- ✅ تمت إضافة {len(tags[:5])} وسوم بنجاح")
@@ -555,6 +1642,8 @@ def add_tags_safely(driver, wait, tags):
 
 def ensure_publish_now_selected(driver):
     """التأكد من تحديد خيار النشر الفوري"""
+    from selenium.webdriver.common.by import By
+    
     print("--- 🎯 التأكد من تحديد 'النشر الفوري'...")
     
     try:
@@ -565,7 +1654,6 @@ def ensure_publish_now_selected(driver):
                 element = publish_now_elements[0]
                 driver.execute_script("arguments[0].click();", element)
                 print("    ✅ تم تحديد 'Publish now' عبر النص")
-                time.sleep(1)
                 return True
         except:
             pass
@@ -577,7 +1665,6 @@ def ensure_publish_now_selected(driver):
                 # عادة الخيار الأول هو Publish now
                 driver.execute_script("arguments[0].click();", radio_buttons[0])
                 print("    ✅ تم تحديد أول خيار radio (النشر الفوري)")
-                time.sleep(1)
                 return True
         except:
             pass
@@ -589,7 +1676,6 @@ def ensure_publish_now_selected(driver):
                 if "publish now" in label.text.lower():
                     driver.execute_script("arguments[0].click();", label)
                     print("    ✅ تم النقر على label 'Publish now'")
-                    time.sleep(1)
                     return True
         except:
             pass
@@ -603,6 +1689,9 @@ def ensure_publish_now_selected(driver):
 
 def quick_publish_with_enter(driver):
     """نشر سريع بـ Enter - الطريقة الأكثر نجاحاً"""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    
     try:
         print("    ⚡ محاولة النشر السريع بـ Enter...")
         
@@ -611,7 +1700,7 @@ def quick_publish_with_enter(driver):
         
         # إرسال Enter مرتين للتأكيد
         active.send_keys(Keys.ENTER)
-        time.sleep(1)
+        wait_for_dom_settled(driver, "publish", quiet_ms=300, timeout=3)
         
         # التحقق من وجود زر تأكيد إضافي
         try:
@@ -633,6 +1722,8 @@ def quick_publish_with_enter(driver):
 
 def publish_with_optimized_attempts(driver, wait):
     """محاولات محسّنة للنشر النهائي - Enter أولاً"""
+    from selenium.webdriver.common.by import By
+    
     print("--- 🚀 بدء عملية النشر النهائي (محسّن)...")
     
     # حفظ لقطة شاشة قبل النشر
@@ -654,7 +1745,6 @@ def publish_with_optimized_attempts(driver, wait):
                 btn_text = btn.text.lower()
                 if "publish" in btn_text and ("now" in btn_text or not "schedule" in btn_text):
                     driver.execute_script("arguments[0].scrollIntoView(true);", btn)
-                    time.sleep(1)
                     driver.execute_script("arguments[0].click();", btn)
                     print(f"    ✅ تم النقر على زر: {btn.text}")
                     publish_success = True
@@ -720,7 +1810,7 @@ def publish_with_optimized_attempts(driver, wait):
             print(f"    ❌ فشلت المحاولة 4: {str(e)[:100]}")
     
     # حفظ لقطة شاشة بعد محاولات النشر
-    time.sleep(3)
+    wait_for_dom_settled(driver, "publish", quiet_ms=500, timeout=5)
     driver.save_screenshot("after_publish_attempts.png")
     print("    📸 تم حفظ لقطة شاشة بعد محاولات النشر")
     
@@ -731,7 +1821,13 @@ def publish_with_optimized_attempts(driver, wait):
     
     return publish_success
 
-def log_success_stats(title, url):
+def is_published_url(url):
+    """التحقق من أن الرابط الحالي يشير إلى مقال منشور وليس المحرر"""
+    if "new-story" in url or url.rstrip("/").endswith("/edit"):
+        return False
+    return "published" in url or "@" in url or "/p/" in url
+
+def log_success_stats(title, url, site=None):
     """تسجيل إحصائيات النجاح"""
     stats_file = "publishing_stats.json"
     from datetime import datetime
@@ -747,7 +1843,7 @@ def log_success_stats(title, url):
         "date": datetime.now().isoformat(),
         "title": title,
         "url": url,
-        "site": SITE_DOMAIN
+        "site": (site or DEFAULT_SITE)["domain"]
     })
     
     # الاحتفاظ بآخر 100 مقال فقط
@@ -759,26 +1855,109 @@ def log_success_stats(title, url):
     
     print(f"📊 إجمالي المقالات المنشورة: {stats['total_published']}")
 
-def main():
-    print(f"--- بدء تشغيل الروبوت الناشر v34 Optimized لموقع {SITE_DOMAIN} ---")
+def build_fallback_html(original_content_html, image1_data, image2_data, original_link, site=None):
+    """بناء HTML من المحتوى الأصلي عند فشل Gemini"""
+    site = site or DEFAULT_SITE
+    site_domain = site["domain"]
     
-    # وضع الاختبار
-    if TEST_MODE:
-        print("🧪 وضع الاختبار مُفعّل - سيتم إيقاف النشر الفعلي")
+    if image1_data:
+        alt1 = f"{image1_data['alt']} | {site_domain}" if image1_data['alt'] else f"Recipe image | {site_domain}"
+        image1_html = f'<img src="{image1_data["url"]}" alt="{alt1}">'
+        caption1 = f"<p><em>{alt1}</em></p>"
+    else:
+        image1_html = ""
+        caption1 = ""
     
-    post_to_publish = get_next_post_to_publish()
-    if not post_to_publish:
-        print(">>> النتيجة: لا توجد مقالات جديدة.")
-        return
+    mid_cta = f'<p><em>👉 See the full recipe at <a href="{original_link}" rel="noopener" target="_blank">{site_domain}</a></em></p>'
+    
+    if image2_data and image2_data['url'] != image1_data.get('url', ''):
+        alt2 = f"{image2_data['alt']} | {site_domain}" if image2_data['alt'] else f"Recipe detail | {site_domain}"
+        image2_html = f'<br><img src="{image2_data["url"]}" alt="{alt2}">'
+        caption2 = f"<p><em>{alt2}</em></p>"
+    else:
+        image2_html = ""
+        caption2 = ""
+    
+    final_cta = f'<br><p><strong>Get the complete recipe with all ingredients and instructions at <a href="{original_link}" rel="noopener" target="_blank">{site_domain}</a>.</strong></p>'
+    
+    return image1_html + caption1 + mid_cta + original_content_html + image2_html + caption2 + final_cta
 
-    original_title = post_to_publish.title
-    original_link = post_to_publish.link
+def is_medium_hosted(url):
+    """صورة مستضافة على Medium (miro أو cdn-images) لا تحتاج جلباً عند اللصق"""
+    from urllib.parse import urlsplit
+    host = urlsplit(url or "").netloc.lower()
+    return host == "medium.com" or host.endswith(".medium.com")
+
+def start_image_uploads(executor, images):
+    """بدء رفع الصور إلى Medium في الخلفية - يرجع Future بقاموس {الرابط الأصلي: رابط Medium} أو None"""
+    from medium_images import upload_images
+    
+    token = os.environ.get("MEDIUM_INTEGRATION_TOKEN")
+    urls = [img["url"] for img in images if img and not is_medium_hosted(img["url"])]
+    if TEST_MODE or not MEDIUM_PREUPLOAD_IMAGES or not token or not urls:
+        return None
+    
+    def upload():
+        with trace_span("image_upload", images=len(urls)) as span:
+            uploaded = upload_images(
+                urls, token, MEDIUM_API_BASE, session=get_session(), cache_path=IMAGE_CACHE_FILE
+            )
+            span["uploaded"] = len(uploaded)
+        return uploaded
+    
+    print(f"--- ⬆️ رفع {len(urls)} صورة إلى Medium بالتوازي مع Gemini...")
+    return executor.submit(upload)
+
+def apply_uploaded_images(upload_future, images):
+    """استبدال روابط الصور بروابط Medium بعد انتهاء الرفع (الأصلي يبقى في source_url)"""
+    if upload_future is None:
+        return images
+    try:
+        uploaded = upload_future.result()
+    except Exception as e:
+        print(f"    ⚠️ فشل رفع الصور مسبقاً، ستبقى الروابط الأصلية: {str(e)[:100]}")
+        return images
     
-    rss_image = extract_image_url_from_entry(post_to_publish)
-    if rss_image:
-        print(f"--- 📷 صورة RSS احتياطية: {rss_image[:80]}...")
+    if uploaded:
+        print(f"--- ✅ {len(uploaded)} صورة مستضافة على Medium مسبقاً")
+    return [
+        {**img, "url": uploaded[img["url"]], "source_url": img["url"]} if img and img["url"] in uploaded else img
+        for img in images
+    ]
+
+def count_prehosted_images(post):
+    """عدد صور المقال التي لن يجلبها Medium من موقع المصدر"""
+    return sum(
+        1 for key in ("image1", "image2")
+        if post.get(key) and (post[key].get("source_url") or is_medium_hosted(post[key]["url"]))
+    )
+
+def prepare_post(entry, site=None):
+    """تجهيز مقال للنشر: كشط الصور وإعادة الكتابة بـ Gemini وبناء HTML النهائي"""
+    site = site or DEFAULT_SITE
+    original_title = entry.title
+    original_link = entry.link
+    print(f"--- 🧩 تجهيز المقال: {original_title}")
     
-    image1_data, image2_data = get_best_images_for_article(original_link, rss_image)
+    # الاستئناف من آخر مرحلة مكتملة
+    article = get_article(original_link)
+    payload = article["payload"] if article else {}
+    if payload.get("post"):
+        print("--- ♻️ استئناف: المقال مُجهّز مسبقاً، تخطي الكشط وGemini")
+        return payload["post"]
+    
+    if "images" in payload:
+        print("--- ♻️ استئناف: الصور مكشوطة مسبقاً، تخطي الكشط")
+        image1_data, image2_data = payload["images"]
+    else:
+        rss_image = extract_image_url_from_entry(entry)
+        if rss_image:
+            print(f"--- 📷 صورة RSS احتياطية: {rss_image[:80]}...")
+        
+        with trace_span("scrape", post=original_link) as span:
+            image1_data, image2_data = get_best_images_for_article(original_link, rss_image, site)
+            span["images_found"] = len([img for img in (image1_data, image2_data) if img])
+        update_article_state(original_link, "scraped", payload={"images": [image1_data, image2_data]}, site=site)
     
     if image1_data:
         print(f"--- 🖼️ الصورة الأولى: {image1_data['url'][:60]}...")
@@ -793,181 +1972,682 @@ def main():
         print("--- ⚠️ لم يتم العثور على صور صالحة للمقال!")
     
     original_content_html = ""
-    if 'content' in post_to_publish and post_to_publish.content:
-        original_content_html = post_to_publish.content[0].value
+    if 'content' in entry and entry.content:
+        original_content_html = entry.content[0].value
     else:
-        original_content_html = post_to_publish.summary
+        original_content_html = entry.summary
 
     image1_alt = image1_data['alt'] if image1_data else ""
     image2_alt = image2_data['alt'] if image2_data else ""
     
-    rewritten_data = rewrite_content_with_gemini(
-        original_title, original_content_html, original_link, image1_alt, image2_alt
-    )
+    from concurrent.futures import ThreadPoolExecutor
     
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-upload") as upload_executor:
+        upload_future = start_image_uploads(upload_executor, [image1_data, image2_data])
+        
+        with trace_span("gemini", post=original_link, input_bytes=len(original_content_html.encode('utf-8'))):
+            rewritten_data = rewrite_content_with_gemini(
+                original_title, original_content_html, original_link, image1_alt, image2_alt
+            )
+        
+        image1_data, image2_data = apply_uploaded_images(upload_future, [image1_data, image2_data])
+    
+    with trace_span("compose", post=original_link, rewritten=bool(rewritten_data)) as span:
+        if rewritten_data:
+            final_title = rewritten_data["title"]
+            ai_content = rewritten_data["content"]
+            ai_tags = rewritten_data.get("tags", [])
+            caption1 = rewritten_data.get("caption1", "")
+            caption2 = rewritten_data.get("caption2", "")
+            
+            full_html_content = prepare_html_with_multiple_images_and_ctas(
+                ai_content, image1_data, image2_data, original_link, original_title, caption1, caption2, site
+            )
+            print("--- ✅ تم إعداد المحتوى المُحسّن مع الصور وDouble CTA.")
+        else:
+            print("--- ⚠️ سيتم استخدام المحتوى الأصلي.")
+            final_title = original_title
+            ai_tags = []
+            full_html_content = build_fallback_html(original_content_html, image1_data, image2_data, original_link, site)
+        span["html_bytes"] = len(full_html_content.encode('utf-8'))
+    
+    post = {
+        "site": site["name"],
+        "link": original_link,
+        "original_title": original_title,
+        "title": final_title,
+        "html": full_html_content,
+        "tags": ai_tags,
+        "image1": image1_data,
+        "image2": image2_data,
+        # False عند المحتوى الأصلي الاحتياطي (فشل Gemini)
+        "rewritten": bool(rewritten_data)
+    }
+    
+    # لا نحفظ المحتوى الاحتياطي حتى تُعاد محاولة Gemini في التشغيل القادم
     if rewritten_data:
-        final_title = rewritten_data["title"]
-        ai_content = rewritten_data["content"]
-        ai_tags = rewritten_data.get("tags", [])
-        caption1 = rewritten_data.get("caption1", "")
-        caption2 = rewritten_data.get("caption2", "")
-        
-        full_html_content = prepare_html_with_multiple_images_and_ctas(
-            ai_content, image1_data, image2_data, original_link, original_title, caption1, caption2
+        update_article_state(original_link, "rewritten", payload={"post": post}, site=site)
+    
+    return post
+
+class PublishUncertain(Exception):
+    """فشل لا نعرف معه هل نُشر المقال أم لا - لا ننتقل لواجهة أخرى حتى لا يتكرر النشر"""
+
+_medium_user_id = None
+
+def get_medium_user_id(token):
+    """معرّف حساب Medium لرمز التكامل (MEDIUM_USER_ID أو GET /v1/me مرة واحدة)"""
+    global _medium_user_id
+    if _medium_user_id is None:
+        _medium_user_id = os.environ.get("MEDIUM_USER_ID")
+    if _medium_user_id is None:
+        response = get_session().get(
+            f"{MEDIUM_API_BASE}/v1/me",
+            headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
+            timeout=TIMEOUTS["default"]
         )
-        print("--- ✅ تم إعداد المحتوى المُحسّن مع الصور وDouble CTA.")
-    else:
-        print("--- ⚠️ سيتم استخدام المحتوى الأصلي.")
-        final_title = original_title
-        ai_tags = []
-        
-        if image1_data:
-            alt1 = f"{image1_data['alt']} | {SITE_DOMAIN}" if image1_data['alt'] else f"Recipe image | {SITE_DOMAIN}"
-            image1_html = f'<img src="{image1_data["url"]}" alt="{alt1}">'
-            caption1 = f"<p><em>{alt1}</em></p>"
-        else:
-            image1_html = ""
-            caption1 = ""
+        response.raise_for_status()
+        _medium_user_id = response.json()["data"]["id"]
+    return _medium_user_id
+
+def publish_post_api(post, credentials, site=None):
+    """نشر عبر واجهة Medium البرمجية بطلب واحد (contentFormat=html) - يرجع رابط المقال"""
+    token = credentials["token"]
+    with trace_span("publish_api", post=post["link"], html_bytes=len(post["html"].encode('utf-8')), prehosted_images=count_prehosted_images(post)) as span:
+        user_id = get_medium_user_id(token)
+        body = {
+            "title": post["title"],
+            "contentFormat": "html",
+            # Medium لا يعرض حقل title داخل المقال، فالعنوان يُضاف كـ h1 في بداية المحتوى
+            "content": f"<h1>{html.escape(post['title'])}</h1>{post['html']}",
+            "tags": post["tags"][:5],
+            "publishStatus": "public",
+        }
+        try:
+            response = get_session().post(
+                f"{MEDIUM_API_BASE}/v1/users/{user_id}/posts",
+                headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json", "Accept": "application/json"},
+                data=json.dumps(body), timeout=TIMEOUTS["default"]
+            )
+        except requests.ConnectTimeout:
+            raise
+        except (requests.ConnectionError, requests.Timeout) as e:
+            # بعد إرسال الطلب قد يكون المقال نُشر فعلاً ولم يصلنا الرد
+            raise PublishUncertain(f"no response from Medium API: {e}") from e
         
-        mid_cta = f'<p><em>👉 See the full recipe at <a href="{original_link}" rel="noopener" target="_blank">{SITE_DOMAIN}</a></em></p>'
+        span["http_status"] = response.status_code
+        if response.status_code == 408 or response.status_code >= 500:
+            # خطأ البوابة قد يصل بعد إنشاء المقال، فلا ننتقل للمحرر حتى لا يتكرر النشر
+            raise PublishUncertain(f"Medium API HTTP {response.status_code}: {response.text[:200]}")
+        if response.status_code not in (200, 201):
+            raise RuntimeError(f"Medium API HTTP {response.status_code}: {response.text[:200]}")
+        try:
+            return response.json()["data"]["url"]
+        except (ValueError, KeyError, TypeError) as e:
+            raise PublishUncertain(f"unexpected Medium API response: {response.text[:200]}") from e
+
+def apply_publisher_profile(driver, editor_ready=False):
+    """ملف الناشر: قبل جاهزية المحرر تُحظر الصور والخطوط والمتتبعات، وبعدها المتتبعات فقط
+    
+    الصور تعود قبل اللصق لأن المحرر يحمّل صور المحتوى ويرفعها.
+    """
+    from browser_setup import set_blocked_resources
+    
+    if not PUBLISHER_BLOCK_RESOURCES:
+        return 0
+    return set_blocked_resources(driver, block_media=not editor_ready, block_trackers=True)
+
+# لصق HTML كحدث paste يحمل text/html - نفس ما يصل للمحرر من الحافظة بدون إذن الحافظة
+PASTE_HTML_JS = """
+(html) => {
+    const target = document.activeElement;
+    const data = new DataTransfer();
+    data.setData('text/html', html);
+    data.setData('text/plain', html.replace(/<[^>]+>/g, ' '));
+    target.dispatchEvent(new ClipboardEvent('paste', {clipboardData: data, bubbles: true, cancelable: true}));
+    return target.tagName;
+}
+"""
+
+# نفس محاولات ensure_publish_now_selected ثم publish_with_optimized_attempts داخل الصفحة
+SELECT_PUBLISH_NOW_JS = """
+() => {
+    const byText = Array.from(document.querySelectorAll('label, span, div, button'))
+        .find(el => el.children.length <= 1 && el.textContent.trim().toLowerCase() === 'publish now' && el.tagName !== 'BUTTON');
+    if (byText) { byText.click(); return 'text'; }
+    const radio = document.querySelector('input[type="radio"]');
+    if (radio) { radio.click(); return 'radio'; }
+    return null;
+}
+"""
+
+CLICK_PUBLISH_BUTTON_JS = """
+() => {
+    const confirm = document.querySelector('[data-testid="publishConfirmButton"]');
+    if (confirm) { confirm.click(); return 'confirm'; }
+    const button = Array.from(document.querySelectorAll('button')).find(btn => {
+        const text = btn.textContent.toLowerCase();
+        return text.includes('publish') && !text.includes('schedule') && !text.includes('draft');
+    });
+    if (button) { button.click(); return button.textContent.trim(); }
+    return null;
+}
+"""
+
+def publish_post_cdp(post, credentials, site=None):
+    """نشر عبر المحرر باستخدام CDP مباشرة: insertText وأحداث إدخال حقيقية بدل send_keys"""
+    final_title = post["title"]
+    full_html_content = post["html"]
+    
+    with _browser_lock:
+        driver = get_browser()
+        publish_clicked = False
         
-        if image2_data and image2_data['url'] != image1_data.get('url', ''):
-            alt2 = f"{image2_data['alt']} | {SITE_DOMAIN}" if image2_data['alt'] else f"Recipe detail | {SITE_DOMAIN}"
-            image2_html = f'<br><img src="{image2_data["url"]}" alt="{alt2}">'
-            caption2 = f"<p><em>{alt2}</em></p>"
-        else:
-            image2_html = ""
-            caption2 = ""
+        try:
+            with trace_span("editor_load", post=post["link"], backend="cdp") as span:
+                print("--- 2. إعداد الجلسة...")
+                span["blocked_patterns"] = apply_publisher_profile(driver)
+                # Network.setCookie يقبل الرابط مباشرة، فلا حاجة لفتح الصفحة الرئيسية أولاً
+                for name, value in (("sid", credentials["sid"]), ("uid", credentials["uid"])):
+                    cookie = {"name": name, "value": value, "url": f"{MEDIUM_BASE_URL}/"}
+                    if MEDIUM_BASE_URL == "https://medium.com":
+                        cookie["domain"] = ".medium.com"
+                    driver.add_cookie(cookie)
+                
+                print("--- 3. الانتقال إلى محرر المقالات...")
+                driver.get(f"{MEDIUM_BASE_URL}/new-story")
+                
+                print("--- 4. كتابة العنوان...")
+                if not driver.wait_for_selector('h3[data-testid="editorTitleParagraph"]', 30):
+                    raise RuntimeError("editor title field did not appear")
+                driver.click('h3[data-testid="editorTitleParagraph"]')
+                driver.insert_text(final_title)
+                apply_publisher_profile(driver, editor_ready=True)
+            
+            with trace_span("paste", post=post["link"], html_bytes=len(full_html_content.encode('utf-8')), prehosted_images=count_prehosted_images(post)):
+                print("--- 5. إدراج المحتوى مع الصور وCTAs...")
+                if not driver.wait_for_selector('p[data-testid="editorParagraphText"]', 30):
+                    raise RuntimeError("editor body field did not appear")
+                driver.click('p[data-testid="editorParagraphText"]')
+                driver.call(PASTE_HTML_JS, full_html_content)
+                
+                print("--- ⏳ انتظار رفع الصور...")
+                wait_for_dom_settled(driver, "paste", quiet_ms=1000)
+                wait_for_network_idle(driver, "paste", idle_ms=1000)
+            
+            driver.save_screenshot("content_ready.png")
+            print("    📸 تم حفظ لقطة شاشة للمحتوى")
+            
+            with trace_span("publish", post=post["link"]) as span:
+                print("--- 6. بدء النشر (فتح نافذة الخيارات)...")
+                if not driver.click('button[data-action="show-prepublish"]'):
+                    raise RuntimeError("publish button not found")
+                driver.wait_for_selector('button[data-testid="publishConfirmButton"]', WAIT_BUDGETS["prepublish"])
+                wait_for_dom_settled(driver, "prepublish", quiet_ms=200)
+                driver.save_screenshot("publish_dialog.png")
+                
+                print("--- 7. التأكد من اختيار 'النشر الفوري'...")
+                print(f"    ✅ خيار النشر: {driver.call(SELECT_PUBLISH_NOW_JS) or 'محدد مسبقاً'}")
+                
+                print("--- 8. إضافة الوسوم (اختياري)...")
+                tags = [tag for tag in post["tags"][:5] if tag]
+                tags_input = driver.wait_for_selector(TAG_INPUT_SELECTORS, WAIT_BUDGETS["tags"]) if tags else None
+                if tags_input and driver.click(tags_input):
+                    for i, tag in enumerate(tags):
+                        driver.insert_text(tag)
+                        driver.press_key("Enter")
+                        wait_for_dom_settled(driver, "tags", quiet_ms=250)
+                        print(f"    ✅ تمت إضافة الوسم {i+1}: {tag}")
+                else:
+                    print("    ℹ️ لم أجد حقل الوسوم - متابعة بدون وسوم")
+                
+                print("--- 9. النشر النهائي...")
+                publish_clicked = True
+                if not driver.click('button[data-testid="publishConfirmButton"]'):
+                    print(f"    🔍 نقر احتياطي عبر JavaScript: {driver.call(CLICK_PUBLISH_BUTTON_JS)}")
+                
+                print("--- 10. انتظار معالجة النشر...")
+                # أحداث التنقل (بما فيها pushState) بدل استطلاع الرابط
+                current_url = driver.wait_for_url(is_published_url, WAIT_BUDGETS["publish"]) or driver.current_url
+                span["tags_added"] = bool(tags_input)
+                span["confirmed"] = is_published_url(current_url)
+            
+            driver.save_screenshot("final_result.png")
+            
+        except Exception as e:
+            print(f"!!! حدث خطأ فادح أثناء عملية النشر: {e}")
+            try:
+                driver.save_screenshot("error_screenshot.png")
+                with open("error_page_source.html", "w", encoding="utf-8") as f:
+                    f.write(driver.page_source)
+                print("--- تم حفظ لقطة الشاشة وHTML للمراجعة")
+            except Exception:
+                pass
+            if publish_clicked:
+                raise PublishUncertain(str(e)[:300]) from e
+            raise
+    
+    if not is_published_url(current_url):
+        raise PublishUncertain(f"unconfirmed: {current_url}")
+    return current_url
+
+def publish_post_browser(post, credentials, site=None):
+    """نشر مقال مُجهّز عبر محرر Medium في المتصفح المشترك - يرجع رابط المقال"""
+    if BROWSER_BACKEND == "cdp":
+        return publish_post_cdp(post, credentials, site)
+    
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    
+    final_title = post["title"]
+    full_html_content = post["html"]
+    ai_tags = post["tags"]
+    
+    with _browser_lock:
+        driver = get_browser()
+        publish_clicked = False
         
-        final_cta = f'<br><p><strong>Get the complete recipe with all ingredients and instructions at <a href="{original_link}" rel="noopener" target="_blank">{SITE_DOMAIN}</a>.</strong></p>'
+        try:
+            with trace_span("editor_load", post=post["link"]) as span:
+                print("--- 2. إعداد الجلسة...")
+                span["blocked_patterns"] = apply_publisher_profile(driver)
+                driver.get(f"{MEDIUM_BASE_URL}/")
+                for name, value in (("sid", credentials["sid"]), ("uid", credentials["uid"])):
+                    cookie = {"name": name, "value": value}
+                    if MEDIUM_BASE_URL == "https://medium.com":
+                        cookie["domain"] = ".medium.com"
+                    driver.add_cookie(cookie)
+                
+                print("--- 3. الانتقال إلى محرر المقالات...")
+                driver.get(f"{MEDIUM_BASE_URL}/new-story")
+                
+                wait = WebDriverWait(driver, 30)
+                
+                print("--- 4. كتابة العنوان...")
+                title_field = wait.until(EC.element_to_be_clickable(
+                    (By.CSS_SELECTOR, 'h3[data-testid="editorTitleParagraph"]')
+                ))
+                title_field.click()
+                title_field.send_keys(final_title)
+                apply_publisher_profile(driver, editor_ready=True)
+            
+            with trace_span("paste", post=post["link"], html_bytes=len(full_html_content.encode('utf-8')), prehosted_images=count_prehosted_images(post)):
+                print("--- 5. إدراج المحتوى مع الصور وCTAs...")
+                story_field = wait.until(EC.element_to_be_clickable(
+                    (By.CSS_SELECTOR, 'p[data-testid="editorParagraphText"]')
+                ))
+                story_field.click()
+                
+                js_script = """
+                const html = arguments[0];
+                const blob = new Blob([html], { type: 'text/html' });
+                const item = new ClipboardItem({ 'text/html': blob });
+                navigator.clipboard.write([item]);
+                """
+                driver.execute_script(js_script, full_html_content)
+                story_field.send_keys(Keys.CONTROL, 'v')
+                
+                print("--- ⏳ انتظار رفع الصور...")
+                wait_for_dom_settled(driver, "paste", quiet_ms=1000)
+                wait_for_network_idle(driver, "paste", idle_ms=1000)
+            
+            # حفظ لقطة شاشة للمحتوى
+            driver.save_screenshot("content_ready.png")
+            print("    📸 تم حفظ لقطة شاشة للمحتوى")
+            
+            with trace_span("publish", post=post["link"]) as span:
+                print("--- 6. بدء النشر (فتح نافذة الخيارات)...")
+                publish_button = wait.until(EC.element_to_be_clickable(
+                    (By.CSS_SELECTOR, 'button[data-action="show-prepublish"]')
+                ))
+                publish_button.click()
+                
+                # انتظار ظهور نافذة النشر
+                wait_for_condition(driver, EC.presence_of_element_located(
+                    (By.CSS_SELECTOR, 'button[data-testid="publishConfirmButton"]')
+                ), "prepublish")
+                
+                # حفظ لقطة شاشة لنافذة النشر
+                driver.save_screenshot("publish_dialog.png")
+                print("    📸 تم حفظ لقطة شاشة لنافذة النشر")
+                
+                print("--- 7. التأكد من اختيار 'النشر الفوري'...")
+                ensure_publish_now_selected(driver)
+                
+                print("--- 8. إضافة الوسوم (اختياري)...")
+                tags_added = add_tags_safely(driver, wait, ai_tags)
+                if not tags_added:
+                    print("    ℹ️ متابعة بدون وسوم - لا يؤثر على النشر")
+                
+                # النشر النهائي بمحاولات محسّنة
+                print("--- 9. النشر النهائي...")
+                publish_clicked = True
+                publish_result = publish_with_optimized_attempts(driver, wait)
+                
+                print("--- 10. انتظار معالجة النشر...")
+                # ينتهي الانتظار فور انتقال المتصفح إلى رابط المقال المنشور
+                wait_for_condition(driver, lambda d: is_published_url(d.current_url), "publish")
+                
+                current_url = driver.current_url
+                span["tags_added"] = tags_added
+                span["confirmed"] = is_published_url(current_url)
+            
+            # حفظ لقطة شاشة نهائية
+            driver.save_screenshot("final_result.png")
+            print("    📸 تم حفظ لقطة شاشة نهائية")
+            
+        except Exception as e:
+            print(f"!!! حدث خطأ فادح أثناء عملية النشر: {e}")
+            driver.save_screenshot("error_screenshot.png")
+            with open("error_page_source.html", "w", encoding="utf-8") as f:
+                f.write(driver.page_source)
+            print("--- تم حفظ لقطة الشاشة وHTML للمراجعة")
+            if publish_clicked:
+                raise PublishUncertain(str(e)[:300]) from e
+            raise
+    
+    # التحقق من نجاح النشر
+    if not is_published_url(current_url):
+        # زر النشر ضُغط، فلا نعيد المحاولة عبر واجهة أخرى
+        raise PublishUncertain(f"unconfirmed: {current_url}")
+    return current_url
+
+# واجهات النشر: كل واجهة (post, credentials, site) -> رابط المقال، وترفع استثناء عند الفشل
+PUBLISHER_BACKENDS = {
+    "api": publish_post_api,
+    "browser": publish_post_browser,
+}
+
+# بيانات الاعتماد التي تحتاجها كل واجهة
+PUBLISHER_CREDENTIALS = {
+    "api": ("token",),
+    "browser": ("sid", "uid"),
+}
+
+def get_publish_credentials():
+    return {
+        "token": os.environ.get("MEDIUM_INTEGRATION_TOKEN"),
+        "sid": os.environ.get("MEDIUM_SID_COOKIE"),
+        "uid": os.environ.get("MEDIUM_UID_COOKIE"),
+    }
+
+def available_publishers(credentials):
+    """الواجهات المهيأة من PUBLISHERS بالترتيب (بياناتها متوفرة)"""
+    return [
+        name for name in PUBLISHERS
+        if name in PUBLISHER_BACKENDS and all(credentials.get(key) for key in PUBLISHER_CREDENTIALS[name])
+    ]
+
+def publish_post(post, credentials, site=None):
+    """نشر مقال مُجهّز عبر أول واجهة تنجح، مع تسجيل الحالة مرة واحدة"""
+    site = site or DEFAULT_SITE
+    errors = []
+    
+    for name in available_publishers(credentials):
+        print(f"--- 🚀 النشر عبر الواجهة: {name}")
+        try:
+            medium_url = PUBLISHER_BACKENDS[name](post, credentials, site)
+        except PublishUncertain as e:
+            # لا إعادة تلقائية: إعادة النشر قد تكرر المقال على Medium
+            print(f"--- ⚠️ لم يتم تأكيد النشر ({name}): {e}")
+            print(f"    🔎 تحقق يدوياً من حساب Medium - المقال بحالة unconfirmed في {STATE_DB_FILE}")
+            update_article_state(post["link"], "unconfirmed", error=f"{name}: {str(e)[:500]}", count_attempt=True, site=site)
+            return False
+        except Exception as e:
+            print(f"!!! فشل النشر عبر {name}: {e}")
+            errors.append(f"{name}: {str(e)[:200]}")
+            continue
         
-        full_html_content = image1_html + caption1 + mid_cta + original_content_html + image2_html + caption2 + final_cta
+        print(f"--- ✅✅✅ تأكيد: تم النشر بنجاح! URL: {medium_url}")
+        log_success_stats(post["title"], medium_url, site)
+        update_article_state(post["link"], "published", medium_url=medium_url, count_attempt=True, site=site)
+        trace_annotate_run(publisher=name)
+        print(f">>> 🎉🎉🎉 تم نشر المقال بنجاح على {site['domain']}! 🎉🎉🎉")
+        return True
+    
+    update_article_state(post["link"], "failed", error="; ".join(errors)[:500], count_attempt=True, site=site)
+    return False
+
+def parse_args():
+    """قراءة خيارات سطر الأوامر"""
+    import argparse
+    parser = argparse.ArgumentParser(description="روبوت النشر التلقائي على Medium")
+    parser.add_argument("command", nargs="?", choices=("run", "prepare", "publish"), default="run",
+                        help="run: السلسلة كاملة | prepare: تجهيز المقالات في الطابور فقط | publish: النشر من الطابور فقط")
+    parser.add_argument("--max-posts", type=int, default=MAX_POSTS,
+                        help="أقصى عدد من المقالات الجديدة للنشر في هذا التشغيل")
+    parser.add_argument("--queue-target", type=int, default=QUEUE_TARGET,
+                        help="prepare: عدد المقالات الجاهزة المطلوب في الطابور")
+    parser.add_argument("--workers", type=int, default=PREPARE_WORKERS,
+                        help="عدد العمال المتوازيين لتجهيز المقالات (كشط + Gemini)")
+    parser.add_argument("--site", action="append",
+                        help="معالجة موقع محدد فقط من سجل المواقع (يمكن تكراره)")
+    parser.add_argument("--no-gemini-cache", action="store_true",
+                        help="تجاهل كاش Gemini وطلب إعادة كتابة جديدة")
+    return parser.parse_args()
+
+def fetch_site_posts(site, max_posts, skip_states=()):
+    """جلب المقالات الجديدة لموقع واحد (أخطاء موقع لا توقف بقية المواقع)"""
+    try:
+        with trace_span("rss", site=site["name"]) as span:
+            entries = get_next_posts_to_publish(max(1, site["max_posts"] or max_posts), site, skip_states)
+            span["new_entries"] = len(entries)
+        return entries
+    except Exception as e:
+        print(f"!!! فشل جلب خلاصة {site['name']}: {e}")
+        return []
+
+def main():
+    global GEMINI_CACHE_BYPASS
+    args = parse_args()
+    if args.no_gemini_cache:
+        GEMINI_CACHE_BYPASS = True
+    
+    start_run_trace()
+    trace_annotate_run(command=args.command)
+    outcome = "error"
+    try:
+        if args.command == "prepare":
+            outcome = prepare_pipeline(args)
+        elif args.command == "publish":
+            outcome = publish_pipeline(args)
+        else:
+            outcome = run_pipeline(args)
+    finally:
+        finish_run_trace(outcome)
 
-    # في وضع الاختبار، نتوقف هنا
+def select_sites(args):
+    sites = load_sites()
+    if args.site:
+        sites = [site for site in sites if site["name"] in args.site]
+    print(f"--- بدء تشغيل الروبوت الناشر v34 Optimized ({args.command}) لـ {len(sites)} موقع: {', '.join(site['domain'] for site in sites)} ---")
+    
+    # وضع الاختبار
     if TEST_MODE:
-        print("🧪 وضع الاختبار: توقف قبل النشر الفعلي")
-        print(f"    📝 العنوان: {final_title}")
-        print(f"    🏷️ الوسوم: {ai_tags}")
-        return
+        print("🧪 وضع الاختبار مُفعّل - سيتم إيقاف النشر الفعلي")
+    return sites
 
-    # --- النشر على Medium ---
-    sid_cookie = os.environ.get("MEDIUM_SID_COOKIE")
-    uid_cookie = os.environ.get("MEDIUM_UID_COOKIE")
+def fetch_all_posts(sites, max_posts, skip_states=()):
+    """جلب خلاصات كل المواقع بالتوازي - يرجع [(الموقع، المقال)]"""
+    from concurrent.futures import ThreadPoolExecutor
     
-    if not sid_cookie or not uid_cookie:
-        print("!!! خطأ: لم يتم العثور على الكوكيز.")
-        return
+    with ThreadPoolExecutor(max_workers=max(1, min(len(sites), SITE_WORKERS))) as executor:
+        site_futures = [(site, executor.submit(fetch_site_posts, site, max_posts, skip_states)) for site in sites]
+        return [(site, entry) for site, future in site_futures for entry in future.result()]
 
-    options = webdriver.ChromeOptions()
-    options.add_argument("--headless")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("window-size=1920,1080")
-    options.add_argument("--disable-blink-features=AutomationControlled")
+def close_resources():
+    close_browser()
+    clear_page_cache()
+    close_state_db()
+    close_gemini_client()
+    close_session()
+    print("--- تم إغلاق الروبوت ---")
+
+def prepare_pipeline(args):
+    """أمر prepare: تجهيز مقالات جديدة (كشط + Gemini + HTML نهائي) وإضافتها إلى الطابور بدون نشر"""
+    global _browser_prewarm
+    _browser_prewarm = False
+    sites = select_sites(args)
     
-    service = ChromeService(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=options)
+    queued = count_queued_posts()
+    needed = args.queue_target - queued
+    print(f"--- 📥 الطابور: {queued} مقال جاهز، المطلوب {args.queue_target}")
+    trace_annotate_run(queued_before=queued)
+    if needed <= 0:
+        print(">>> النتيجة: الطابور ممتلئ، لا حاجة للتجهيز.")
+        return "queue_full"
+    
+    from concurrent.futures import ThreadPoolExecutor
+    from itertools import chain, zip_longest
+    
+    # المقالات المنتظرة في الطابور أو قيد النشر ليست جديدة
+    candidates = fetch_all_posts(sites, needed, skip_states=("queued", "publishing"))
+    # توزيع عادل بين المواقع قبل القص
+    by_site = {}
+    for site, entry in candidates:
+        by_site.setdefault(site["name"], []).append((site, entry))
+    posts_to_prepare = [item for item in chain.from_iterable(zip_longest(*by_site.values())) if item][:needed]
+    
+    trace_annotate_run(sites=len(sites), posts=len(posts_to_prepare))
+    if not posts_to_prepare:
+        print(">>> النتيجة: لا توجد مقالات جديدة.")
+        return "nothing_new"
+    
+    prepared_count = 0
+    workers = max(1, min(args.workers, len(posts_to_prepare)))
+    print(f"--- 📦 تجهيز {len(posts_to_prepare)} مقال بـ {workers} عامل")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(site, executor.submit(prepare_post, entry, site)) for site, entry in posts_to_prepare]
+            for site, future in futures:
+                try:
+                    post = future.result()
+                except Exception as e:
+                    print(f"!!! فشل تجهيز المقال ({site['name']}): {e}")
+                    continue
+                # المحتوى الأصلي الاحتياطي لا يدخل الطابور: التجهيز التالي يعيد محاولة Gemini
+                if not post.get("rewritten", True):
+                    print(f"--- ⏭️ لم يُضف إلى الطابور (لم تنجح إعادة الكتابة): {post['title']}")
+                    continue
+                enqueue_post(post, site)
+                prepared_count += 1
+                print(f"--- 📥 أُضيف إلى الطابور: {post['title']}")
+    finally:
+        close_resources()
+    
+    print(f"📦 تم تجهيز {prepared_count} من {len(posts_to_prepare)} مقال - في الطابور الآن {queued + prepared_count}")
+    trace_annotate_run(prepared=prepared_count)
+    return "prepared" if prepared_count else "failed"
 
-    stealth(driver, 
-            languages=["en-US", "en"], 
-            vendor="Google Inc.", 
-            platform="Win32", 
-            webgl_vendor="Intel Inc.", 
-            renderer="Intel Iris OpenGL Engine", 
-            fix_hairline=True)
+def publish_pipeline(args):
+    """أمر publish: سحب المقالات الجاهزة من الطابور ونشرها فقط (بدون RSS ولا كشط ولا Gemini)"""
+    sites = select_sites(args)
+    sites_by_name = {site["name"]: site for site in sites}
+    
+    recover_interrupted_publishes()
+    posts = [post for post in get_queued_posts() if post.get("site", DEFAULT_SITE["name"]) in sites_by_name]
+    posts = posts[:max(1, args.max_posts)]
+    trace_annotate_run(sites=len(sites), posts=len(posts))
+    if not posts:
+        print(">>> النتيجة: الطابور فارغ.")
+        return "queue_empty"
     
+    credentials = get_publish_credentials()
+    if not TEST_MODE and not available_publishers(credentials):
+        print("!!! خطأ: لم يتم العثور على الكوكيز أو رمز التكامل لأي واجهة نشر.")
+        return "missing_cookies"
+    
+    published_count = 0
     try:
-        print("--- 2. إعداد الجلسة...")
-        driver.get("https://medium.com/")
-        driver.add_cookie({"name": "sid", "value": sid_cookie, "domain": ".medium.com"})
-        driver.add_cookie({"name": "uid", "value": uid_cookie, "domain": ".medium.com"})
-        
-        print("--- 3. الانتقال إلى محرر المقالات...")
-        driver.get("https://medium.com/new-story")
-        
-        wait = WebDriverWait(driver, 30)
-        
-        print("--- 4. كتابة العنوان...")
-        title_field = wait.until(EC.element_to_be_clickable(
-            (By.CSS_SELECTOR, 'h3[data-testid="editorTitleParagraph"]')
-        ))
-        title_field.click()
-        title_field.send_keys(final_title)
-        
-        print("--- 5. إدراج المحتوى مع الصور وCTAs...")
-        story_field = wait.until(EC.element_to_be_clickable(
-            (By.CSS_SELECTOR, 'p[data-testid="editorParagraphText"]')
-        ))
-        story_field.click()
-        
-        js_script = """
-        const html = arguments[0];
-        const blob = new Blob([html], { type: 'text/html' });
-        const item = new ClipboardItem({ 'text/html': blob });
-        navigator.clipboard.write([item]);
-        """
-        driver.execute_script(js_script, full_html_content)
-        story_field.send_keys(Keys.CONTROL, 'v')
-        
-        print("--- ⏳ انتظار رفع الصور...")
-        time.sleep(12)
-        
-        # حفظ لقطة شاشة للمحتوى
-        driver.save_screenshot("content_ready.png")
-        print("    📸 تم حفظ لقطة شاشة للمحتوى")
-        
-        print("--- 6. بدء النشر (فتح نافذة الخيارات)...")
-        publish_button = wait.until(EC.element_to_be_clickable(
-            (By.CSS_SELECTOR, 'button[data-action="show-prepublish"]')
-        ))
-        publish_button.click()
-        
-        # انتظار ظهور نافذة النشر
-        time.sleep(3)
-        
-        # حفظ لقطة شاشة لنافذة النشر
-        driver.save_screenshot("publish_dialog.png")
-        print("    📸 تم حفظ لقطة شاشة لنافذة النشر")
-        
-        print("--- 7. التأكد من اختيار 'النشر الفوري'...")
-        ensure_publish_now_selected(driver)
-        
-        print("--- 8. إضافة الوسوم (اختياري)...")
-        tags_added = add_tags_safely(driver, wait, ai_tags)
-        if not tags_added:
-            print("    ℹ️ متابعة بدون وسوم - لا يؤثر على النشر")
-        
-        # النشر النهائي بمحاولات محسّنة
-        print("--- 9. النشر النهائي...")
-        publish_result = publish_with_optimized_attempts(driver, wait)
-        
-        print("--- 10. انتظار معالجة النشر...")
-        time.sleep(20)  # انتظار أطول للتأكد من إتمام العملية
-        
-        # حفظ لقطة شاشة نهائية
-        driver.save_screenshot("final_result.png")
-        print("    📸 تم حفظ لقطة شاشة نهائية")
-        
-        # التحقق من نجاح النشر
-        current_url = driver.current_url
-        if "published" in current_url or "@" in current_url or "/p/" in current_url:
-            print(f"--- ✅✅✅ تأكيد: تم النشر بنجاح! URL: {current_url}")
+        for post in posts:
+            site = sites_by_name[post.get("site", DEFAULT_SITE["name"])]
+            print(f"--- 📤 من الطابور: {post['title']}")
+            if TEST_MODE:
+                print("🧪 وضع الاختبار: توقف قبل النشر الفعلي (المقال يبقى في الطابور)")
+                print(f"    🌐 الموقع: {site['domain']}")
+                print(f"    🏷️ الوسوم: {post['tags']}")
+                continue
             
-            # تسجيل الإحصائيات
-            log_success_stats(final_title, current_url)
-        
-        add_posted_link(post_to_publish.link)
-        print(f">>> 🎉🎉🎉 تم نشر المقال بنجاح على {SITE_DOMAIN}! 🎉🎉🎉")
-        
-    except Exception as e:
-        print(f"!!! حدث خطأ فادح أثناء عملية النشر: {e}")
-        driver.save_screenshot("error_screenshot.png")
-        with open("error_page_source.html", "w", encoding="utf-8") as f:
-            f.write(driver.page_source)
-        print("--- تم حفظ لقطة الشاشة وHTML للمراجعة")
+            # يُسجَّل قبل البدء حتى لا يُعاد نشر مقال انقطع تشغيله في منتصف النشر
+            update_article_state(post["link"], "publishing", site=site)
+            if publish_post(post, credentials, site):
+                published_count += 1
+    finally:
+        close_resources()
+    
+    if TEST_MODE:
+        return "test_mode"
+    
+    print(f"📦 تم نشر {published_count} من {len(posts)} مقال من الطابور - المتبقي {count_queued_posts()}")
+    trace_annotate_run(published=published_count)
+    if published_count == len(posts):
+        return "published"
+    return "partial" if published_count else "failed"
+
+def run_pipeline(args):
+    """تشغيل السلسلة كاملة وإرجاع نتيجة التشغيل لسجل التتبع"""
+    global _browser_prewarm
+    from concurrent.futures import ThreadPoolExecutor
+    
+    sites = select_sites(args)
+    # مقال انقطع نشره في تشغيل سابق لا يُختار من الخلاصة من جديد
+    recover_interrupted_publishes()
+    posts_to_publish = fetch_all_posts(sites, args.max_posts)
+    
+    trace_annotate_run(sites=len(sites), posts=len(posts_to_publish))
+    if not posts_to_publish:
+        print(">>> النتيجة: لا توجد مقالات جديدة.")
+        return "nothing_new"
+    
+    credentials = get_publish_credentials()
+    
+    if not TEST_MODE and not available_publishers(credentials):
+        print("!!! خطأ: لم يتم العثور على الكوكيز أو رمز التكامل لأي واجهة نشر.")
+        return "missing_cookies"
+    # Chrome يُشغَّل مسبقاً فقط إذا كان المحرر هو واجهة النشر الأولى
+    _browser_prewarm = available_publishers(credentials)[:1] == ["browser"]
+    
+    published_count = 0
+    workers = max(1, min(args.workers, len(posts_to_publish)))
+    print(f"--- 📦 وضع الدفعات: {len(posts_to_publish)} مقال بـ {workers} عامل تجهيز")
+    
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # التجهيز يعمل بالتوازي، والنشر يستهلك النتائج واحدة تلو الأخرى بترتيب الخلاصة
+            futures = [(site, executor.submit(prepare_post, entry, site)) for site, entry in posts_to_publish]
+            
+            for site, future in futures:
+                try:
+                    post = future.result()
+                except Exception as e:
+                    print(f"!!! فشل تجهيز المقال ({site['name']}): {e}")
+                    continue
+                
+                # في وضع الاختبار، نتوقف قبل النشر
+                if TEST_MODE:
+                    print("🧪 وضع الاختبار: توقف قبل النشر الفعلي")
+                    print(f"    🌐 الموقع: {site['domain']}")
+                    print(f"    📝 العنوان: {post['title']}")
+                    print(f"    🏷️ الوسوم: {post['tags']}")
+                    continue
+                
+                # يُسجَّل قبل البدء حتى لا يُعاد نشر مقال انقطع تشغيله في منتصف النشر
+                update_article_state(post["link"], "publishing", site=site)
+                if publish_post(post, credentials, site):
+                    published_count += 1
     finally:
-        driver.quit()
-        print("--- تم إغلاق الروبوت ---")
+        close_resources()
+    
+    if TEST_MODE:
+        return "test_mode"
+    
+    print(f"📦 تم نشر {published_count} من {len(posts_to_publish)} مقال في هذا التشغيل")
+    trace_annotate_run(published=published_count)
+    if published_count == len(posts_to_publish):
+        return "published"
+    return "partial" if published_count else "failed"
 
 if __name__ == "__main__":
     main()
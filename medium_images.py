@@ -0,0 +1,141 @@
+"""رفع صور المقال إلى Medium مسبقاً (POST /v1/images) قبل اللصق أو النشر
+
+عند لصق HTML فيه صور خارجية يجلب Medium كل صورة من موقع المصدر ويعيد
+استضافتها، وجاهزية النشر تتوقف على سرعة خادم صور الموقع. الرفع المسبق يتم
+بالتوازي مع إعادة الكتابة بـ Gemini، ثم يشير HTML إلى روابط Medium مباشرة.
+
+الروابط المرفوعة تُحفظ في كاش الصور (images.db) بمفتاح الرابط المُطبَّع،
+فنفس الصورة لا تُرفع مرتين عبر التشغيلات.
+"""
+import io
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from image_probe import HASH_MAX_BYTES, PROBE_USER_AGENT, Image, normalize_image_url, parse_image_header
+
+# الصيغ التي يقبلها /v1/images كما هي - WebP يُحوَّل إلى JPEG عند توفر Pillow
+UPLOAD_CONTENT_TYPES = {"jpeg": "image/jpeg", "png": "image/png", "gif": "image/gif"}
+UPLOAD_TIMEOUT = (5, 60)
+
+class ImageUploadError(Exception):
+    """تعذر رفع صورة (تنزيل المصدر أو صيغة غير مدعومة أو رفض Medium)"""
+
+def open_upload_cache(path):
+    """جدول الروابط المرفوعة داخل كاش الصور"""
+    import os
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS medium_uploads (
+            url_key TEXT PRIMARY KEY,
+            medium_url TEXT NOT NULL,
+            uploaded_at REAL NOT NULL
+        )
+    """)
+    return conn
+
+def load_uploaded(conn, urls):
+    uploaded = {}
+    for url in urls:
+        row = conn.execute(
+            "SELECT medium_url FROM medium_uploads WHERE url_key = ?", (normalize_image_url(url),)
+        ).fetchone()
+        if row:
+            uploaded[url] = row[0]
+    return uploaded
+
+def store_uploaded(conn, uploaded):
+    now = time.time()
+    conn.executemany(
+        "INSERT OR REPLACE INTO medium_uploads (url_key, medium_url, uploaded_at) VALUES (?, ?, ?)",
+        [(normalize_image_url(url), medium_url, now) for url, medium_url in uploaded.items()]
+    )
+    conn.commit()
+
+def download_image(url, session, timeout):
+    """تنزيل الصورة كاملة - يرجع (البايتات، الصيغة)"""
+    response = session.get(url, headers={"User-Agent": PROBE_USER_AGENT}, timeout=timeout, stream=True)
+    with response:
+        if response.status_code != 200:
+            raise ImageUploadError(f"source HTTP {response.status_code}")
+        data = b""
+        for chunk in response.iter_content(65536):
+            data += chunk
+            if len(data) > HASH_MAX_BYTES:
+                raise ImageUploadError(f"source larger than {HASH_MAX_BYTES} bytes")
+    image_format, _, _ = parse_image_header(data)
+    return data, image_format
+
+def to_uploadable(data, image_format):
+    """(البايتات، نوع المحتوى) بصيغة يقبلها Medium"""
+    if image_format in UPLOAD_CONTENT_TYPES:
+        return data, UPLOAD_CONTENT_TYPES[image_format]
+    if image_format == "webp" and Image is not None:
+        output = io.BytesIO()
+        Image.open(io.BytesIO(data)).convert("RGB").save(output, "JPEG", quality=90)
+        return output.getvalue(), "image/jpeg"
+    raise ImageUploadError(f"unsupported format for upload: {image_format}")
+
+def upload_image(url, token, api_base, session=None, timeout=UPLOAD_TIMEOUT):
+    """رفع صورة واحدة من رابطها - يرجع رابطها على Medium"""
+    http = session or requests
+    data, image_format = download_image(url, http, timeout)
+    body, content_type = to_uploadable(data, image_format)
+    extension = content_type.split("/")[1]
+
+    response = http.post(
+        f"{api_base}/v1/images",
+        headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
+        files={"image": (f"image.{extension}", body, content_type)},
+        timeout=timeout
+    )
+    if response.status_code not in (200, 201):
+        raise ImageUploadError(f"Medium HTTP {response.status_code}: {response.text[:200]}")
+    return response.json()["data"]["url"]
+
+def upload_images(urls, token, api_base, session=None, cache_path=None, max_workers=4, timeout=UPLOAD_TIMEOUT):
+    """رفع عدة صور بالتوازي - يرجع {الرابط الأصلي: رابط Medium} للصور التي نجح رفعها
+
+    الفشل لا يرفع استثناء: الصورة تبقى برابطها الأصلي ويجلبها Medium كالمعتاد.
+    """
+    urls = list(dict.fromkeys(url for url in urls if url))
+    uploaded = {}
+    if cache_path:
+        conn = open_upload_cache(cache_path)
+        try:
+            uploaded = load_uploaded(conn, urls)
+        finally:
+            conn.close()
+
+    pending = [url for url in urls if url not in uploaded]
+    if pending:
+        def upload(url):
+            try:
+                return url, upload_image(url, token, api_base, session, timeout), None
+            except (ImageUploadError, requests.RequestException, OSError, ValueError, KeyError) as e:
+                return url, None, e
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+            results = list(executor.map(upload, pending))
+
+        fresh = {}
+        for url, medium_url, error in results:
+            if medium_url:
+                fresh[url] = medium_url
+            else:
+                print(f"    ⚠️ تعذر رفع الصورة إلى Medium ({url[:60]}...): {str(error)[:100]}")
+        uploaded.update(fresh)
+        if cache_path and fresh:
+            conn = open_upload_cache(cache_path)
+            try:
+                store_uploaded(conn, fresh)
+            finally:
+                conn.close()
+
+    return uploaded
@@ -0,0 +1,196 @@
+"""توجيه طلبات Gemini بين عدة نماذج: تحوّط (hedging) وتدرّج (tiers)
+
+- التحوّط: إن تجاوز النموذج الأول نسبة مئوية من زمنه المعتاد (p90 افتراضياً)
+  يُرسل طلب مكرر إلى النموذج التالي، وأول رد صالح يفوز ويُلغى الآخر.
+- التدرّج: عند نفاد الحصة (429) أو فشل الخادم ننتقل إلى النموذج التالي في
+  القائمة بدل انتظار إعادة المحاولات.
+- إحصاءات لكل نموذج (آخر الأزمنة، النجاح، الفشل، نفاد الحصة، مرات الفوز
+  بالتحوّط، الطلبات الملغاة) تُحفظ على القرص، فيتكيف حد التحوّط مع الزمن عبر التشغيلات.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+
+from gemini_client import GeminiError
+
+# أخطاء تستحق الانتقال إلى النموذج التالي: نفاد الحصة وأعطال الخادم والشبكة
+FALLTHROUGH_STATUSES = {None, 429, 500, 502, 503, 504}
+
+class ModelStats:
+    """أزمنة ونتائج نموذج واحد (نافذة منزلقة لآخر window طلب)"""
+
+    def __init__(self, latencies=None, success=0, failure=0, quota=0, hedge_wins=0, cancelled=0, window=50):
+        self.latencies = list(latencies or [])[-window:]
+        self.success = success
+        self.failure = failure
+        self.quota = quota
+        self.hedge_wins = hedge_wins
+        # طلبات أُلغيت قبل اكتمالها - زمنها الحقيقي مجهول فلا يدخل في النسب المئوية
+        self.cancelled = cancelled
+        self.window = window
+
+    def record_latency(self, seconds):
+        self.latencies.append(round(seconds, 3))
+        del self.latencies[:-self.window]
+
+    def percentile(self, percent):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def to_dict(self):
+        return {
+            "latencies": self.latencies, "success": self.success, "failure": self.failure,
+            "quota": self.quota, "hedge_wins": self.hedge_wins, "cancelled": self.cancelled,
+        }
+
+class ModelRouter:
+    """موجّه فوق GeminiClient - models بالترتيب: الأساسي أولاً ثم البدائل"""
+
+    def __init__(self, client, models, stats_file=None, hedge_percentile=90, hedge_default_seconds=30.0, min_samples=5):
+        self.client = client
+        self.models = list(dict.fromkeys(models))
+        self.stats_file = stats_file
+        self.hedge_percentile = hedge_percentile
+        self.hedge_default_seconds = hedge_default_seconds
+        self.min_samples = min_samples
+        self.stats = {model: ModelStats() for model in self.models}
+        self._stats_lock = threading.Lock()
+        self._load_stats()
+
+    def _load_stats(self):
+        if not self.stats_file or not os.path.exists(self.stats_file):
+            return
+        try:
+            with open(self.stats_file, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for model, data in saved.items():
+            if model in self.stats:
+                self.stats[model] = ModelStats(**data)
+
+    def save_stats(self):
+        if not self.stats_file:
+            return
+        with self._stats_lock:
+            snapshot = {model: stats.to_dict() for model, stats in self.stats.items()}
+        directory = os.path.dirname(self.stats_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_file = f"{self.stats_file}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(temp_file, self.stats_file)
+
+    def hedge_threshold(self, model):
+        """ثواني الانتظار قبل التحوّط: النسبة المئوية من الأزمنة الأخيرة، أو القيمة الافتراضية"""
+        stats = self.stats[model]
+        if len(stats.latencies) < self.min_samples:
+            return self.hedge_default_seconds
+        return stats.percentile(self.hedge_percentile)
+
+    async def _call(self, model, body, stream, on_field, retry_on_quota, stop):
+        """طلب واحد لنموذج واحد مع تسجيل الزمن والنتيجة"""
+        started = time.monotonic()
+        try:
+            if stream:
+                payload, attempts = await self.client.generate_stream(
+                    model, body, on_field, retry_on_quota=retry_on_quota, stop=stop
+                )
+            else:
+                payload, attempts = await self.client.generate(model, body, retry_on_quota=retry_on_quota)
+        except asyncio.CancelledError:
+            # الزمن حتى الإلغاء أقصر من الزمن الفعلي، وتسجيله يخفض p90 فيتحوّط أبكر في كل مرة
+            with self._stats_lock:
+                self.stats[model].cancelled += 1
+            raise
+        except GeminiError as e:
+            with self._stats_lock:
+                self.stats[model].failure += 1
+                if e.status == 429:
+                    self.stats[model].quota += 1
+            raise
+
+        with self._stats_lock:
+            self.stats[model].success += 1
+            self.stats[model].record_latency(time.monotonic() - started)
+        return payload, attempts
+
+    async def _hedged(self, primary, backup, body, stream, on_field, is_valid, retry_on_quota):
+        """النموذج الأساسي، ثم نسخة تحوّط إلى backup إن تأخر - أول رد صالح يفوز"""
+        stops = {}
+        tasks = {}
+
+        def start(model):
+            stops[model] = threading.Event()
+            task = asyncio.create_task(self._call(model, body, stream, on_field, retry_on_quota, stops[model]))
+            tasks[task] = model
+
+        start(primary)
+        threshold = self.hedge_threshold(primary)
+        done, pending = await asyncio.wait(set(tasks), timeout=threshold)
+        if not done and backup:
+            print(f"    🪁 {primary} تجاوز {threshold:.1f}s - إرسال طلب تحوّط إلى {backup}")
+            start(backup)
+            pending = {task for task in tasks if not task.done()}
+
+        fallback = None
+        last_error = None
+        while pending or done:
+            if not done:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                model = tasks[task]
+                try:
+                    payload, attempts = task.result()
+                except GeminiError as e:
+                    last_error = e
+                    continue
+                meta = {"model": model, "attempts": attempts, "hedged": len(tasks) > 1}
+                if is_valid(payload):
+                    for other in pending:
+                        stops[tasks[other]].set()
+                        other.cancel()
+                    if model != primary:
+                        with self._stats_lock:
+                            self.stats[model].hedge_wins += 1
+                    return payload, meta
+                fallback = fallback or (payload, meta)
+            done = set()
+
+        if fallback:
+            return fallback
+        raise last_error
+
+    async def generate(self, body, stream=False, on_field=None, is_valid=None):
+        """توجيه طلب واحد - يرجع (JSON الرد، {"model", "attempts", "hedged"})"""
+        is_valid = is_valid or (lambda payload: True)
+        emitted = set()
+
+        def field_once(key, value):
+            # النسختان المتحوّطتان تبثان نفس الحقول، فنمررها مرة واحدة
+            if on_field and key not in emitted:
+                emitted.add(key)
+                on_field(key, value)
+
+        tiers = list(self.models)
+        while True:
+            primary = tiers[0]
+            backup = tiers[1] if len(tiers) > 1 else None
+            try:
+                return await self._hedged(
+                    primary, backup, body, stream, field_once, is_valid, retry_on_quota=backup is None
+                )
+            except GeminiError as e:
+                if e.status not in FALLTHROUGH_STATUSES or backup is None:
+                    raise
+                print(f"    ⤵️ {primary} فشل ({e}) - الانتقال إلى {backup}")
+                tiers = tiers[1:]
+
+    def generate_sync(self, body, stream=False, on_field=None, is_valid=None):
+        return self.client.run_sync(self.generate(body, stream, on_field, is_valid))
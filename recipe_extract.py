@@ -0,0 +1,199 @@
+"""استخراج محتوى الوصفة لطلب Gemini ضمن ميزانية رموز
+
+الترتيب: بيانات schema.org Recipe من JSON-LD (المكونات والخطوات والأزمنة
+والكمية)، ثم استخراج المحتوى الرئيسي بأسلوب readability، ثم نص RSS كاحتياط.
+الناتج ملخص مضغوط لا يتجاوز max_tokens (تقدير 4 أحرف لكل رمز، نفس تقدير
+gemini_client) مع تقديم المكونات والخطوات على الوصف.
+"""
+import json
+import re
+
+CHARS_PER_TOKEN = 4
+
+# عناصر لا تحمل محتوى المقال
+BOILERPLATE_TAGS = ["script", "style", "noscript", "nav", "header", "footer", "aside", "form", "iframe", "svg", "button"]
+BOILERPLATE_HINTS = re.compile(r"comment|share|social|related|newsletter|subscribe|sidebar|widget|advert|promo|breadcrumb|jump|print", re.IGNORECASE)
+ISO_DURATION = re.compile(r"^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:\d+S)?)?$", re.IGNORECASE)
+
+def count_tokens(text):
+    """تقدير عدد الرموز بدون محلل رموز (Gemini يقارب 4 أحرف للرمز في الإنجليزية)"""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def collapse_whitespace(text):
+    return re.sub(r"\s+", " ", text or "").strip()
+
+def html_to_text(html):
+    """نص مقروء من HTML صغير (خطوات JSON-LD أو محتوى RSS)"""
+    return collapse_whitespace(re.sub(r"<[^>]+>", " ", html or ""))
+
+def format_duration(value):
+    """PT1H30M -> 1 h 30 min"""
+    match = ISO_DURATION.match(str(value or "").strip())
+    if not match or not any(match.groups()):
+        return collapse_whitespace(str(value or ""))
+    days, hours, minutes = (int(group) if group else 0 for group in match.groups())
+    hours += days * 24
+    parts = []
+    if hours:
+        parts.append(f"{hours} h")
+    if minutes:
+        parts.append(f"{minutes} min")
+    return " ".join(parts)
+
+def is_recipe_node(node):
+    node_type = node.get("@type")
+    types = node_type if isinstance(node_type, list) else [node_type]
+    return "Recipe" in types
+
+def find_recipe_node(data):
+    """البحث عن عقدة Recipe داخل JSON-LD (قوائم و@graph متداخلة)"""
+    if isinstance(data, list):
+        for item in data:
+            found = find_recipe_node(item)
+            if found:
+                return found
+    elif isinstance(data, dict):
+        if is_recipe_node(data):
+            return data
+        for key in ("@graph", "mainEntity", "itemListElement"):
+            if key in data:
+                found = find_recipe_node(data[key])
+                if found:
+                    return found
+    return None
+
+def flatten_instructions(instructions):
+    """recipeInstructions قد تكون نصاً أو قائمة نصوص أو HowToStep أو HowToSection"""
+    if isinstance(instructions, str):
+        text = html_to_text(instructions)
+        return [step.strip() for step in re.split(r"(?<=[.!?])\s+(?=[A-Z])", text) if step.strip()]
+    steps = []
+    for item in instructions or []:
+        if isinstance(item, str):
+            steps.append(html_to_text(item))
+        elif isinstance(item, dict):
+            if "itemListElement" in item:
+                steps.extend(flatten_instructions(item["itemListElement"]))
+            elif item.get("text") or item.get("name"):
+                steps.append(html_to_text(item.get("text") or item.get("name")))
+    return [step for step in steps if step]
+
+def as_text_list(value):
+    if isinstance(value, str):
+        return [collapse_whitespace(value)]
+    if isinstance(value, list):
+        return [collapse_whitespace(str(item)) for item in value if item]
+    return []
+
+def extract_jsonld_recipe(soup):
+    """أقسام الملخص من schema.org Recipe، أو None إن لم توجد"""
+    for script in soup.find_all("script", type="application/ld+json"):
+        try:
+            data = json.loads(script.string or script.get_text() or "")
+        except ValueError:
+            continue
+        recipe = find_recipe_node(data)
+        if not recipe:
+            continue
+
+        facts = []
+        for label, key in (("Prep", "prepTime"), ("Cook", "cookTime"), ("Total", "totalTime")):
+            if recipe.get(key):
+                facts.append(f"{label}: {format_duration(recipe[key])}")
+        recipe_yield = as_text_list(recipe.get("recipeYield"))
+        if recipe_yield:
+            facts.append(f"Yield: {recipe_yield[0]}")
+        for label, key in (("Category", "recipeCategory"), ("Cuisine", "recipeCuisine")):
+            values = as_text_list(recipe.get(key))
+            if values:
+                facts.append(f"{label}: {', '.join(values)}")
+
+        ingredients = as_text_list(recipe.get("recipeIngredient") or recipe.get("ingredients"))
+        steps = flatten_instructions(recipe.get("recipeInstructions"))
+        if not ingredients and not steps:
+            continue
+        return {
+            "facts": "; ".join(facts),
+            "ingredients": ingredients,
+            "steps": steps,
+            "description": html_to_text(recipe.get("description", "")),
+        }
+    return None
+
+def extract_main_text(soup, selectors):
+    """استخراج بأسلوب readability: الحاوية الرئيسية بدون القوائم والتعليقات والإعلانات"""
+    for tag in soup.find_all(BOILERPLATE_TAGS):
+        tag.decompose()
+    for tag in soup.find_all(True):
+        if tag.decomposed:
+            continue
+        hints = " ".join(tag.get("class") or []) + " " + (tag.get("id") or "")
+        if hints.strip() and BOILERPLATE_HINTS.search(hints) and tag.name not in ("body", "html", "article", "main"):
+            tag.decompose()
+
+    container = None
+    for selector in selectors:
+        container = soup.select_one(selector)
+        if container:
+            break
+    if container is None:
+        # أكثر عنصر يحتوي فقرات نصية
+        candidates = soup.find_all(["div", "section", "article", "main"])
+        container = max(
+            candidates,
+            key=lambda element: sum(len(p.get_text(" ", strip=True)) for p in element.find_all("p", recursive=False)),
+            default=soup.body or soup
+        )
+
+    blocks = []
+    for element in container.find_all(["h2", "h3", "p", "li"]):
+        text = collapse_whitespace(element.get_text(" ", strip=True))
+        if len(text) >= 20 or element.name in ("h2", "h3", "li"):
+            if text and (not blocks or blocks[-1] != text):
+                blocks.append(text)
+    return blocks
+
+def fit_to_budget(lines, max_tokens):
+    """إضافة الأسطر بالترتيب حتى الميزانية، وقص آخر سطر على حدود كلمة"""
+    output = []
+    used = 0
+    for line in lines:
+        cost = count_tokens(line) + 1
+        if used + cost <= max_tokens:
+            output.append(line)
+            used += cost
+            continue
+        remaining_chars = (max_tokens - used - 1) * CHARS_PER_TOKEN
+        if remaining_chars > 40:
+            output.append(line[:remaining_chars].rsplit(" ", 1)[0] + "…")
+        break
+    return "\n".join(output)
+
+def build_recipe_summary(recipe, max_tokens):
+    """المكونات والخطوات أولاً لأنها جوهر المقال، ثم الوصف إن بقي مكان"""
+    lines = []
+    if recipe["facts"]:
+        lines.append(recipe["facts"])
+    if recipe["ingredients"]:
+        lines.append("Ingredients: " + "; ".join(recipe["ingredients"]))
+    for number, step in enumerate(recipe["steps"], 1):
+        lines.append(f"{number}. {step}")
+    if recipe["description"]:
+        lines.append("About: " + recipe["description"])
+    return fit_to_budget(lines, max_tokens)
+
+def summarize_recipe_content(page_html, fallback_html, max_tokens, selectors=("article", "main")):
+    """ملخص مضغوط للمقال - يرجع (النص، المصدر) والمصدر: jsonld أو readability أو rss"""
+    if page_html:
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(page_html, "html.parser")
+
+        recipe = extract_jsonld_recipe(soup)
+        if recipe:
+            return build_recipe_summary(recipe, max_tokens), "jsonld"
+
+        blocks = extract_main_text(soup, selectors)
+        if sum(len(block) for block in blocks) >= 200:
+            return fit_to_budget(blocks, max_tokens), "readability"
+
+    return fit_to_budget([html_to_text(fallback_html)], max_tokens), "rss"